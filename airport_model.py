@@ -0,0 +1,112 @@
+import csv
+import io
+import re
+
+import numpy as np
+
+from board_eval import parse_coord, parse_runway_data, RWY_COLUMNS, PROC_COLUMNS
+from procedure_index import procedure_index
+
+# --- CONFIGURAZIONE ---
+ICAO_COLUMN, NAME_COLUMN, COORD_COLUMN = 'ICAO', 'Name', 'coord'
+RE_ICAO = re.compile(r'^[A-Z0-9]{4}$')
+
+
+# --- AEROPORTO (RECORD IMMUTABILE, COSTRUITO UNA VOLTA PER VERSIONE DEL CSV) ---
+
+class Airport:
+    __slots__ = ('icao', 'name', 'lat', 'lon', 'true_headings', 'magnetic_headings', 'procedures', 'signature')
+
+    def __init__(self, icao, name, lat, lon, true_headings, magnetic_headings, procedures, signature):
+        self.icao = icao
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.true_headings = true_headings          # tuple di prue vere, una per pista
+        self.magnetic_headings = magnetic_headings  # stesse piste, prue magnetiche
+        self.procedures = procedures                # ProcedureIndex (minime ordinate)
+        self.signature = signature                  # campi grezzi della riga: entra nelle firme delle cache
+
+    @property
+    def has_position(self):
+        return self.lat is not None
+
+    def __repr__(self):
+        return f"Airport({self.icao!r}, {self.name!r})"
+
+
+class AirportTable:
+    __slots__ = ('airports', 'by_icao', 'icaos', 'home_base', 'lats', 'lons', 'problems')
+
+    def __init__(self, airports, problems=()):
+        self.airports = tuple(airports)  # ordine del CSV
+        self.by_icao = {a.icao: a for a in self.airports}
+        self.icaos = tuple(self.by_icao)
+        # Prima base con coordinate: e' la base di partenza, esclusa dalla logica alternato
+        self.home_base = next((a.icao for a in self.airports if a.has_position), None)
+        self.lats = np.array([a.lat if a.has_position else np.nan for a in self.airports], dtype=float)
+        self.lons = np.array([a.lon if a.has_position else np.nan for a in self.airports], dtype=float)
+        self.problems = tuple(problems)
+
+    def __iter__(self):
+        return iter(self.airports)
+
+    def __len__(self):
+        return len(self.airports)
+
+    def __contains__(self, icao):
+        return icao in self.by_icao
+
+    def __getitem__(self, icao):
+        return self.by_icao[icao]
+
+    def get(self, icao, default=None):
+        return self.by_icao.get(icao, default)
+
+    def stations(self):
+        # [(ICAO, lat, lon)] delle basi con coordinate (effemeridi, fulmini, indice spaziale)
+        return [(a.icao, a.lat, a.lon) for a in self.airports if a.has_position]
+
+
+# --- CARICAMENTO E VALIDAZIONE DEL CSV (SENZA PANDAS) ---
+
+def _column(columns, candidates):
+    return next((columns[c] for c in candidates if c in columns), None)
+
+def parse_airport_table(text):
+    # Colonne mancanti = errore; righe non valide scartate e riportate in `problems`
+    reader = csv.reader(io.StringIO(text.lstrip('\ufeff')), skipinitialspace=True)
+    header = [h.strip() for h in next(reader, [])]
+    columns = {name: i for i, name in enumerate(header)}
+    icao_col, name_col = columns.get(ICAO_COLUMN), columns.get(NAME_COLUMN)
+    rwy_col, proc_col, coord_col = _column(columns, RWY_COLUMNS), _column(columns, PROC_COLUMNS), columns.get(COORD_COLUMN)
+    missing = [name for name, col in ((ICAO_COLUMN, icao_col), (NAME_COLUMN, name_col), (RWY_COLUMNS[0], rwy_col),
+                                      (PROC_COLUMNS[0], proc_col)) if col is None]
+    if missing:
+        raise ValueError(f"Colonne mancanti nel CSV aeroporti: {', '.join(missing)} (presenti: {', '.join(header)})")
+
+    airports, problems, seen = [], [], set()
+    for line, fields in enumerate(reader, start=2):
+        if not any(f.strip() for f in fields):
+            continue
+        fields += [''] * (len(header) - len(fields))
+        icao = fields[icao_col].strip().upper()
+        if not RE_ICAO.match(icao):
+            problems.append(f"riga {line}: ICAO non valido {fields[icao_col]!r}")
+            continue
+        if icao in seen:
+            problems.append(f"riga {line}: {icao} duplicato, tenuta la prima riga")
+            continue
+        seen.add(icao)
+        runways = fields[rwy_col].strip()
+        true_hdgs, magn_hdgs = parse_runway_data(runways)
+        if runways and not true_hdgs:
+            problems.append(f"riga {line}: {icao} piste non riconosciute {runways!r}")
+        coord = fields[coord_col].strip() if coord_col is not None else ''
+        lat, lon = parse_coord(coord)
+        if coord and lat is None:
+            problems.append(f"riga {line}: {icao} coordinate non valide {coord!r}")
+        procedures = procedure_index(fields[proc_col].strip() or None)
+        airports.append(Airport(icao, fields[name_col].strip(), lat, lon, tuple(true_hdgs), tuple(magn_hdgs),
+                                procedures, '|'.join(f.strip() for f in fields)))
+    return AirportTable(airports, problems)
@@ -0,0 +1,104 @@
+from datetime import timedelta
+from functools import lru_cache
+
+import numpy as np
+
+from board_eval import alternate_requirements, has_report
+from report_parser import parse_weather_conditions
+from taf_timeline import get_timeline, HOUR
+from weather_fetch import get_weather_bulk
+
+# --- CONFIGURAZIONE ---
+EARTH_RADIUS_NM = 3440.065
+NM_PER_DEG_LAT = 60.0
+DEFAULT_RADIUS_NM = 250
+MAX_SHORTLIST = 10
+
+
+# --- INDICE SPAZIALE: BANDA DI LATITUDINE + HAVERSINE VETTORIALE ---
+
+def haversine_nm(lat, lon, lats, lons):
+    lat, lon, lats, lons = np.radians(lat), np.radians(lon), np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_NM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class SpatialIndex:
+    __slots__ = ('icaos', 'lats', 'lons', 'positions')
+
+    def __init__(self, stations):
+        # stations: [(ICAO, lat, lon)], ordinate per latitudine per il prefiltro con searchsorted
+        stations = sorted(stations, key=lambda s: s[1])
+        self.icaos = np.array([s[0] for s in stations], dtype=object)
+        self.lats = np.array([s[1] for s in stations], dtype=float)
+        self.lons = np.array([s[2] for s in stations], dtype=float)
+        self.positions = {s[0]: (s[1], s[2]) for s in stations}
+
+    def __len__(self):
+        return len(self.icaos)
+
+    def query(self, lat, lon, radius_nm):
+        # Solo la banda di latitudine compatibile con il raggio passa alla haversine; risultato ordinato per distanza
+        band = radius_nm / NM_PER_DEG_LAT
+        first = np.searchsorted(self.lats, lat - band, side='left')
+        last = np.searchsorted(self.lats, lat + band, side='right')
+        distances = haversine_nm(lat, lon, self.lats[first:last], self.lons[first:last])
+        inside = np.nonzero(distances <= radius_nm)[0]
+        order = inside[np.argsort(distances[inside], kind='stable')]
+        return [(self.icaos[first + i], float(distances[i])) for i in order]
+
+@lru_cache(maxsize=8)
+def spatial_index(stations):
+    return SpatialIndex(stations)
+
+
+# --- PIANIFICATORE ---
+
+class AlternatePlanner:
+    def __init__(self, airports, fetch=get_weather_bulk):
+        # airports: AirportTable (o iterabile di Airport)
+        self.airports = {airport.icao: airport for airport in airports}
+        self.index = spatial_index(tuple((a.icao, a.lat, a.lon) for a in self.airports.values() if a.has_position))
+        self.fetch = fetch
+
+    def candidates(self, destination, radius_nm=DEFAULT_RADIUS_NM, limit=MAX_SHORTLIST):
+        position = self.index.positions.get(destination)
+        if position is None:
+            return []
+        shortlist = []
+        for icao, distance in self.index.query(*position, radius_nm):
+            # Senza procedure non c'e' requisito alternato: non vale la pena scaricarne il meteo
+            if icao == destination or not self.airports[icao].procedures:
+                continue
+            shortlist.append((icao, distance))
+            if len(shortlist) >= limit:
+                break
+        return shortlist
+
+    def evaluate(self, icao, distance, metar, taf, eta_start, eta_end):
+        airport = self.airports[icao]
+        min_proc, vis_req, ceil_req = alternate_requirements(airport.procedures)
+        metar_vis, metar_ceil = parse_weather_conditions(metar)
+        result = {'icao': icao, 'name': airport.name, 'distance_nm': round(distance, 1),
+                  'procedure': min_proc['proc'], 'vis_req': vis_req, 'ceil_req': ceil_req,
+                  'metar_ok': metar_vis >= vis_req and metar_ceil >= ceil_req if has_report(metar) else None,
+                  'taf_covers_window': False, 'taf_valid': False, 'hours_ok': 0, 'hours_total': 0}
+        timeline = get_timeline(icao, taf) if has_report(taf) else None
+        if timeline is None:
+            return result
+        hours = timeline.window(eta_start, eta_end)
+        hourly_ok = timeline.hourly_alternate(vis_req, ceil_req)[hours]
+        # Il TAF deve coprire tutta la finestra ETA, altrimenti l'alternato non e' pianificabile
+        covers = timeline.start <= eta_start and timeline.start + timeline.n_hours * HOUR >= eta_end
+        result.update({'taf_covers_window': covers, 'taf_valid': bool(covers and len(hourly_ok) and hourly_ok.all()),
+                       'hours_ok': int(hourly_ok.sum()), 'hours_total': len(hourly_ok)})
+        return result
+
+    def plan(self, destination, eta_start, eta_end=None, radius_nm=DEFAULT_RADIUS_NM, limit=MAX_SHORTLIST):
+        eta_end = eta_end or eta_start + timedelta(hours=1)
+        shortlist = self.candidates(destination, radius_nm, limit)
+        weather = self.fetch([icao for icao, _ in shortlist]) if shortlist else {}
+        results = [self.evaluate(icao, distance, *weather[icao], eta_start, eta_end) for icao, distance in shortlist]
+        # Prima gli alternati validi su tutta la finestra, poi per ore valide e distanza
+        results.sort(key=lambda r: (not r['taf_valid'], -r['hours_ok'], r['distance_nm']))
+        return results
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import metrics
+from shared_cache import get_shared_cache
+
+# --- CONFIGURAZIONE ---
+STEP_MINUTES = 5
+SUN_ALTITUDE = -0.833  # rifrazione + semidiametro
+MOON_PARALLAX_FACTOR, MOON_ALTITUDE_OFFSET = 0.7275, -0.5667  # h0 = 0.7275 * parallasse - 0.5667 (Meeus)
+MAX_MOON_MILLILUX = 250
+SHARED_RETENTION_SECONDS = 2 * 24 * 3600
+J2000 = datetime(2000, 1, 1, 12, tzinfo=timezone.utc)
+MOON_PHASES = ('New Moon', 'Waxing Crescent', 'First Quarter', 'Waxing Gibbous',
+               'Full Moon', 'Waning Gibbous', 'Last Quarter', 'Waning Crescent')
+
+
+# --- EFFEMERIDI A BASSA PRECISIONE (~0.01 deg SOLE, ~0.3 deg LUNA) ---
+
+def _days_since_j2000(times):
+    return np.array([(t - J2000).total_seconds() / 86400 for t in times])
+
+def _sind(x):
+    return np.sin(np.radians(x))
+
+def _cosd(x):
+    return np.cos(np.radians(x))
+
+def sun_ecliptic(days):
+    mean_longitude = 280.460 + 0.9856474 * days
+    anomaly = 357.528 + 0.9856003 * days
+    longitude = mean_longitude + 1.915 * _sind(anomaly) + 0.020 * _sind(2 * anomaly)
+    return longitude % 360, np.zeros_like(days)
+
+def moon_ecliptic(days):
+    # Almanacco Astronomico, formule a bassa precisione; restituisce anche la parallasse orizzontale
+    t = days / 36525
+    longitude = (218.32 + 481267.881 * t + 6.29 * _sind(135.0 + 477198.87 * t) - 1.27 * _sind(259.3 - 413335.36 * t)
+                 + 0.66 * _sind(235.7 + 890534.22 * t) + 0.21 * _sind(269.9 + 954397.74 * t)
+                 - 0.19 * _sind(357.5 + 35999.05 * t) - 0.11 * _sind(186.5 + 966404.03 * t))
+    latitude = (5.13 * _sind(93.3 + 483202.02 * t) + 0.28 * _sind(228.2 + 960400.89 * t)
+                - 0.28 * _sind(318.3 + 6003.15 * t) - 0.17 * _sind(217.6 - 407332.21 * t))
+    parallax = (0.9508 + 0.0518 * _cosd(135.0 + 477198.87 * t) + 0.0095 * _cosd(259.3 - 413335.36 * t)
+                + 0.0078 * _cosd(235.7 + 890534.22 * t) + 0.0028 * _cosd(269.9 + 954397.74 * t))
+    return longitude % 360, latitude, parallax
+
+def equatorial(days, longitude, latitude):
+    obliquity = 23.439 - 0.0000004 * days
+    declination = np.degrees(np.arcsin(_sind(latitude) * _cosd(obliquity) + _cosd(latitude) * _sind(obliquity) * _sind(longitude)))
+    right_ascension = np.degrees(np.arctan2(_sind(longitude) * _cosd(obliquity) - np.tan(np.radians(latitude)) * _sind(obliquity), _cosd(longitude)))
+    return right_ascension % 360, declination
+
+def altitudes(days, right_ascension, declination, lats, lons):
+    # (stazioni, istanti): tutte le basi in un'unica operazione
+    sidereal = (280.46061837 + 360.98564736629 * days) % 360
+    hour_angle = sidereal[None, :] + lons[:, None] - right_ascension[None, :]
+    sin_alt = _sind(lats)[:, None] * _sind(declination)[None, :] + _cosd(lats)[:, None] * _cosd(declination)[None, :] * _cosd(hour_angle)
+    return np.degrees(np.arcsin(np.clip(sin_alt, -1, 1)))
+
+
+# --- ALBA/TRAMONTO: PRIMO ATTRAVERSAMENTO DELLA QUOTA h0 NEL GIORNO UTC ---
+
+def _crossings(times, height, rising):
+    above = height >= 0
+    crossing = (~above[:, :-1] & above[:, 1:]) if rising else (above[:, :-1] & ~above[:, 1:])
+    found = crossing.any(axis=1)
+    first = crossing.argmax(axis=1)
+    rows = np.arange(len(height))
+    h0, h1 = height[rows, first], height[rows, first + 1]
+    fraction = np.where(h1 != h0, h0 / (h0 - h1), 0)
+    step = (times[1] - times[0]).total_seconds()
+    return [times[0] + timedelta(seconds=float((i + f) * step)) if ok else None for i, f, ok in zip(first, fraction, found)]
+
+def _format_time(value):
+    return value.strftime('%H:%M Z') if value is not None else "N/A"
+
+def daily_ephemeris(stations, day):
+    # stations: [(ICAO, lat, lon)] -> {ICAO: {'sunrise', 'sunset', 'moonrise', 'moonset', 'moon_phase', ...}}
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    times = [start + timedelta(minutes=m) for m in range(0, 24 * 60 + 1, STEP_MINUTES)]
+    days = _days_since_j2000(times)
+    lats = np.array([lat for _, lat, _ in stations], dtype=float)
+    lons = np.array([lon for _, _, lon in stations], dtype=float)
+    sun_lon, sun_lat = sun_ecliptic(days)
+    moon_lon, moon_lat, moon_parallax = moon_ecliptic(days)
+    sun_alt = altitudes(days, *equatorial(days, sun_lon, sun_lat), lats, lons) - SUN_ALTITUDE
+    moon_alt = altitudes(days, *equatorial(days, moon_lon, moon_lat), lats, lons) - (MOON_PARALLAX_FACTOR * moon_parallax + MOON_ALTITUDE_OFFSET)[None, :]
+    # Fase uguale per tutte le basi: elongazione Luna-Sole a 12Z e illuminazione massima del giorno
+    elongation = (moon_lon - sun_lon) % 360
+    illumination = (1 - _cosd(elongation) * _cosd(moon_lat)) / 2
+    phase = MOON_PHASES[int(((elongation[len(times) // 2] + 22.5) % 360) // 45)]
+    max_illumination = float(illumination.max())
+    events = {name: _crossings(times, height, rising) for name, height, rising in
+              (('sunrise', sun_alt, True), ('sunset', sun_alt, False), ('moonrise', moon_alt, True), ('moonset', moon_alt, False))}
+    table = {}
+    for i, (icao, _, _) in enumerate(stations):
+        table[icao] = {name: _format_time(values[i]) for name, values in events.items()}
+        table[icao].update({'moon_phase': phase, 'moon_illumination': round(max_illumination * 100),
+                            'moon_luminosity': round(max_illumination * MAX_MOON_MILLILUX)})
+    return table
+
+
+# --- TABELLA GIORNALIERA (CALCOLATA UNA VOLTA PER GIORNO UTC) ---
+
+_tables = {}
+_lock = threading.Lock()
+
+def _shared_ephemeris(stations, day):
+    # Una sola replica calcola le effemeridi del giorno, le altre le leggono dalla cache condivisa
+    shared = get_shared_cache()
+    if shared is None:
+        return daily_ephemeris(stations, day)
+    digest = hashlib.sha1(json.dumps(stations).encode('utf-8')).hexdigest()
+    shared.purge('astronomy', SHARED_RETENTION_SECONDS)
+    return shared.get_or_compute('astronomy', f"{day.isoformat()}:{digest}", lambda: daily_ephemeris(stations, day))
+
+def astronomy_table(stations, now=None):
+    day = (now or datetime.now(timezone.utc)).date()
+    stations = tuple((icao, float(lat), float(lon)) for icao, lat, lon in stations)
+    key = (day, stations)
+    with _lock:
+        if key in _tables:
+            return _tables[key]
+    # Calcolo (o attesa del lease di un'altra replica) fuori dal lock: le altre sessioni non restano bloccate
+    with metrics.timer('stage_seconds', stage='astronomy'):
+        table = _shared_ephemeris(stations, day) if stations else {}
+    with _lock:
+        for old_key in [k for k in _tables if k[0] != day]:
+            del _tables[old_key]
+        return _tables.setdefault(key, table)
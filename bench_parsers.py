@@ -0,0 +1,213 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+from airport_model import parse_airport_table
+from board_eval import parse_procedures, format_grouped_procedures, evaluate_board, PROC_COLUMNS
+from data_loader import parse_limits_csv, BASE_DIR
+from report_parser import parse_report, parse_weather_conditions, parse_multiple_wind, estrai_fasce_TAF
+from weather_fetch import fetch_reports
+from wind_engine import get_max_wind_components
+
+# --- CONFIGURAZIONE ---
+SMOKE_CORPUS_PATH = os.path.join(BASE_DIR, 'bench_smoke_corpus.txt')  # sintetico: regressione degli output, non throughput
+RECORDED_CORPUS_PATH = os.path.join(BASE_DIR, 'bench_recorded_corpus.txt')
+GOLDEN_PATH = os.path.join(BASE_DIR, 'bench_golden.json')
+OUTPUT_PATH = os.path.join(BASE_DIR, 'bench_output.txt')
+AIRPORTS_PATH = os.path.join(BASE_DIR, 'airport_list.csv')
+LIMITS_PATH = os.path.join(BASE_DIR, 'aircraft_limits.csv')
+DEFAULT_SIZE = 5000
+DEFAULT_REPEAT = 3
+BOARD_CHUNK = 100
+BENCH_NOW = datetime(2025, 10, 17, 12, tzinfo=timezone.utc)
+# Soglie minime (report/s, passata a freddo) contro regressioni grossolane, non un obiettivo di prestazioni
+MIN_REPORTS_PER_SEC = {
+    'parse_weather_conditions': 5000,
+    'parse_multiple_wind': 5000,
+    'estrai_fasce_TAF': 3000,
+    'parse_procedures': 10000,
+    'format_grouped_procedures': 10000,
+    'get_max_wind_components': 2000,
+    'evaluate_board': 500,
+}
+
+RE_ISSUE_GROUP = re.compile(r'\b\d{6}Z\b')
+RE_WIND_GROUP = re.compile(r'\b(\d{3})(\d{2,3}(?:G\d{2,3})?(?:KT|MPS))\b')
+RE_TAF_START = re.compile(r'\n(?=TAF\b)')
+
+
+# --- CORPUS ---
+
+def load_corpus(path=SMOKE_CORPUS_PATH):
+    with open(path, encoding='utf-8') as f:
+        lines = [line.rstrip() for line in f if not line.startswith('#')]
+    return [block.strip('\n') for block in '\n'.join(lines).split('\n\n') if block.strip()]
+
+def expand_corpus(reports, size):
+    # Varianti deterministiche e tutte diverse (orario e direzione vento): la cache di parse_report non aiuta
+    expanded = []
+    for i in range(size):
+        base, k = reports[i % len(reports)], i // len(reports)
+        issue = f"{1 + (k // 1440) % 28:02d}{(k // 60) % 24:02d}{k % 60:02d}Z"
+        text = RE_ISSUE_GROUP.sub(issue, base, count=1)
+        text = RE_WIND_GROUP.sub(lambda m: f"{(int(m.group(1)) + 10 * (k % 36)) % 360:03d}{m.group(2)}", text, count=1)
+        expanded.append(text)
+    return expanded
+
+def capture_corpus(path, hours):
+    # Bollettini reali (storico di hours ore) delle basi di airport_list.csv, nello stesso formato a blocchi
+    airports, _, _ = load_airports()
+    reports = fetch_reports([airport.icao for airport in airports], hours=hours)
+    blocks = []
+    for (kind, icao), text in sorted(reports.items()):
+        if not text:
+            continue
+        if kind == 'metar':
+            blocks.extend(line.strip() for line in text.splitlines() if line.strip())
+        else:
+            blocks.extend(taf.strip() if taf.lstrip().startswith('TAF') else f"TAF {taf.strip()}"
+                          for taf in RE_TAF_START.split(text) if taf.strip())
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"# Corpus registrato con weather_fetch il {datetime.now(timezone.utc):%Y-%m-%d %H:%MZ} (ultime {hours} ore)\n\n")
+        f.write('\n\n'.join(blocks) + '\n')
+    return len(blocks)
+
+def load_airports():
+    with open(AIRPORTS_PATH, encoding='utf-8') as f:
+        text = f.read()
+    with open(LIMITS_PATH, encoding='utf-8') as f:
+        limits = parse_limits_csv(f.read())
+    # Stringhe grezze "(proc;ceil;vis)" per il benchmark del parser, modello tipizzato per il resto
+    records = list(csv.DictReader(text.splitlines(), skipinitialspace=True))
+    proc_column = next((c for c in PROC_COLUMNS if records and c in records[0]), None)
+    proc_strings = [r[proc_column] for r in records] if proc_column else []
+    return parse_airport_table(text), proc_strings, limits
+
+
+# --- BENCHMARK ---
+
+def build_cases(corpus):
+    airports, proc_strings, limits = load_airports()
+    rows = list(airports)
+    procedures = [airport.procedures for airport in rows]
+    headings = [h for airport in rows for h in airport.true_headings]
+    tafs = [text for text in corpus if text.startswith('TAF')]
+    metars = [text for text in corpus if not text.startswith('TAF')]
+    conditions = [parse_weather_conditions(text) for text in corpus]
+    winds = [parse_multiple_wind(text) for text in corpus]
+    board_entries = [(rows[i % len(rows)], metars[i % len(metars)], tafs[i % len(tafs)]) for i in range(len(corpus))]
+    # (nome, funzione, input, freddo): freddo = si svuota la cache dei report prima di ogni passata
+    return [
+        ('parse_weather_conditions', parse_weather_conditions, [(t,) for t in corpus], True),
+        ('parse_multiple_wind', parse_multiple_wind, [(t,) for t in corpus], True),
+        ('estrai_fasce_TAF', estrai_fasce_TAF, [(t,) for t in tafs], True),
+        ('parse_procedures', parse_procedures, [(proc_strings[i % len(proc_strings)],) for i in range(len(corpus))] if proc_strings else [], False),
+        ('format_grouped_procedures', format_grouped_procedures,
+         [(procedures[i % len(procedures)], *conditions[i]) for i in range(len(corpus))] if procedures else [], False),
+        ('get_max_wind_components', get_max_wind_components,
+         [(winds[i], headings[i % len(headings)]) for i in range(len(corpus)) if winds[i]], False),
+        ('evaluate_board', lambda *chunk: evaluate_board(list(chunk), limits, None, BENCH_NOW),
+         [tuple(board_entries[i:i + BOARD_CHUNK]) for i in range(0, len(board_entries), BOARD_CHUNK)], True),
+    ]
+
+def _digest(outputs):
+    def normalize(value):
+        if isinstance(value, float):
+            return round(value, 6)
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        return value
+    return hashlib.sha256(json.dumps(normalize(outputs), sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def run_case(func, inputs, cold, repeat):
+    best, outputs = None, None
+    for _ in range(repeat):
+        if cold:
+            parse_report.cache_clear()
+        started = time.perf_counter()
+        outputs = [func(*args) for args in inputs]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, outputs
+
+def run_benchmarks(size=DEFAULT_SIZE, repeat=DEFAULT_REPEAT, corpus_path=SMOKE_CORPUS_PATH):
+    corpus = expand_corpus(load_corpus(corpus_path), size)
+    results = []
+    for name, func, inputs, cold in build_cases(corpus):
+        if not inputs:
+            results.append({'name': name, 'items': 0, 'elapsed': 0.0, 'per_sec': None, 'digest': None})
+            continue
+        elapsed, outputs = run_case(func, inputs, cold, repeat)
+        items = sum(len(args) for args in inputs) if name == 'evaluate_board' else len(inputs)
+        results.append({'name': name, 'items': items, 'elapsed': elapsed,
+                        'per_sec': items / elapsed if elapsed else float('inf'), 'digest': _digest(outputs)})
+    return results
+
+
+# --- REPORT, SOGLIE E OUTPUT DI RIFERIMENTO ---
+
+def check(results, golden, size, corpus_path):
+    failures = []
+    # Riferimento valido solo per lo stesso corpus e la stessa dimensione
+    same_run = golden.get('size') == size and golden.get('corpus') == os.path.basename(corpus_path)
+    golden_digests = golden.get('digests', {}) if same_run else {}
+    for result in results:
+        threshold = MIN_REPORTS_PER_SEC.get(result['name'])
+        if result['per_sec'] is not None and threshold and result['per_sec'] < threshold:
+            failures.append(f"{result['name']}: {result['per_sec']:.0f}/s sotto la soglia di {threshold}/s")
+        expected = golden_digests.get(result['name'])
+        if expected and result['digest'] and expected != result['digest']:
+            failures.append(f"{result['name']}: output diverso dal riferimento ({GOLDEN_PATH})")
+    return failures
+
+def format_results(results, failures):
+    lines = [f"{'benchmark':<28}{'items':>8}{'tempo (s)':>12}{'report/s':>12}  soglia"]
+    for result in results:
+        per_sec = f"{result['per_sec']:.0f}" if result['per_sec'] is not None else 'n/d'
+        threshold = MIN_REPORTS_PER_SEC.get(result['name'], '')
+        lines.append(f"{result['name']:<28}{result['items']:>8}{result['elapsed']:>12.4f}{per_sec:>12}  {threshold}")
+    lines.extend(['', 'REGRESSIONI:'] + failures if failures else ['', 'OK'])
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark di parser e valutatori sul corpus METAR/TAF")
+    parser.add_argument('--corpus', help=f"file del corpus (default: {os.path.basename(SMOKE_CORPUS_PATH)}, sintetico)")
+    parser.add_argument('--capture', type=int, metavar='HOURS',
+                        help=f"registra i bollettini reali delle ultime HOURS ore in --corpus (default {os.path.basename(RECORDED_CORPUS_PATH)})")
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help="numero di report generati dal corpus")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--update-golden', action='store_true', help="riscrive gli output di riferimento")
+    args = parser.parse_args(argv)
+    if args.capture:
+        path = args.corpus or RECORDED_CORPUS_PATH
+        print(f"{capture_corpus(path, args.capture)} report registrati in {path}", file=sys.stderr)
+        return 0
+    corpus_path = args.corpus or SMOKE_CORPUS_PATH
+    results = run_benchmarks(args.size, args.repeat, corpus_path)
+    if args.update_golden:
+        with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'corpus': os.path.basename(corpus_path), 'size': args.size,
+                       'digests': {r['name']: r['digest'] for r in results if r['digest']}}, f, indent=2)
+            f.write('\n')
+    golden = {}
+    if os.path.exists(GOLDEN_PATH):
+        with open(GOLDEN_PATH, encoding='utf-8') as f:
+            golden = json.load(f)
+    failures = check(results, golden, args.size, corpus_path)
+    report = format_results(results, failures)
+    print(report)
+    with open(OUTPUT_PATH, 'w', encoding='utf-8') as f:
+        f.write(report + '\n')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from airport_model import parse_airport_table
+from board_eval import evaluate_board, runway_status, worst_status
+from data_loader import load_airport_table, load_limit_profiles, parse_limit_profiles, BASE_DIR
+from notam import NotamIndex, FileNotamSource
+from last_good_cache import LastGoodStore
+from weather_fetch import get_weather_bulk, METAR_MISSING, TAF_MISSING
+
+# --- CONFIGURAZIONE ---
+GITHUB_USER = "angelo79"
+REPO_NAME = "total_step"
+BRANCH = "main"
+PATH_AIRPORTS = "airport_list.csv"
+PATH_LIMITS = "aircraft_limits.csv"
+url_airports = f"https://raw.githubusercontent.com/{GITHUB_USER}/{REPO_NAME}/{BRANCH}/{PATH_AIRPORTS}"
+url_limits = f"https://raw.githubusercontent.com/{GITHUB_USER}/{REPO_NAME}/{BRANCH}/{PATH_LIMITS}"
+CSV_FIELDS = ('icao', 'kind', 'item', 'source', 'status', 'headwind', 'tailwind', 'crosswind', 'wind',
+              'visibility', 'ceiling', 'hour')
+
+
+# --- SNAPSHOT DEL BOARD SENZA STREAMLIT ---
+
+def load_static(offline, airac):
+    if offline:
+        with open(os.path.join(BASE_DIR, PATH_AIRPORTS), encoding='utf-8') as f:
+            airports = parse_airport_table(f.read())
+        with open(os.path.join(BASE_DIR, PATH_LIMITS), encoding='utf-8') as f:
+            profiles = parse_limit_profiles(f.read())
+        return airports, profiles
+    return load_airport_table(url_airports, PATH_AIRPORTS, airac), load_limit_profiles(url_limits, PATH_LIMITS, airac)
+
+def load_weather(icaos, offline):
+    # Offline: nessuna richiesta di rete, solo gli ultimi report validi salvati su disco (se presenti)
+    if not offline:
+        return get_weather_bulk(icaos)
+    saved = LastGoodStore().load()
+    return {icao: (saved[icao].metar, saved[icao].taf or TAF_MISSING) if icao in saved else (METAR_MISSING, TAF_MISSING)
+            for icao in icaos}
+
+def board_snapshot(offline=False, airac=None, now=None, notam_path=None, profile=None):
+    now = now or datetime.now(timezone.utc)
+    airports, profiles = load_static(offline, airac)
+    profile = profile or next(iter(profiles))
+    if profile not in profiles:
+        raise SystemExit(f"Profilo sconosciuto: {profile} (disponibili: {', '.join(profiles)})")
+    limits = profiles[profile]
+    notams = None
+    if notam_path:
+        notams = NotamIndex()
+        notams.ingest(FileNotamSource(notam_path).fetch(), complete=True)
+    weather_by_icao = load_weather(airports.icaos, offline)
+    entries = [(airport, *weather_by_icao[airport.icao]) for airport in airports]
+    return {'generated_at': now.strftime('%Y-%m-%dT%H:%M:%SZ'), 'profile': profile, 'limits': limits, 'profiles': profiles,
+            'stations': evaluate_board(entries, limits, airports.home_base, now, notams, profiles)}
+
+def _status(ok, good, bad):
+    return 'unknown' if ok is None else (good if ok else bad)
+
+def snapshot_rows(snapshot):
+    # Una riga per pista/procedura/verifica alternato, adatta a CSV; 'unknown' se il report manca
+    for station in snapshot['stations']:
+        icao = station['icao']
+        for runway in station['runways']:
+            for source in ('metar', 'taf'):
+                wind = runway[source]
+                if wind is None:
+                    continue
+                worst = worst_status(runway_status(wind, snapshot['profile']).values())
+                yield dict(icao=icao, kind='wind', item=runway['runway'], source=source, status=worst, **wind['gust'])
+        for procedure in station['procedures']:
+            for source in ('metar', 'taf'):
+                status = 'notam' if procedure['notams'] else _status(procedure[f'{source}_go'], 'go', 'no_go')
+                yield dict(icao=icao, kind='procedure', item=procedure['procedure'], source=source, status=status,
+                           visibility=procedure['visibility'], ceiling=procedure['ceiling'])
+        alternate = station['alternate']
+        if not alternate or alternate['procedure'] is None:
+            continue
+        yield dict(icao=icao, kind='alternate', item=alternate['procedure'], source='metar',
+                   status=_status(alternate['metar_ok'], 'valid', 'invalid'),
+                   visibility=alternate['vis_req'], ceiling=alternate['ceil_req'])
+        for hour in alternate['taf_hourly'] or []:
+            yield dict(icao=icao, kind='alternate', item=alternate['procedure'], source='taf',
+                       status='valid' if hour['ok'] else 'invalid', visibility=alternate['vis_req'],
+                       ceiling=alternate['ceil_req'], hour=hour['hour'])
+
+def write_snapshot(snapshot, output, fmt):
+    if fmt == 'csv':
+        writer = csv.DictWriter(output, fieldnames=CSV_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(snapshot_rows(snapshot))
+    else:
+        json.dump(snapshot, output, indent=2, ensure_ascii=False)
+        output.write('\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshot del board TOTAL STEP in JSON/CSV, senza Streamlit")
+    parser.add_argument('--format', choices=('json', 'csv'), default='json')
+    parser.add_argument('--output', '-o', help="file di uscita (default: stdout)")
+    parser.add_argument('--offline', action='store_true', help="nessuna rete: CSV locali e ultimi report salvati su disco")
+    parser.add_argument('--airac', default=None, help="AIRAC dei CSV (chiave della cache di parsing)")
+    parser.add_argument('--notams', default=None, help="file NOTAM: procedure con NOTAM attivi non utilizzabili")
+    parser.add_argument('--profile', default=None, help="profilo aeromobile per lo stato vento CSV (default: il primo)")
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    snapshot = board_snapshot(args.offline, args.airac, notam_path=args.notams, profile=args.profile)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            write_snapshot(snapshot, f, args.format)
+    else:
+        write_snapshot(snapshot, sys.stdout, args.format)
+    print(f"{len(snapshot['stations'])} stazioni in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+import re
+from datetime import datetime, timezone
+
+import numpy as np
+
+import metrics
+from procedure_index import procedure_index, ProcedureIndex
+
+from report_parser import parse_report, parse_weather_conditions, parse_multiple_wind, estrai_fasce_TAF
+from taf_timeline import get_timeline
+from wind_engine import board_wind_components, COMPONENTS, SUSTAINED, GUST
+
+# --- CONFIGURAZIONE ---
+RWY_COLUMNS = ('RWY_true_north(magn_north)', 'RWY(truenorth;magnnorth)')
+PROC_COLUMNS = ('(proc;ceil;vis)', 'proc')
+ALTERNATE_VIS_MARGIN, ALTERNATE_VIS_MIN = 2000, 3000
+ALTERNATE_CEIL_MARGIN, ALTERNATE_CEIL_MIN = 500, 1000
+STATUS_OK, STATUS_DRY_ONLY, STATUS_EXCEEDED = 'ok', 'dry_only', 'exceeded'
+WIND_LIMITS = {'headwind': 'max_headwind', 'tailwind': 'max_tailwind', 'wind': 'max_wind'}
+STATUS_CODES = (STATUS_OK, STATUS_DRY_ONLY, STATUS_EXCEEDED)
+PROFILE_LIMITS = ('max_headwind', 'max_tailwind', 'max_crosswind_dry', 'max_crosswind_wet', 'max_wind')
+STATION_OK, STATION_CAUTION, STATION_CRITICAL, STATION_UNKNOWN = 'ok', 'caution', 'critical', 'unknown'
+# Regione dal prefisso ICAO: terza lettera per le basi italiane, paese per le altre
+ITALIAN_REGIONS = {'LIM': 'Nord-Ovest', 'LIP': 'Nord-Est', 'LIQ': 'Centro', 'LIR': 'Centro', 'LIB': 'Sud',
+                   'LIC': 'Sicilia-Calabria', 'LIE': 'Sardegna'}
+COUNTRY_PREFIXES = {'LI': 'Italia', 'LF': 'Francia', 'LE': 'Spagna', 'LP': 'Portogallo', 'ED': 'Germania', 'ET': 'Germania',
+                    'LO': 'Austria', 'LS': 'Svizzera', 'LJ': 'Slovenia', 'LD': 'Croazia', 'LG': 'Grecia', 'LM': 'Malta',
+                    'EG': 'Regno Unito', 'EB': 'Belgio', 'EH': 'Paesi Bassi', 'LH': 'Ungheria', 'LK': 'Cechia', 'EP': 'Polonia'}
+
+
+# --- PARSING DELLE COLONNE CSV ---
+
+def parse_coord(coord_str):
+    if not isinstance(coord_str, str) or coord_str.strip() == '':
+        return None, None
+    try:
+        lat_str, lon_str = coord_str.split(';')
+        return float(lat_str), float(lon_str)
+    except (ValueError, IndexError):
+        return None, None
+
+def parse_procedures(proc_str):
+    if not isinstance(proc_str, str):
+        return []
+    return procedure_index(proc_str).as_dicts()
+
+def parse_runway_data(data_string):
+    true_hdgs, magn_hdgs = [], []
+    if isinstance(data_string, str):
+        pairs = data_string.strip().split(';')
+        for pair in pairs:
+            # Formati accettati: "82(78)" (CSV attuale) e "(82,78)"
+            match = re.match(r'^\s*(\d+)\s*\(\s*(\d+)\s*\)\s*$', pair) or re.match(r'\((\d+),(\d+)\)', pair.strip())
+            if match:
+                true_hdgs.append(int(match.group(1)))
+                magn_hdgs.append(int(match.group(2)))
+    return true_hdgs, magn_hdgs
+
+def station_region(icao):
+    icao = icao.strip().upper()
+    return ITALIAN_REGIONS.get(icao[:3]) or COUNTRY_PREFIXES.get(icao[:2], icao[:2])
+
+def format_runway_name(magnetic_heading):
+    return f"RWY {round(magnetic_heading / 10):02d}"
+
+
+# --- MINIME E LIMITI ---
+
+def has_report(text):
+    # Segnaposto (METAR/TAF non disponibile, non richiesto, non emesso) = nessun report: stato sconosciuto, mai "go"
+    section = parse_report(text).latest if text else None
+    return section is not None and section.station is not None
+
+def procedure_go(procedure, vis, ceil):
+    return vis >= procedure['vis'] and ceil >= procedure['ceil']
+
+def alternate_requirements(procedures):
+    # Requisiti alternato dalla procedura con minime piu' basse: (procedura, visibilita', ceiling)
+    index = procedures if isinstance(procedures, ProcedureIndex) else ProcedureIndex.from_dicts(procedures)
+    if not index:
+        return None
+    min_proc = index.lowest
+    vis_req = max(min_proc.vis + ALTERNATE_VIS_MARGIN, ALTERNATE_VIS_MIN)
+    ceil_req = max(min_proc.ceil + ALTERNATE_CEIL_MARGIN, ALTERNATE_CEIL_MIN)
+    return min_proc.as_dict(), vis_req, ceil_req
+
+def wind_component_status(component, value, limits):
+    if component == 'crosswind':
+        if value > limits['max_crosswind_dry']:
+            return STATUS_EXCEEDED
+        return STATUS_DRY_ONLY if value > limits['max_crosswind_wet'] else STATUS_OK
+    return STATUS_EXCEEDED if value > limits[WIND_LIMITS[component]] else STATUS_OK
+
+def worst_status(statuses):
+    statuses = list(statuses)
+    return max(statuses, key=STATUS_CODES.index) if statuses else None
+
+def limits_matrix(profiles):
+    # {profilo: limiti} -> (profili, 5) nell'ordine di PROFILE_LIMITS
+    return np.array([[float(limits[k]) for k in PROFILE_LIMITS] for limits in profiles.values()]).reshape(-1, len(PROFILE_LIMITS))
+
+def wind_status_matrix(gusts, matrix):
+    # gusts: (piste, 4) [head, tail, cross, vento] -> (piste, profili, 4) indici in STATUS_CODES,
+    # stessa regola di wind_component_status per tutti i profili in una sola operazione
+    g = np.asarray(gusts, dtype=float)[:, None, :]
+    head, tail, cross_dry, cross_wet, wind = (matrix[:, k] for k in range(len(PROFILE_LIMITS)))
+    codes = np.zeros((g.shape[0], len(matrix), len(COMPONENTS)), dtype=np.int8)
+    codes[..., 0] = np.where(g[..., 0] > head, 2, 0)
+    codes[..., 1] = np.where(g[..., 1] > tail, 2, 0)
+    codes[..., 2] = np.where(g[..., 2] > cross_dry, 2, np.where(g[..., 2] > cross_wet, 1, 0))
+    codes[..., 3] = np.where(g[..., 3] > wind, 2, 0)
+    return codes
+
+def runway_wind(components, limits, profile_codes=None, profile_names=()):
+    # components: (2, 4) [sostenuto|raffica]; lo stato si valuta sulla raffica (caso peggiore)
+    sustained = {name: float(v) for name, v in zip(COMPONENTS, components[SUSTAINED])}
+    gust = {name: float(v) for name, v in zip(COMPONENTS, components[GUST])}
+    wind = {'sustained': sustained, 'gust': gust,
+            'status': {name: wind_component_status(name, value, limits) for name, value in gust.items()}}
+    if profile_codes is not None:
+        wind['status_by_profile'] = {profile: {name: STATUS_CODES[c] for name, c in zip(COMPONENTS, codes)}
+                                     for profile, codes in zip(profile_names, profile_codes)}
+    return wind
+
+
+def _procedure_span(p, vis, ceil, unavailable):
+    # Procedure rese inutilizzabili da NOTAM attivi: in grigio barrate, con gli ID nel tooltip
+    # Classi del foglio di stile condiviso dei pannelli (panel_html.PANEL_CSS)
+    if p.name in unavailable:
+        return f"<span class='ts-off' title='NOTAM {', '.join(unavailable[p.name])}'>{p.name}</span>"
+    if vis is None:
+        return f"<span class='ts-na'>{p.name}</span>"  # report mancante o non richiesto: ne' go ne' no-go
+    return f"<span class='{'ts-ok' if p.usable(vis, ceil) else 'ts-bad'}'>{p.name}</span>"
+
+def format_grouped_procedures(procedures, vis, ceil, unavailable=None):
+    # Raggruppamento per pista gia' fatto nell'indice: nessuna regex per procedura a ogni rerun
+    index = procedures if isinstance(procedures, ProcedureIndex) else ProcedureIndex.from_dicts(procedures)
+    if not index:
+        return ""
+    unavailable = unavailable or {}
+    output_lines = []
+    for rwy, procs in index.by_runway.items():
+        spans = [_procedure_span(p, vis, ceil, unavailable) for p in procs]
+        output_lines.append(f"<div><b>{rwy}:</b>&nbsp;&nbsp;{' / '.join(spans)}</div>")
+    return "".join(output_lines)
+
+# --- VALUTAZIONE DI UNA STAZIONE E DEL BOARD ---
+
+def evaluate_alternate(icao, procedures, metar, taf, now=None):
+    requirements = alternate_requirements(procedures)
+    if requirements is None:
+        return {'procedure': None}
+    min_proc, vis_req, ceil_req = requirements
+    alternate = {'procedure': min_proc['proc'], 'vis_req': vis_req, 'ceil_req': ceil_req,
+                 'metar_ok': None, 'taf_segments': None, 'taf_hourly': None}
+    if has_report(metar):
+        metar_vis, metar_ceil = parse_weather_conditions(metar)
+        alternate['metar_ok'] = metar_vis >= vis_req and metar_ceil >= ceil_req
+    if has_report(taf):
+        alternate['taf_segments'] = [{'label': label.strip(), 'ok': vis >= vis_req and ceil >= ceil_req} for label, vis, ceil in estrai_fasce_TAF(taf)]
+        taf_timeline = get_timeline(icao, taf, now)
+        if taf_timeline is not None:
+            hourly_ok = taf_timeline.hourly_alternate(vis_req, ceil_req)
+            alternate['taf_hourly'] = [{'hour': hour_start.strftime('%Y-%m-%dT%H:%MZ'), 'ok': bool(ok)}
+                                       for hour_start, ok in zip(taf_timeline.hour_starts(), hourly_ok)]
+    return alternate
+
+def taf_conditions(icao, taf, now):
+    # Caso peggiore sulle ore di validita' residue del TAF, se la griglia oraria e' disponibile
+    if not has_report(taf):
+        return None, None
+    # `now` risolve anche i gruppi giorno/ora del TAF: stesso risultato a parita' di report e ora
+    taf_timeline = get_timeline(icao, taf, now)
+    taf_worst = taf_timeline.worst_conditions(now) if taf_timeline is not None else None
+    return taf_worst[:2] if taf_worst else parse_weather_conditions(taf)
+
+def evaluate_board(entries, limits, first_airport_icao=None, now=None, notams=None, profiles=None):
+    # entries: [(Airport, metar, taf)]; componenti vento di tutte le stazioni in un'unica chiamata vettoriale
+    # notams: NotamIndex opzionale, le procedure con NOTAM attivi a `now` non sono utilizzabili
+    # profiles: {profilo: limiti} opzionale, stato vento di ogni pista per tutti i profili (status_by_profile)
+    now = now or datetime.now(timezone.utc)
+    with metrics.timer('stage_seconds', stage='parse'):
+        reports = [(parse_report(metar), parse_report(taf)) for _, metar, taf in entries]
+    with metrics.timer('stage_seconds', stage='evaluate'):
+        return _evaluate_entries(entries, reports, limits, first_airport_icao, now, notams, profiles)
+
+def _int(value):
+    return int(value) if value is not None else None
+
+def _procedure_usable(p, blocked, vis, ceil):
+    # False con NOTAM attivo, None senza report, altrimenti confronto con le minime
+    if p.name in blocked:
+        return False
+    return p.usable(vis, ceil) if vis is not None else None
+
+def _evaluate_entries(entries, reports, limits, first_airport_icao, now, notams=None, profiles=None):
+    components = board_wind_components([(report[k].winds, airport.true_headings) for k in (0, 1)
+                                        for report, (airport, _, _) in zip(reports, entries)])
+    # Matrice (pista x profilo x componente) per tutto il board; righe per [metar di ogni stazione, taf di ogni stazione]
+    profile_names, profile_codes, offsets = tuple(profiles or ()), None, None
+    if profile_names and components:
+        offsets = np.concatenate(([0], np.cumsum([len(c) for c in components])))
+        stacked = np.concatenate(components) if offsets[-1] else np.zeros((0, 2, len(COMPONENTS)))
+        profile_codes = wind_status_matrix(stacked[:, GUST, :], limits_matrix(profiles))
+    def wind_for(k, r):
+        codes = profile_codes[offsets[k] + r] if profile_codes is not None else None
+        return runway_wind(components[k][r], limits, codes, profile_names)
+    stations = []
+    for i, (airport, metar, taf) in enumerate(entries):
+        icao, procedures = airport.icao, airport.procedures
+        blocked = notams.unavailable_procedures(icao, procedures, now) if notams is not None else {}
+        available = ProcedureIndex(p for p in procedures.procedures if p.name not in blocked) if blocked else procedures
+        # Report mancante o non richiesto: condizioni None, procedure ne' go ne' no-go
+        metar_vis, metar_ceil = parse_weather_conditions(metar) if has_report(metar) else (None, None)
+        taf_vis, taf_ceil = taf_conditions(icao, taf, now)
+        metar_wind, taf_wind = bool(parse_multiple_wind(metar)), bool(parse_multiple_wind(taf))
+        stations.append({
+            'icao': icao, 'name': airport.name, 'metar': metar, 'taf': taf,
+            'conditions': {'metar': {'visibility': _int(metar_vis), 'ceiling': _int(metar_ceil)},
+                           'taf': {'visibility': _int(taf_vis), 'ceiling': _int(taf_ceil)}},
+            'procedures': [{'procedure': p.name, 'runway': p.runway, 'type': p.kind, 'ceiling': p.ceil, 'visibility': p.vis,
+                            'metar_go': _procedure_usable(p, blocked, metar_vis, metar_ceil),
+                            'taf_go': _procedure_usable(p, blocked, taf_vis, taf_ceil), 'notams': blocked.get(p.name, [])}
+                           for p in procedures.procedures],
+            'best_procedure': {source: {rwy: getattr(available.best_usable(vis, ceil, rwy), 'name', None) if vis is not None else None
+                                        for rwy in procedures.by_runway}
+                               for source, vis, ceil in (('metar', metar_vis, metar_ceil), ('taf', taf_vis, taf_ceil))},
+            'runways': [{'runway': format_runway_name(magn_hdg), 'true_heading': true_hdg, 'magnetic_heading': magn_hdg,
+                         'metar': wind_for(i, r) if metar_wind else None,
+                         'taf': wind_for(len(entries) + i, r) if taf_wind else None,
+                         'notams': notams.runway_notams(icao, format_runway_name(magn_hdg).replace(' ', ''), now) if notams is not None else []}
+                        for r, (true_hdg, magn_hdg) in enumerate(zip(airport.true_headings, airport.magnetic_headings))],
+            'alternate': evaluate_alternate(icao, available, metar, taf, now) if icao != first_airport_icao else None,
+            'notams': [n.as_dict() for n in notams.active_notams(icao, now)] if notams is not None else [],
+        })
+    return stations
+
+def runway_status(wind, profile=None):
+    return wind['status_by_profile'][profile] if profile is not None else wind['status']
+
+def station_status(station, source='metar', profile=None):
+    # Stato sintetico per il riepilogo: vento oltre i limiti o nessuna procedura utilizzabile = critico
+    if not has_report(station[source]):
+        return STATION_UNKNOWN
+    wind = worst_status(s for runway in station['runways'] if runway[source] for s in runway_status(runway[source], profile).values())
+    go = [p[f'{source}_go'] for p in station['procedures']]
+    if wind == STATUS_EXCEEDED or (go and not any(go)):
+        return STATION_CRITICAL
+    alternate = station['alternate'] if source == 'metar' else None
+    if wind == STATUS_DRY_ONLY or (go and not all(go)) or (alternate and alternate['procedure'] and not alternate['metar_ok']):
+        return STATION_CAUTION
+    return STATION_OK
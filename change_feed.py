@@ -0,0 +1,115 @@
+import logging
+import threading
+
+# --- CONFIGURAZIONE ---
+FALLBACK_CHECK_SECONDS = 15  # controllo delle versioni quando il risveglio lato server non e' disponibile
+
+log = logging.getLogger(__name__)
+
+
+# --- PUBBLICAZIONE DEI CAMBI PER STAZIONE, ABBONAMENTI PER SESSIONE ---
+
+class ChangeFeed:
+    # Il poller pubblica le stazioni con un report nuovo; si svegliano solo le sessioni che le mostrano
+    def __init__(self):
+        self._versions = {}
+        self._subscribers = {}  # session_id -> (stazioni, wake)
+        self._lock = threading.Lock()
+
+    def publish(self, icaos):
+        icaos = {i.strip().upper() for i in icaos}
+        if not icaos:
+            return 0
+        with self._lock:
+            for icao in icaos:
+                self._versions[icao] = self._versions.get(icao, 0) + 1
+            woken = [(session_id, wake) for session_id, (stations, wake) in self._subscribers.items() if stations & icaos]
+        gone = [session_id for session_id, wake in woken if not wake()]
+        if gone:
+            with self._lock:
+                for session_id in gone:
+                    self._subscribers.pop(session_id, None)
+        return len(woken) - len(gone)
+
+    def subscribe(self, session_id, icaos, wake):
+        # Un abbonamento per sessione, sostituito a ogni riesecuzione; wake() -> False se la sessione non c'e' piu'
+        with self._lock:
+            self._subscribers[session_id] = (frozenset(i.strip().upper() for i in icaos), wake)
+
+    def unsubscribe(self, session_id):
+        with self._lock:
+            self._subscribers.pop(session_id, None)
+
+    def versions(self, icaos):
+        with self._lock:
+            return tuple(self._versions.get(i.strip().upper(), 0) for i in icaos)
+
+    def subscribers(self):
+        return len(self._subscribers)
+
+
+# --- RISVEGLIO DI UNA SESSIONE STREAMLIT DAL THREAD DEL POLLER ---
+
+# API interne verificate con la versione di Streamlit fissata in requirements.txt
+_waker_broken = False
+_unavailable_logged = False
+
+def _log_unavailable(reason):
+    # Una sola volta per processo: da qui in poi le sessioni usano il controllo periodico delle versioni
+    global _unavailable_logged
+    if not _unavailable_logged:
+        _unavailable_logged = True
+        log.warning("Risveglio delle sessioni non disponibile (%s): controllo delle versioni ogni %d s",
+                    reason, FALLBACK_CHECK_SECONDS)
+
+def _streamlit_waker(session_id):
+    # Riesecuzione della sessione richiesta lato server (API interne di Streamlit, con gli stessi widget
+    # dell'ultima esecuzione); None se non disponibile
+    if _waker_broken:
+        return None
+    try:
+        from streamlit.proto.ClientState_pb2 import ClientState
+        from streamlit.runtime import Runtime
+        if not Runtime.exists():
+            _log_unavailable("runtime Streamlit assente")
+            return None
+        session_mgr = Runtime.instance()._session_mgr
+        info = session_mgr.get_active_session_info(session_id)
+        if info is None:
+            return None
+        if not hasattr(info.session, '_client_state') or not hasattr(info.session, '_event_loop'):
+            _log_unavailable("API interne della sessione cambiate")
+            return None
+    except Exception as e:
+        _log_unavailable(f"{type(e).__name__}: {e}")
+        return None
+
+    def wake():
+        global _waker_broken
+        info = session_mgr.get_active_session_info(session_id)
+        if info is None:
+            return False
+        try:
+            session = info.session
+            client_state = ClientState()
+            client_state.CopyFrom(session._client_state)
+            client_state.fragment_id = ''
+            client_state.is_auto_rerun = True
+            session._event_loop.call_soon_threadsafe(session.request_rerun, client_state)
+        except Exception as e:
+            # Le sessioni gia' abbonate sono tolte; alla prossima esecuzione passano al controllo periodico
+            _waker_broken = True
+            _log_unavailable(f"{type(e).__name__}: {e}")
+            return False
+        return True
+    return wake
+
+def subscribe_session(feed, icaos):
+    # True = la sessione corrente verra' svegliata dal poller; False = serve il controllo periodico delle versioni
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx(suppress_warning=True)
+    wake = _streamlit_waker(ctx.session_id) if ctx is not None else None
+    if wake is None:
+        return False
+    feed.subscribe(ctx.session_id, icaos, wake)
+    return True
@@ -0,0 +1,145 @@
+import csv
+import hashlib
+import io
+import os
+import threading
+import time
+
+import metrics
+from airport_model import parse_airport_table
+from http_client import get_client
+from shared_cache import get_shared_cache
+
+# --- CONFIGURAZIONE ---
+REVALIDATE_SECONDS = 300
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- FILE STATICI CON REVALIDAZIONE CONDIZIONALE (ETag / If-Modified-Since) ---
+
+class StaticFile:
+    __slots__ = ('text', 'content_hash', 'etag', 'last_modified', 'checked_at', 'source')
+
+    def __init__(self, text, etag=None, last_modified=None, source='remote'):
+        self.text = text
+        self.content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checked_at = time.monotonic()
+        self.source = source
+
+
+_files = {}
+_parsed = {}
+_inflight = {}  # url -> Event della rivalidazione in corso
+_lock = threading.Lock()
+
+def _read_local(local_path):
+    path = local_path if os.path.isabs(local_path) else os.path.join(BASE_DIR, local_path)
+    with open(path, encoding='utf-8') as f:
+        return StaticFile(f.read(), source='local')
+
+def _revalidate(url, local_path, cached):
+    headers = {}
+    if cached is not None and cached.source == 'remote':
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+    result = get_client().get(url, headers=headers)
+    name = os.path.basename(local_path)
+    if result.status == 304 and cached is not None:
+        metrics.increment('static_revalidations', file=name, outcome='not_modified')
+        cached.checked_at = time.monotonic()
+        return cached
+    if result.ok and result.text.strip():
+        metrics.increment('static_revalidations', file=name, outcome='downloaded')
+        return StaticFile(result.text, result.headers.get('ETag'), result.headers.get('Last-Modified'))
+    # Offline o errore: si tiene l'ultima copia valida, altrimenti il CSV locale del repository
+    if cached is not None:
+        metrics.increment('static_revalidations', file=name, outcome='stale_copy')
+        cached.checked_at = time.monotonic()
+        return cached
+    metrics.increment('static_revalidations', file=name, outcome='local_file')
+    return _read_local(local_path)
+
+def _shared_revalidate(url, local_path, cached, max_age):
+    # Con piu' processi una sola rivalidazione per file ogni max_age: le altre repliche leggono il risultato
+    shared = get_shared_cache()
+    if shared is None:
+        return _revalidate(url, local_path, cached)
+    def revalidate():
+        static_file = _revalidate(url, local_path, cached)
+        return {'text': static_file.text, 'etag': static_file.etag, 'last_modified': static_file.last_modified,
+                'source': static_file.source}
+    record = shared.get_or_compute('static', url, revalidate, max_age)
+    if cached is not None and cached.text == record['text']:
+        cached.checked_at = time.monotonic()
+        return cached
+    return StaticFile(record['text'], record['etag'], record['last_modified'], record['source'])
+
+def load_static_file(url, local_path, max_age=REVALIDATE_SECONDS):
+    # Il lock protegge solo lettura e sostituzione della voce; la GET condizionale gira fuori, una per file:
+    # durante la rivalidazione chi ha gia' una copia la usa subito, chi non ne ha attende quella in corso
+    with _lock:
+        cached = _files.get(url)
+        if cached is not None and time.monotonic() - cached.checked_at < max_age:
+            return cached
+        inflight = _inflight.get(url)
+        owner = inflight is None
+        if owner:
+            inflight = _inflight[url] = threading.Event()
+    if not owner:
+        if cached is not None:
+            return cached
+        inflight.wait()
+        with _lock:
+            static_file = _files.get(url)
+        return static_file if static_file is not None else load_static_file(url, local_path, max_age)
+    try:
+        with metrics.timer('stage_seconds', stage='data_load'):
+            static_file = _shared_revalidate(url, local_path, cached, max_age)
+        with _lock:
+            _files[url] = static_file
+        return static_file
+    finally:
+        with _lock:
+            del _inflight[url]
+        inflight.set()
+
+def load_parsed(url, local_path, parser, airac_number, max_age=REVALIDATE_SECONDS):
+    static_file = load_static_file(url, local_path, max_age)
+    key = (url, parser.__name__, static_file.content_hash, airac_number)
+    with _lock:
+        if key not in _parsed:
+            for old_key in [k for k in _parsed if k[:2] == key[:2]]:
+                del _parsed[old_key]
+            _parsed[key] = parser(static_file.text)
+        return _parsed[key]
+
+
+# --- PARSING DEI CSV ---
+
+def parse_limit_profiles(text):
+    # Una riga per tipo di aeromobile, colonna opzionale "profile" (senza: un solo profilo "default")
+    profiles = {}
+    for record in csv.DictReader(io.StringIO(text.lstrip('\ufeff')), skipinitialspace=True):
+        record = {key.strip(): value.strip() for key, value in record.items() if key is not None and value is not None}
+        if not any(record.values()):
+            continue
+        name = record.pop('profile', '') or 'default'
+        profiles[name] = {key: float(value) for key, value in record.items()}
+    return profiles
+
+def parse_limits_csv(text):
+    return next(iter(parse_limit_profiles(text).values()))
+
+def load_airport_table(url, local_path, airac_number):
+    # AirportTable immutabile, ricostruita solo quando cambiano contenuto del CSV o AIRAC
+    return load_parsed(url, local_path, parse_airport_table, airac_number)
+
+def load_aircraft_limits(url, local_path, airac_number):
+    return load_parsed(url, local_path, parse_limits_csv, airac_number)
+
+def load_limit_profiles(url, local_path, airac_number):
+    return load_parsed(url, local_path, parse_limit_profiles, airac_number)
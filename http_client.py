@@ -0,0 +1,163 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# --- CONFIGURAZIONE ---
+HEADERS = {'User-Agent': 'TotalStep-Streamlit-App/Final'}
+POOL_SIZE = 16
+MAX_WORKERS = 16
+CONNECT_TIMEOUT = 3.0
+READ_TIMEOUT = 8.0
+OVERALL_DEADLINE = 15.0
+HEDGE_DELAY = 1.5
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5
+RATE_PER_SECOND = 5.0
+RATE_BURST = 10
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+# --- LIMITATORE DI FREQUENZA (TOKEN BUCKET) ---
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_time = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait_time > deadline:
+                return False
+            time.sleep(wait_time)
+
+
+# --- RISULTATO DI UNA RICHIESTA ---
+
+class FetchResult:
+    __slots__ = ('key', 'ok', 'status', 'text', 'headers', 'error', 'elapsed')
+
+    def __init__(self, key, ok=False, status=None, text='', headers=None, error=None, elapsed=0.0):
+        self.key = key
+        self.ok = ok
+        self.status = status
+        self.text = text
+        self.headers = headers or {}
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f"FetchResult({self.key!r}, ok={self.ok}, status={self.status}, error={self.error!r})"
+
+
+# --- CLIENT HTTP CONDIVISO ---
+
+class HttpClient:
+    def __init__(self, pool_size=POOL_SIZE, max_workers=MAX_WORKERS, rate=RATE_PER_SECOND, burst=RATE_BURST,
+                 hedge_delay=HEDGE_DELAY, max_retries=MAX_RETRIES):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(HEADERS)
+        self.bucket = TokenBucket(rate, burst)
+        self.hedge_delay = hedge_delay
+        self.max_retries = max_retries
+        # Due pool separati: le richieste in parallelo non devono mai attendere i propri tentativi
+        self._requests_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='http-request')
+        self._attempts_pool = ThreadPoolExecutor(max_workers=max_workers * 2, thread_name_prefix='http-attempt')
+
+    def _attempt(self, key, url, params, headers, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return FetchResult(key, error='deadline')
+        if not self.bucket.acquire(deadline):
+            return FetchResult(key, error='rate limit')
+        started = time.monotonic()
+        timeout = (min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, max(deadline - started, 0.1)))
+        host = urlsplit(url).netloc
+        try:
+            response = self.session.get(url, params=params, headers=headers, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            metrics.observe('upstream_seconds', time.monotonic() - started, host=host)
+            metrics.increment('upstream_requests', host=host, status=type(e).__name__)
+            return FetchResult(key, error=str(e) or type(e).__name__, elapsed=time.monotonic() - started)
+        metrics.observe('upstream_seconds', time.monotonic() - started, host=host)
+        metrics.increment('upstream_requests', host=host, status=response.status_code)
+        return FetchResult(key, ok=response.ok, status=response.status_code, text=response.text,
+                           headers=dict(response.headers), elapsed=time.monotonic() - started)
+
+    def _hedged(self, key, url, params, headers, deadline):
+        # Secondo tentativo in parallelo se il primo non risponde entro hedge_delay: vince il primo utile
+        futures = {self._attempts_pool.submit(self._attempt, key, url, params, headers, deadline)}
+        hedged = False
+        result = None
+        while futures:
+            timeout = self.hedge_delay if not hedged else max(deadline - time.monotonic(), 0)
+            done, futures = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if hedged or time.monotonic() >= deadline:
+                    break
+                hedged = True
+                metrics.increment('upstream_hedges', host=urlsplit(url).netloc)
+                futures.add(self._attempts_pool.submit(self._attempt, key, url, params, headers, deadline))
+                continue
+            for future in done:
+                result = future.result()
+                if result.status is not None and result.status not in RETRY_STATUS:
+                    return result
+        return result or FetchResult(key, error='deadline')
+
+    def get(self, url, params=None, headers=None, key=None, deadline=None):
+        deadline = deadline or time.monotonic() + OVERALL_DEADLINE
+        result = None
+        for attempt in range(self.max_retries + 1):
+            result = self._hedged(key or url, url, params, headers, deadline)
+            if result.status is not None and result.status not in RETRY_STATUS:
+                return result
+            if time.monotonic() + RETRY_BACKOFF * (attempt + 1) >= deadline:
+                break
+            metrics.increment('upstream_retries', host=urlsplit(url).netloc)
+            time.sleep(RETRY_BACKOFF * (attempt + 1))
+        return result
+
+    def fetch_many(self, requests_by_key, deadline=OVERALL_DEADLINE):
+        # requests_by_key: {chiave: (url, params)} -> {chiave: FetchResult}, entro una scadenza complessiva
+        overall = time.monotonic() + deadline
+        futures = {key: self._requests_pool.submit(self.get, url, params, None, key, overall)
+                   for key, (url, params) in requests_by_key.items()}
+        wait(futures.values(), timeout=max(overall - time.monotonic(), 0) + 0.5)
+        results = {}
+        for key, future in futures.items():
+            if future.done() and future.exception() is None:
+                results[key] = future.result()
+            else:
+                results[key] = FetchResult(key, error='deadline' if not future.done() else str(future.exception()))
+        return results
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
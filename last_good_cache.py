@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+from data_loader import BASE_DIR
+from weather_cache import WeatherEntry
+
+# --- CONFIGURAZIONE ---
+LAST_GOOD_PATH = os.environ.get('TOTAL_STEP_LAST_GOOD', os.path.join(BASE_DIR, 'last_good_reports.json'))
+FORMAT_VERSION = 1
+MAX_AGE_HOURS = 48
+# Eta' del report (dall'ora di emissione) oltre cui e' "vecchio" / "scaduto"
+STALE_AFTER = {'metar': timedelta(minutes=75), 'taf': timedelta(hours=7)}
+EXPIRED_AFTER = {'metar': timedelta(hours=3), 'taf': timedelta(hours=12)}
+FRESH, STALE, EXPIRED = 'fresh', 'stale', 'expired'
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+def _time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+# --- ULTIMI REPORT VALIDI SU DISCO (SCRITTURA ATOMICA) ---
+
+class LastGoodStore:
+    def __init__(self, path=LAST_GOOD_PATH, max_age_hours=MAX_AGE_HOURS):
+        self.path = path
+        self.max_age = timedelta(hours=max_age_hours)
+        self._lock = threading.Lock()
+
+    def load(self, now=None):
+        # {ICAO: WeatherEntry}; file assente, corrotto o di un'altra versione = cache vuota
+        now = now or datetime.now(timezone.utc)
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != FORMAT_VERSION:
+            return {}
+        entries = {}
+        for icao, item in data.get('stations', {}).items():
+            try:
+                entry = WeatherEntry(item['metar'], item['taf'], _time(item['metar_issued']),
+                                     _time(item['taf_issued']), _time(item['fetched_at']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if entry.fetched_at is not None and now - entry.fetched_at <= self.max_age:
+                entries[icao] = entry
+        return entries
+
+    def save(self, entries, now=None):
+        # Solo report con ora di emissione riconosciuta; file temporaneo + os.replace: mai un JSON a meta'
+        now = now or datetime.now(timezone.utc)
+        stations = {icao: {'metar': e.metar, 'taf': e.taf, 'metar_issued': _iso(e.metar_issued),
+                           'taf_issued': _iso(e.taf_issued), 'fetched_at': _iso(e.fetched_at)}
+                    for icao, e in entries.items() if e.metar_issued is not None or e.taf_issued is not None}
+        payload = json.dumps({'version': FORMAT_VERSION, 'saved_at': _iso(now), 'stations': stations}, ensure_ascii=False)
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', prefix='.last_good_', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        return len(stations)
+
+
+# --- ETA' DEI REPORT (BADGE DI AGGIORNAMENTO) ---
+
+def report_age(entry, kind, now=None):
+    # (minuti dall'emissione, livello) oppure (None, None) se l'ora di emissione non e' nota
+    issued = getattr(entry, f'{kind}_issued', None) if entry is not None else None
+    if issued is None:
+        return None, None
+    age = (now or datetime.now(timezone.utc)) - issued
+    level = EXPIRED if age > EXPIRED_AFTER[kind] else (STALE if age > STALE_AFTER[kind] else FRESH)
+    return max(0, int(age.total_seconds() // 60)), level
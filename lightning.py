@@ -0,0 +1,335 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+
+from alternate_planner import haversine_nm
+import metrics
+
+log = logging.getLogger(__name__)
+
+# --- CONFIGURAZIONE ---
+LIGHTNING_SOURCE = os.environ.get('TOTAL_STEP_LIGHTNING')  # "tcp://host:porta" oppure percorso di un file
+RADII_NM = (5, 10, 20)
+RING_MINUTES = 60
+CELL_DEG = 1 / 3  # ~20 NM in latitudine: una cella copre al massimo il raggio piu' grande
+MAX_BUFFERED_STRIKES = 200000
+BATCH_SIZE = 500
+BATCH_SECONDS = 0.5
+RECONNECT_SECONDS = 5
+MAX_FUTURE_SECONDS = 60  # fulmini piu' avanti dell'orologio locale (feed sfasato) scartati
+FEED_STALE_SECONDS = 60  # nessuna riga (nemmeno vuota) dalla sorgente per piu' di cosi': feed non attivo
+
+
+# --- PARSING DEGLI EVENTI (CSV "tempo,lat,lon" O JSON PER RIGA) ---
+
+def _epoch(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value.strip().replace('Z', '+00:00')).timestamp()
+
+def parse_strike(line):
+    # (epoch UTC, lat, lon) oppure None per righe non valide
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    try:
+        if line.startswith('{'):
+            event = json.loads(line)
+            t, lat, lon = _epoch(event['time']), float(event['lat']), float(event['lon'])
+        else:
+            fields = line.split(',')
+            t, lat, lon = _epoch(fields[0]), float(fields[1]), float(fields[2])
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    return (t, lat, lon) if -90 <= lat <= 90 and -180 <= lon <= 180 else None
+
+
+# --- GRIGLIA GEOGRAFICA CON SCADENZA E CONTATORI AD ANELLO PER STAZIONE ---
+
+def _cell(lat, lon, cell_deg=CELL_DEG):
+    return int(math.floor(lat / cell_deg)), int(math.floor(lon / cell_deg))
+
+
+class LightningGrid:
+    # Ogni fulmine incrementa, per minuto, i contatori 5/10/20 NM delle sole stazioni vicine alla sua cella:
+    # la domanda "quanti negli ultimi N minuti" e' una somma su N celle dell'anello, senza scorrere i fulmini
+    def __init__(self, stations=(), radii_nm=RADII_NM, ring_minutes=RING_MINUTES, cell_deg=CELL_DEG,
+                 max_buffered=MAX_BUFFERED_STRIKES):
+        self.radii = np.array(radii_nm, dtype=float)
+        self.ring_minutes = ring_minutes
+        self.cell_deg = cell_deg
+        self.max_buffered = max_buffered
+        self._cells = {}       # cella -> deque[(t, lat, lon)] degli ultimi ring_minutes
+        self._buffered = 0
+        self.future = 0        # fulmini scartati perche' nel futuro
+        self._minute = None    # ultimo minuto (epoch // 60) dell'anello
+        self._lock = threading.Lock()
+        self.stations = ()
+        self.set_stations(stations)
+
+    def set_stations(self, stations):
+        # stations: [(ICAO, lat, lon)]; i contatori delle nuove stazioni si ricostruiscono dai fulmini in memoria
+        stations = tuple(stations)
+        if stations == self.stations:
+            return False
+        with self._lock:
+            self.stations = stations
+            self._icaos = [s[0] for s in stations]
+            self._lats = np.array([s[1] for s in stations], dtype=float)
+            self._lons = np.array([s[2] for s in stations], dtype=float)
+            self._counts = np.zeros((len(stations), len(self.radii), self.ring_minutes), dtype=np.int32)
+            self._cell_stations = self._cover(stations)
+            for bucket in self._cells.values():
+                for t, lat, lon in bucket:
+                    self._count(t, lat, lon)
+        return True
+
+    def _cover(self, stations):
+        # Celle che intersecano il cerchio di raggio massimo attorno a ogni stazione
+        cover, radius = {}, float(self.radii.max()) if len(self.radii) else 0.0
+        for i, (_, lat, lon) in enumerate(stations):
+            dlat = radius / 60
+            dlon = radius / (60 * max(math.cos(math.radians(min(abs(lat) + dlat, 89.0))), 0.01))
+            (i0, j0), (i1, j1) = _cell(lat - dlat, lon - dlon, self.cell_deg), _cell(lat + dlat, lon + dlon, self.cell_deg)
+            for ci in range(i0, i1 + 1):
+                for cj in range(j0, j1 + 1):
+                    cover.setdefault((ci, cj), []).append(i)
+        return {cell: np.array(indices) for cell, indices in cover.items()}
+
+    def _advance(self, minute):
+        # Azzera le celle dell'anello dei minuti appena iniziati e scarta i fulmini scaduti
+        if self._minute is not None and minute <= self._minute:
+            return
+        if self._minute is None or minute - self._minute >= self.ring_minutes:
+            self._counts[:] = 0
+        else:
+            for m in range(self._minute + 1, minute + 1):
+                self._counts[:, :, m % self.ring_minutes] = 0
+        self._minute = minute
+        expired = (minute - self.ring_minutes + 1) * 60
+        for cell in list(self._cells):
+            bucket = self._cells[cell]
+            while bucket and bucket[0][0] < expired:
+                bucket.popleft()
+                self._buffered -= 1
+            if not bucket:
+                del self._cells[cell]
+
+    def _count(self, t, lat, lon):
+        candidates = self._cell_stations.get(_cell(lat, lon, self.cell_deg))
+        if candidates is None:
+            return
+        distances = haversine_nm(lat, lon, self._lats[candidates], self._lons[candidates])
+        slot = int(t // 60) % self.ring_minutes
+        for r, radius in enumerate(self.radii):
+            self._counts[candidates[distances <= radius], r, slot] += 1
+
+    def add_many(self, strikes, now=None):
+        # strikes: [(epoch, lat, lon)]; ritorna il numero di fulmini conteggiati (troppo vecchi = scartati).
+        # Un fulmine nel futuro sposterebbe l'anello in avanti azzerando i minuti intermedi: scartato
+        horizon = (now if now is not None else time.time()) + MAX_FUTURE_SECONDS
+        added = 0
+        with self._lock:
+            for t, lat, lon in strikes:
+                if t > horizon:
+                    self.future += 1
+                    continue
+                minute = int(t // 60)
+                self._advance(minute)
+                if minute <= self._minute - self.ring_minutes:
+                    continue
+                self._count(t, lat, lon)
+                if self._buffered < self.max_buffered:
+                    self._cells.setdefault(_cell(lat, lon, self.cell_deg), deque()).append((t, lat, lon))
+                    self._buffered += 1
+                added += 1
+        return added
+
+    def add(self, t, lat, lon):
+        return self.add_many([(t, lat, lon)])
+
+    def counts(self, minutes, now=None):
+        # {ICAO: (n entro 5, 10, 20 NM)} negli ultimi `minutes` minuti (minuto corrente incluso)
+        minutes = max(1, min(int(minutes), self.ring_minutes))
+        now_minute = int((now if now is not None else time.time()) // 60)
+        with self._lock:
+            self._advance(now_minute)
+            slots = [(self._minute - k) % self.ring_minutes for k in range(minutes)]
+            totals = self._counts[:, :, slots].sum(axis=2)
+            icaos = self._icaos
+        return {icao: tuple(int(v) for v in row) for icao, row in zip(icaos, totals)}
+
+    def buffered(self):
+        return self._buffered
+
+
+# --- SORGENTI (FILE IN CODA O SOCKET TCP) E INGESTIONE IN BACKGROUND ---
+
+class FileStrikeSource:
+    def __init__(self, path, follow=True):
+        self.path = path
+        self.follow = follow
+
+    def lines(self):
+        # Come "tail -f": le righe aggiunte al file vengono lette man mano; '' = nessun dato (svuota il lotto)
+        with open(self.path, encoding='utf-8') as f:
+            while True:
+                line = f.readline()
+                if line:
+                    yield line
+                elif not self.follow:
+                    return
+                else:
+                    yield ''
+                    time.sleep(BATCH_SECONDS)
+
+
+class SocketStrikeSource:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def lines(self):
+        while True:
+            try:
+                with socket.create_connection((self.host, self.port), timeout=30) as conn:
+                    conn.settimeout(BATCH_SECONDS)
+                    buffer = b''
+                    while True:
+                        try:
+                            chunk = conn.recv(65536)
+                        except socket.timeout:
+                            yield ''
+                            continue
+                        if not chunk:
+                            break
+                        *lines, buffer = (buffer + chunk).split(b'\n')
+                        for line in lines:
+                            yield line.decode('utf-8', 'replace')
+            except OSError:
+                pass
+            time.sleep(RECONNECT_SECONDS)
+
+def default_source(spec=LIGHTNING_SOURCE):
+    if not spec:
+        return None
+    if spec.startswith('tcp://'):
+        host, _, port = spec[len('tcp://'):].rpartition(':')
+        return SocketStrikeSource(host or 'localhost', int(port))
+    return FileStrikeSource(spec)
+
+
+class LightningFeed(threading.Thread):
+    # Lettura e parsing nel thread del feed; la griglia e' bloccata solo per l'inserimento di un lotto
+    def __init__(self, source, grid=None):
+        super().__init__(name='lightning-feed', daemon=True)
+        self.source = source
+        self.grid = grid or LightningGrid()
+        self.received = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.last_line = None
+        metrics.REGISTRY.gauge('lightning_feed', self._liveness)
+
+    @property
+    def alive(self):
+        # Le sorgenti emettono '' a ogni BATCH_SECONDS senza dati: il silenzio vuol dire feed fermo
+        return self.is_alive() and self.last_line is not None and time.monotonic() - self.last_line < FEED_STALE_SECONDS
+
+    def _liveness(self):
+        age = time.monotonic() - self.last_line if self.last_line is not None else -1
+        return {(('state', 'up'),): int(self.alive), (('state', 'last_line_age_seconds'),): round(age, 1),
+                (('state', 'restarts'),): self.restarts}
+
+    def run(self):
+        # Un errore della sorgente (file ruotato, socket, decodifica) non deve fermare il thread in silenzio
+        while True:
+            try:
+                self._consume()
+                log.warning("Feed fulmini: sorgente terminata, riavvio fra %d s", RECONNECT_SECONDS)
+            except Exception:
+                log.exception("Feed fulmini: errore, riavvio fra %d s", RECONNECT_SECONDS)
+            self.restarts += 1
+            metrics.increment('lightning_feed_restarts')
+            time.sleep(RECONNECT_SECONDS)
+
+    def _consume(self):
+        batch, flushed = [], time.monotonic()
+        for line in self.source.lines():
+            self.last_line = time.monotonic()
+            if line.strip():
+                strike = parse_strike(line)
+                if strike is None:
+                    self.rejected += 1
+                else:
+                    batch.append(strike)
+            if batch and (len(batch) >= BATCH_SIZE or time.monotonic() - flushed >= BATCH_SECONDS):
+                future = self.grid.future
+                added = self.grid.add_many(batch)
+                future = self.grid.future - future
+                self.received += added
+                metrics.increment('lightning_strikes', added, outcome='counted')
+                if future:
+                    metrics.increment('lightning_strikes', future, outcome='future')
+                if added + future < len(batch):
+                    metrics.increment('lightning_strikes', len(batch) - added - future, outcome='late')
+                batch, flushed = [], time.monotonic()
+
+
+# --- SERVER DI PROVA: FULMINI SINTETICI O REPLAY DI UN FILE SU TCP ---
+
+def synthetic_strikes(center, spread_nm, rate_per_minute):
+    lat0, lon0 = center
+    interval = 60.0 / rate_per_minute
+    while True:
+        distance, bearing = spread_nm * math.sqrt(random.random()), random.uniform(0, 2 * math.pi)
+        lat = lat0 + distance * math.cos(bearing) / 60
+        lon = lon0 + distance * math.sin(bearing) / (60 * math.cos(math.radians(lat0)))
+        yield f"{datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')},{lat:.4f},{lon:.4f}\n"
+        time.sleep(interval)
+
+def serve(port, lines_factory, host='127.0.0.1'):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                for line in lines_factory():
+                    self.wfile.write(line.encode('utf-8'))
+            except OSError:
+                pass
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((host, port), Handler) as server:
+        bound_host, bound_port = server.server_address[:2]
+        print(f"Fulmini su tcp://{bound_host}:{bound_port} (TOTAL_STEP_LIGHTNING)", file=sys.stderr)
+        server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Server di prova per il feed fulmini (righe 'tempo,lat,lon')")
+    parser.add_argument('--port', type=int, default=9500)
+    parser.add_argument('--host', default='127.0.0.1', help="indirizzo di ascolto (0.0.0.0 per esporlo in rete)")
+    parser.add_argument('--replay', help="file da inviare riga per riga invece dei fulmini sintetici")
+    parser.add_argument('--center', default='45.68,12.09', help="centro dei fulmini sintetici (lat,lon)")
+    parser.add_argument('--spread', type=float, default=40.0, help="raggio dei fulmini sintetici (NM)")
+    parser.add_argument('--rate', type=float, default=1000.0, help="fulmini sintetici al minuto")
+    args = parser.parse_args(argv)
+    if args.replay:
+        serve(args.port, lambda: FileStrikeSource(args.replay, follow=False).lines(), args.host)
+    else:
+        center = tuple(float(v) for v in args.center.split(','))
+        serve(args.port, lambda: synthetic_strikes(center, args.spread, args.rate), args.host)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
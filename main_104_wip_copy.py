@@ -1,15 +1,34 @@
 import streamlit as st
 import pandas as pd
-import requests
+import json
 import re
-from math import sin, cos, radians, floor
+import hashlib
+from collections import OrderedDict
+from time import perf_counter
 from streamlit_autorefresh import st_autorefresh
-from datetime import datetime, date, time
+from datetime import datetime, date, time, timedelta
 import pytz
 from streamlit_js_eval import streamlit_js_eval
+from http_client import get_client
+from weather_fetch import get_weather_bulk
+from data_loader import load_airport_table, load_limit_profiles
+from weather_cache import WeatherCache, WeatherPoller
+from change_feed import ChangeFeed, subscribe_session, FALLBACK_CHECK_SECONDS
+from shared_cache import get_shared_cache
+from last_good_cache import LastGoodStore, report_age
+from notam import NotamFeed, default_source as notam_source
+from lightning import LightningFeed, default_source as lightning_source, RADII_NM
+from report_parser import CEIL_NOT_REPORTED
+from obs_store import ObservationStore
+from astronomy import astronomy_table
+from panel_html import PANEL_CSS, render_panel, report_column, format_alternate, format_notams, format_wind_lines
+from panel_html import format_meta, format_lightning, format_astronomy
+import metrics
+from alternate_planner import AlternatePlanner, DEFAULT_RADIUS_NM
+from board_eval import format_grouped_procedures, evaluate_board, STATUS_OK, STATUS_DRY_ONLY, STATUS_EXCEEDED
+from board_eval import station_region, station_status, runway_status, worst_status, STATION_OK, STATION_CAUTION, STATION_CRITICAL, STATION_UNKNOWN
 
 # --- CONFIGURAZIONE ---
-IPGEOLOCATION_API_KEY = "KEY"  # Inserisci la tua chiave API
 GITHUB_USER = "angelo79"
 REPO_NAME = "total_step"
 BRANCH = "main"
@@ -25,195 +44,327 @@ AIRAC_EFFECTIVE_DATE = "02 OCT 2025"
 NEXT_PUBLICATION_DATE = "30 OCT 2025"
 NEXT_AIRAC_NUMBER = "A11/25"
 
+# I report nuovi arrivano via push (ChangeFeed): il timer dei pannelli copre solo eta' dei report e ora TAF
+PANEL_REFRESH_SECONDS = 15 * 60
+PAGE_REFRESH_MINUTES = 30
+MAX_PANEL_MODELS = 1000
+# Board scalabile: riepilogo paginato per tutte le stazioni, pannelli completi (e TAF) solo per quelle espanse
+AUTO_EXPAND_STATIONS = 20
+DETAIL_WAIT_SECONDS = 10
+PAGE_SIZES = (25, 50, 100)
+STATION_LABELS = {STATION_OK: 'OK', STATION_CAUTION: 'ATTENZIONE', STATION_CRITICAL: 'CRITICO', STATION_UNKNOWN: 'N/D'}
+WIND_LABELS = {STATUS_OK: 'OK', STATUS_DRY_ONLY: 'SOLO PISTA ASCIUTTA', STATUS_EXCEEDED: 'OLTRE LIMITI'}
+ALTERNATE_LABELS = {True: 'OK', False: 'NO', None: 'n/d'}
+SUMMARY_COLUMNS = ('ICAO', 'Nome', 'Regione', 'Stato', 'Visibilità (m)', 'Ceiling (ft)', 'Vento', 'Procedure OK', 'Alternato METAR')
+
 
 # --- FUNZIONI DI PARSING E CALCOLO ---
 
-def parse_coord(coord_str):
-    if pd.isna(coord_str) or coord_str.strip() == '':
-        return None, None
-    try:
-        lat_str, lon_str = coord_str.split(';')
-        return float(lat_str), float(lon_str)
-    except (ValueError, IndexError):
-        return None, None
-
-def parse_procedures(proc_str):
-    if pd.isna(proc_str) or not isinstance(proc_str, str):
-        return []
-    pattern = r'\(([^;]+);([^;]+);([^)]+)\)'
-    matches = re.findall(pattern, proc_str)
-    procedures = []
-    for match in matches:
-        try:
-            procedures.append({"proc": match[0].strip(), "ceil": int(match[1].strip()), "vis": int(match[2].strip())})
-        except (ValueError, IndexError):
-            continue
-    return procedures
-
-def parse_weather_conditions(report_str):
-    if not isinstance(report_str, str):
-        return 9999, 99999
-    sanitized_report = re.sub(r'\b\d{4}/\d{4}\b', '', report_str)
-    sanitized_report = re.sub(r'\b\d{6}Z\b', '', sanitized_report)
-    vis_matches = re.findall(r'\b(\d{4})\b', sanitized_report)
-    vis_values = [int(v) for v in vis_matches if v.isdigit()]
-    if "CAVOK" in report_str:
-        vis_values.append(9999)
-    visibility = min(vis_values) if vis_values else 9999
-    ceil_matches = re.findall(r'(BKN|OVC)(\d{3})', report_str)
-    ceil_values = [int(height) * 100 for code, height in ceil_matches]
-    ceiling = min(ceil_values) if ceil_values else 99999
-    return visibility, ceiling
-
-def parse_runway_data(data_string):
-    true_hdgs, magn_hdgs = [], []
-    if isinstance(data_string, str):
-        pairs = data_string.strip().split(';')
-        for pair in pairs:
-            match = re.match(r'\((\d+),(\d+)\)', pair.strip())
-            if match:
-                true_hdgs.append(int(match.group(1)))
-                magn_hdgs.append(int(match.group(2)))
-    return true_hdgs, magn_hdgs
-
-def format_grouped_procedures(procedures, vis, ceil):
-    if not procedures:
-        return ""
-    grouped_by_rwy = {}
-    for proc in procedures:
-        match = re.search(r'RWY\s*\d{2}[RLC]?', proc['proc'])
-        rwy_key = match.group(0) if match else "MISC"
-        if rwy_key not in grouped_by_rwy:
-            grouped_by_rwy[rwy_key] = []
-        color = "green" if vis >= proc['vis'] and ceil >= proc['ceil'] else "red"
-        grouped_by_rwy[rwy_key].append(f"<span style='color:{color}'>{proc['proc']}</span>")
-    output_lines = [f"<div><b>{rwy}:</b>&nbsp;&nbsp;{' / '.join(procs)}</div>" for rwy, procs in sorted(grouped_by_rwy.items())]
-    return "".join(output_lines)
-
-@st.cache_data(ttl=21600)
-def get_astronomy_data(lat, lon, api_key):
-    params = {'apiKey': api_key, 'lat': lat, 'long': lon}
-    try:
-        response = requests.get("https://api.ipgeolocation.io/astronomy", params=params)
-        response.raise_for_status()
-        data = response.json()
-        local_tz = pytz.timezone('Europe/Rome')
-        date_today = datetime.strptime(data['date'], '%Y-%m-%d').date()
-        def to_utc(time_str):
-            if not time_str or time_str == '--:--': return "N/A"
-            h, m = map(int, time_str.split(':'))
-            local_dt = local_tz.localize(datetime.combine(date_today, datetime.min.time().replace(hour=h, minute=m)))
-            return local_dt.astimezone(pytz.utc).strftime('%H:%M Z')
-        illum_str = data.get('moon_illumination', {}).get('percentage', '0')
-        illumination_percent = float(illum_str.replace('%', '')) if illum_str else 0.0
-        estimated_millilux = (illumination_percent / 100.0) * 0.25 * 1000
-        return {
-            'sunrise': to_utc(data.get('sunrise')), 'sunset': to_utc(data.get('sunset')),
-            'moonrise': to_utc(data.get('moonrise')), 'moonset': to_utc(data.get('moonset')),
-            'moon_phase': data.get('moon_phase', 'N/A').replace('-', ' ').title(),
-            'moon_luminosity': round(estimated_millilux)
-        }
-    except Exception as e:
-        st.warning(f"Non è stato possibile recuperare i dati astronomici: {e}")
+def get_weather_data(icao):
+    return get_weather_bulk([icao])[icao.strip().upper()]
+
+@st.cache_resource
+def get_observation_store():
+    return ObservationStore()
+
+@st.cache_resource
+def get_weather_poller():
+    # Avvio a freddo: la cache parte dagli ultimi report validi su disco, il poller li aggiorna in background
+    store = LastGoodStore()
+    cache = WeatherCache()
+    cache.seed(store.load())
+    poller = WeatherPoller(cache, store=store, shared=get_shared_cache())
+    poller.listeners.append(get_observation_store().add_weather)
+    change_feed = get_change_feed()
+    poller.change_listeners.append(lambda icaos: publish_changes(change_feed, icaos))
+    poller.start()
+    return poller
+
+@st.cache_resource
+def get_change_feed():
+    return ChangeFeed()
+
+def publish_changes(change_feed, icaos):
+    # Chiamata dal thread del poller: niente st.* qui
+    woken = change_feed.publish(icaos)
+    metrics.increment('change_pushes', len(icaos), outcome='stations')
+    metrics.increment('change_pushes', woken, outcome='sessions')
+
+@st.fragment(run_every=FALLBACK_CHECK_SECONDS)
+def watch_changes(icaos):
+    # Senza risveglio lato server: confronto delle versioni delle stazioni mostrate, riesecuzione solo se cambiate
+    versions = get_change_feed().versions(icaos)
+    previous = st.session_state.get('change_versions')
+    st.session_state['change_versions'] = versions
+    if previous is not None and previous != versions:
+        st.rerun()
+
+@st.cache_resource
+def get_notam_feed():
+    # Sorgente NOTAM opzionale (TOTAL_STEP_NOTAM_URL o notams.txt locale): senza sorgente nessun NOTAM
+    source = notam_source()
+    if source is None:
         return None
+    feed = NotamFeed(source)
+    feed.refresh()
+    return feed
 
-def get_weather_data(icao):
-    metar, taf = "METAR non disponibile", "TAF non disponibile"
-    headers = {'User-Agent': 'TotalStep-Streamlit-App/Final'}
-    try:
-        r_metar = requests.get(f'https://aviationweather.gov/api/data/metar?ids={icao}&format=raw&hoursBeforeNow=2', headers=headers)
-        if r_metar.ok and r_metar.text: metar = r_metar.text.strip()
-    except requests.exceptions.RequestException: pass
-    try:
-        r_taf = requests.get(f'https://aviationweather.gov/api/data/taf?ids={icao}&format=raw&hoursBeforeNow=3', headers=headers)
-        if r_taf.ok and r_taf.text: taf = r_taf.text.strip()
-        elif r_taf.status_code == 404: taf = "TAF non emesso per questa stazione."
-    except requests.exceptions.RequestException: pass
-    return metar, taf
-
-@st.cache_data
-def load_aircraft_limits(url):
-    df = pd.read_csv(url, dtype=float)
-    df.columns = df.columns.str.strip()
-    return df.iloc[0].to_dict()
-
-def parse_multiple_wind(report_str):
-    if not isinstance(report_str, str): return []
-    pattern = r'(\d{3}|VRB)(\d{2,3})(?:G(\d{2,3}))?KT'
-    matches = re.findall(pattern, report_str)
-    return [(int(d) if d != 'VRB' else 0, int(s)) for d, s, g in matches if int(d if d != 'VRB' else 0) != 0 or int(s) != 0]
-
-def get_max_wind_components(winds, rwy_true_heading):
-    max_hw, max_tw, max_cw, max_w = 0.0, 0.0, 0.0, 0.0
-    for wind_dir, wind_speed in winds:
-        angle_diff = radians(wind_dir - rwy_true_heading)
-        headwind_comp = wind_speed * cos(angle_diff)
-        if headwind_comp >= 0: max_hw = max(max_hw, headwind_comp)
-        else: max_tw = max(max_tw, abs(headwind_comp))
-        max_cw = max(max_cw, abs(wind_speed * sin(angle_diff)))
-        max_w = max(max_w, wind_speed)
-    return max_hw, max_tw, max_cw, max_w
-
-def format_runway_name(magnetic_heading):
-    return f"RWY {round(magnetic_heading / 10):02d}"
-
-def get_colored_wind_display(max_headwind, max_tailwind, max_crosswind, max_wind, limits):
-    parts = []
-    if max_headwind > 0.0: parts.append(f"<span style='color:{\"red\" if max_headwind > limits['max_headwind'] else \"green\"}'>Max Headwind: {max_headwind:.1f} kts</span>")
-    if max_tailwind > 0.0: parts.append(f"<span style='color:{\"red\" if max_tailwind > limits['max_tailwind'] else \"green\"}'>Max Tailwind: {max_tailwind:.1f} kts</span>")
-    color_cw = "red" if max_crosswind > limits['max_crosswind_dry'] else ("orange" if max_crosswind > limits['max_crosswind_wet'] else "green")
-    parts.append(f"<span style='color:{color_cw}'>Max Crosswind: {max_crosswind:.1f} kts</span>")
-    parts.append(f"<span style='color:{\"red\" if max_wind > limits['max_wind'] else \"green\"}'>Max Wind: {max_wind:.1f} kts</span>")
-    return " | ".join(parts)
-    
-# --- NUOVE FUNZIONI PER ALTERNATO METEO ---
-def estrai_fasce_TAF(taf_str):
-    if not isinstance(taf_str, str) or not taf_str.strip():
-        return []
-
-    taf_text = ' '.join(taf_str.strip().split())
-    taf_text = re.sub(r'^TAF\s+(?:AMD|COR)\s+', 'TAF ', taf_text)
-    change_groups = re.split(r'(BECMG|TEMPO|FM\d{6})', taf_text)
-    
-    base_forecast_text = change_groups[0]
-    validity_match = re.search(r'\d{6}Z\s+(\d{4}/\d{4})', base_forecast_text)
-    main_period_label = validity_match.group(1) if validity_match else "Base"
-
-    segments = [(main_period_label, base_forecast_text)]
-    
-    for i in range(1, len(change_groups), 2):
-        change_type = change_groups[i]
-        weather_part = change_groups[i+1]
-        
-        period_match = re.search(r'(\d{4}/\d{4})', weather_part)
-        if period_match:
-            label = f"{change_type} {period_match.group(1)}"
-        elif 'FM' in change_type:
-            label = change_type
+def get_notam_index():
+    feed = get_notam_feed()
+    if feed is None:
+        return None
+    feed.refresh_async()
+    return feed.index
+
+@st.cache_resource
+def get_lightning_feed():
+    # Feed fulmini opzionale (TOTAL_STEP_LIGHTNING): ingestione in un thread, la pagina legge solo i contatori
+    source = lightning_source()
+    if source is None:
+        return None
+    feed = LightningFeed(source)
+    feed.start()
+    return feed
+
+def show_trend_charts(observations):
+    if not observations:
+        st.caption("Nessuna osservazione memorizzata per questo intervallo.")
+        return
+    trend = pd.DataFrame({
+        'Pressione (hPa)': [o.pressure for o in observations],
+        'Visibilità (m)': [o.visibility for o in observations],
+        'Ceiling (ft)': [o.ceiling if o.ceiling < CEIL_NOT_REPORTED else None for o in observations],
+    }, index=pd.DatetimeIndex([o.time for o in observations], name='UTC'))
+    chart_cols = st.columns(3)
+    for chart_col, column in zip(chart_cols, trend.columns):
+        with chart_col:
+            st.caption(column)
+            st.line_chart(trend[[column]], height=160)
+
+# --- PANNELLI AEROPORTO INCREMENTALI (FIRMA DI CAMBIAMENTO) ---
+def panel_signature(airport, metar, taf, profiles, is_first, now, notam_ids=()):
+    # Cambia solo con report, riga CSV, profili limiti, AIRAC, NOTAM attivi o ora UTC (caso peggiore TAF sulle ore residue)
+    parts = (metar, taf, airport.signature, json.dumps(profiles, sort_keys=True), AIRAC_NUMBER, is_first, now.strftime('%Y%m%d%H'), notam_ids)
+    return hashlib.sha1('\x1f'.join(map(str, parts)).encode('utf-8')).hexdigest()
+
+@st.cache_resource
+def get_panel_models():
+    return OrderedDict()
+
+def build_panel_models(entries, profiles, first_airport_icao, now, notams=None):
+    # entries: [(Airport, metar, taf, firma)]; valutazione di tutte le stazioni cambiate in un'unica passata,
+    # HTML statico del pannello gia' pronto per ogni profilo aeromobile: cambiare profilo non ricalcola nulla
+    stations = evaluate_board([(airport, metar, taf) for airport, metar, taf, _ in entries], next(iter(profiles.values())),
+                              first_airport_icao, now, notams, profiles)
+    models = []
+    for (airport, _, _, signature), station in zip(entries, stations):
+        procedures = airport.procedures
+        metar, taf = station['conditions']['metar'], station['conditions']['taf']
+        has_wind = {source: any(runway[source] for runway in station['runways']) for source in ('metar', 'taf')}
+        unavailable = {p['procedure']: p['notams'] for p in station['procedures'] if p['notams']}
+        metar_procedures = format_grouped_procedures(procedures, metar['visibility'], metar['ceiling'], unavailable)
+        taf_procedures = format_grouped_procedures(procedures, taf['visibility'], taf['ceiling'], unavailable)
+        models.append({
+            'signature': signature, 'icao': station['icao'], 'name': station['name'],
+            'body': format_notams(station['notams']) + format_alternate(station['alternate']),
+            'metar_column': {name: report_column("METAR", station['metar'], metar_procedures, bool(unavailable), "Wind Components",
+                                                 format_wind_lines(station['runways'], 'metar', name) if has_wind['metar'] else None,
+                                                 "Wind not reported or calm.", metar['visibility'] is not None) for name in profiles},
+            'taf_column': {name: report_column("TAF", station['taf'], taf_procedures, bool(unavailable), "Forecast Wind Components",
+                                               format_wind_lines(station['runways'], 'taf', name) if has_wind['taf'] else None,
+                                               "No specific wind forecast.", taf['visibility'] is not None) for name in profiles},
+        })
+    return models
+
+def get_panel_model_batch(airports, weather_by_icao, profiles, first_airport_icao, now=None):
+    # Si ricalcolano solo le stazioni con firma cambiata; le altre riusano il modello del processo
+    now = now or datetime.now(pytz.utc)
+    notams = get_notam_index()
+    panel_models = get_panel_models()
+    models, entries = {}, []
+    for airport in airports:
+        icao = airport.icao
+        metar, taf = weather_by_icao[icao]
+        notam_ids = notams.active_ids(icao, now) if notams is not None else ()
+        signature = panel_signature(airport, metar, taf, profiles, icao == first_airport_icao, now, notam_ids)
+        model = panel_models.get(icao)
+        if model is not None and model['signature'] == signature:
+            metrics.increment('panel_models', result='hit')
+            models[icao] = model
         else:
-            label = change_type
-        segments.append((label, weather_part))
-
-    parsed_segments = []
-    current_vis, current_ceil = parse_weather_conditions(base_forecast_text)
-    parsed_segments.append((segments[0][0], current_vis, current_ceil))
-
-    for label, text in segments[1:]:
-        vis_change, ceil_change = parse_weather_conditions(text)
-        if 'TEMPO' not in label:
-             current_vis = vis_change if vis_change != 9999 else current_vis
-             current_ceil = ceil_change if ceil_change != 99999 else current_ceil
-        parsed_segments.append((label, vis_change, ceil_change))
-
-    return parsed_segments
-
-
-def box_ALT(ok):
-    color = "#34c759" if ok else "#fa5252"
-    return f'<span style="display:inline-block; min-width:42px; background:{color}; color:white; font-weight:600; border-radius:4px; text-align:center; margin:2px; padding:2px 7px;">ALT</span>'
+            metrics.increment('panel_models', result='miss')
+            entries.append((airport, metar, taf, signature))
+    for model in build_panel_models(entries, profiles, first_airport_icao, now, notams) if entries else []:
+        models[model['icao']] = panel_models[model['icao']] = model
+        panel_models.move_to_end(model['icao'])
+    while len(panel_models) > MAX_PANEL_MODELS:
+        panel_models.popitem(last=False)
+    return models
+
+# --- RIEPILOGO STAZIONI (SOLO METAR, FIRMA PER STAZIONE) ---
+def summary_signature(airport, metar, profiles, is_first, notam_ids=()):
+    parts = (metar, airport.signature, json.dumps(profiles, sort_keys=True), AIRAC_NUMBER, is_first, notam_ids)
+    return hashlib.sha1('\x1f'.join(map(str, parts)).encode('utf-8')).hexdigest()
+
+@st.cache_resource
+def get_summary_rows():
+    return OrderedDict()
+
+def summary_row(station, profile):
+    # METAR mancante: visibilita'/ceiling vuoti, procedure e alternato "n/d" (mai OK)
+    metar = station['conditions']['metar']
+    go = [p['metar_go'] for p in station['procedures']]
+    known = metar['visibility'] is not None
+    wind = worst_status(s for runway in station['runways'] if runway['metar'] for s in runway_status(runway['metar'], profile).values())
+    alternate = station['alternate']
+    return {'ICAO': station['icao'], 'Nome': station['name'], 'Regione': station_region(station['icao']),
+            'Stato': STATION_LABELS[station_status(station, profile=profile)], 'Visibilità (m)': metar['visibility'],
+            'Ceiling (ft)': metar['ceiling'] if known and metar['ceiling'] < CEIL_NOT_REPORTED else None,
+            'Vento': WIND_LABELS.get(wind, '-'), 'Procedure OK': (f"{sum(map(bool, go))}/{len(go)}" if known else 'n/d') if go else '-',
+            'Alternato METAR': ALTERNATE_LABELS[alternate['metar_ok']] if alternate and alternate['procedure'] else '-'}
+
+def get_board_summary(airports, weather_by_icao, profiles, first_airport_icao, profile):
+    # Il riepilogo usa solo il METAR: le stazioni non espanse non hanno TAF in cache;
+    # in cache le righe di tutti i profili, si restituiscono quelle del profilo scelto
+    now = datetime.now(pytz.utc)
+    notams = get_notam_index()
+    summary_rows = get_summary_rows()
+    summary, entries, signatures = {}, [], {}
+    for airport in airports:
+        icao = airport.icao
+        metar = weather_by_icao[icao][0]
+        notam_ids = notams.active_ids(icao, now) if notams is not None else ()
+        signature = summary_signature(airport, metar, profiles, icao == first_airport_icao, notam_ids)
+        cached = summary_rows.get(icao)
+        if cached is not None and cached[0] == signature:
+            summary[icao] = cached[1]
+        else:
+            entries.append((airport, metar, ''))
+            signatures[icao] = signature
+    with metrics.timer('stage_seconds', stage='summary'):
+        stations = evaluate_board(entries, next(iter(profiles.values())), first_airport_icao, now, notams, profiles) if entries else []
+        for station in stations:
+            summary[station['icao']] = {name: summary_row(station, name) for name in profiles}
+            summary_rows[station['icao']] = (signatures[station['icao']], summary[station['icao']])
+            summary_rows.move_to_end(station['icao'])
+    while len(summary_rows) > MAX_PANEL_MODELS:
+        summary_rows.popitem(last=False)
+    return [summary[airport.icao][profile] for airport in airports]
+
+def show_board_summary(summary, extra_columns):
+    # Ricerca, filtri e paginazione: alla tabella arriva solo la pagina corrente
+    search_col, region_col, status_col, size_col = st.columns([2, 2, 2, 1])
+    query = search_col.text_input("Cerca ICAO o nome", key="board_search").strip().upper()
+    regions = region_col.multiselect("Regione", sorted({r['Regione'] for r in summary}), key="board_regions")
+    statuses = status_col.multiselect("Stato", list(STATION_LABELS.values()), key="board_statuses")
+    page_size = size_col.selectbox("Per pagina", PAGE_SIZES, key="board_page_size")
+    filtered = [r for r in summary
+                if (not query or query in r['ICAO'] or query in r['Nome'].upper())
+                and (not regions or r['Regione'] in regions) and (not statuses or r['Stato'] in statuses)]
+    n_pages = max(1, -(-len(filtered) // page_size))
+    if st.session_state.get("board_page", 1) > n_pages:
+        st.session_state["board_page"] = 1
+    page = st.number_input(f"Pagina (di {n_pages})", min_value=1, max_value=n_pages, step=1, key="board_page") if n_pages > 1 else 1
+    page_rows = filtered[(page - 1) * page_size:page * page_size]
+    st.caption(f"{len(filtered)} stazioni su {len(summary)}; selezionare le righe per espandere METAR/TAF completi")
+    frame = pd.DataFrame(page_rows, columns=SUMMARY_COLUMNS)
+    for column, values in extra_columns.items():
+        frame[column] = [values.get(r['ICAO']) for r in page_rows]
+    event = st.dataframe(frame, hide_index=True,
+                         on_select="rerun", selection_mode="multi-row", key="board_table")
+    selected = [page_rows[i]['ICAO'] for i in event.selection.rows if i < len(page_rows)] if event else []
+    return page_rows, selected
+
+@st.fragment(run_every=PANEL_REFRESH_SECONDS)
+def render_airport_panel(airport, context):
+    # Ogni pannello si aggiorna da solo: alla riesecuzione del frammento si rilegge la cache del poller
+    with metrics.timer('stage_seconds', stage='render'):
+        show_airport_panel(airport, context)
+
+def show_airport_panel(airport, context):
+    icao = airport.icao
+    weather_poller = get_weather_poller()
+    # Il pannello visibile mantiene viva la richiesta di TAF per la sua stazione
+    weather_poller.request_detail([icao])
+    model = get_panel_model_batch([airport], {icao: weather_poller.cache.weather(icao)}, context['profiles'], context['first_airport_icao'])[icao]
+    entry = weather_poller.cache.get(icao)
+    # Eta' dei report, fulmini ed effemeridi cambiano col tempo: inseriti nel blocco a ogni render
+    lightning_feed = get_lightning_feed()
+    # Feed fermo: nessun conteggio invece di un falso "nessun fulmine"
+    counts = lightning_feed.grid.counts(context['lightning_minutes']).get(icao) if lightning_feed is not None and lightning_feed.alive else None
+    panel = render_panel(model, context['profile'], format_meta(entry), format_lightning(counts, context['lightning_minutes']),
+                         format_astronomy(astronomy_table(context['astro_stations']).get(icao)))
+    metrics.increment('panel_html_bytes', len(panel))
+    st.markdown(panel, unsafe_allow_html=True)
+    with st.expander(f"Trend ultime {context['trend_hours']} ore"):
+        show_trend_charts(get_observation_store().series(icao, context['trend_hours']))
+
+
+# --- PIANIFICATORE ALTERNATI ---
+def planner_weather(icaos):
+    # Solo dalla cache del poller, mai un download durante il rerun: le candidate senza TAF sono accodate al poller
+    weather_poller = get_weather_poller()
+    pending = [icao for icao in icaos if not weather_poller.cache.has_taf(icao)]
+    if pending:
+        weather_poller.request_detail(pending)
+    return weather_poller.cache.snapshot(icaos)
+
+@st.fragment
+def show_alternate_planner(airports):
+    # Piano calcolato solo alla conferma del modulo (il corpo dell'expander gira a ogni rerun anche se chiuso)
+    with st.expander("Pianificatore alternati"):
+        destinations = [airport.icao for airport in airports if airport.has_position]
+        if not destinations:
+            st.caption("Nessuna base con coordinate.")
+            return
+        with st.form("alternate_planner"):
+            dest_col, eta_col, radius_col = st.columns(3)
+            destination = dest_col.selectbox("Destinazione", destinations)
+            eta_hours = eta_col.slider("Finestra ETA (ore da adesso, UTC)", 0, 30, (1, 3))
+            radius = radius_col.number_input("Raggio (NM)", min_value=25, max_value=1000, value=DEFAULT_RADIUS_NM, step=25)
+            submitted = st.form_submit_button("Calcola alternati")
+        if submitted:
+            now = datetime.now(pytz.utc)
+            eta_start = now + timedelta(hours=eta_hours[0])
+            eta_end = now + timedelta(hours=max(eta_hours[1], eta_hours[0] + 1))
+            with metrics.timer('stage_seconds', stage='alternate_planner'):
+                results = AlternatePlanner(airports, fetch=planner_weather).plan(destination, eta_start, eta_end, radius)
+            st.session_state['alternate_plan'] = {
+                'caption': f"ETA {eta_start.strftime('%d %H:%MZ')} - {eta_end.strftime('%d %H:%MZ')}, entro {radius} NM da {destination}",
+                'results': results, 'pending': [r['icao'] for r in results if not get_weather_poller().cache.has_taf(r['icao'])]}
+        plan = st.session_state.get('alternate_plan')
+        if plan is None:
+            return
+        st.caption(plan['caption'])
+        if plan['pending']:
+            st.caption(f"TAF in arrivo per {', '.join(plan['pending'])}: ricalcolare tra poco per includerli.")
+        if not plan['results']:
+            st.info("Nessuna base con procedure entro il raggio indicato.")
+        else:
+            st.dataframe(pd.DataFrame(plan['results']), hide_index=True)
+
+# --- DIAGNOSTICA PRESTAZIONI ---
+@st.cache_resource
+def get_metrics_server():
+    return metrics.start_metrics_server()
+
+def show_diagnostics_sidebar(metrics_server):
+    st.sidebar.markdown("**Tempi per fase (ultimi 15 min)**")
+    summary = metrics.REGISTRY.summary()
+    if summary:
+        st.sidebar.dataframe(pd.DataFrame(summary), hide_index=True)
+    counters = [{'contatore': name, 'etichette': ', '.join(f'{k}={v}' for k, v in labels), 'valore': value}
+                for (name, labels), value in metrics.REGISTRY.counters().items()]
+    if counters:
+        st.sidebar.dataframe(pd.DataFrame(counters), hide_index=True)
+    st.sidebar.caption(f"Endpoint Prometheus: porta {metrics_server.server_port}, /metrics" if metrics_server else "Endpoint Prometheus non attivo (TOTAL_STEP_METRICS_PORT non impostata o porta occupata)")
 
 # --- INTERFACCIA STREAMLIT ---
+rerun_started = perf_counter()
+metrics_server = get_metrics_server()
 st.set_page_config(layout="wide")
+# Classi condivise dai pannelli: un solo foglio di stile per pagina invece degli stili inline ripetuti
+st.markdown(PANEL_CSS, unsafe_allow_html=True)
 st.markdown("<h1 style='text-align: center'>TOTAL STEP</h1>", unsafe_allow_html=True)
 st.markdown("<p style='text-align: right; font-size: 0.9em'>by angelo.corallo@am.difesa.it</p>", unsafe_allow_html=True)
 
@@ -237,105 +388,89 @@ html_code = f"""
 """
 st.markdown(html_code, unsafe_allow_html=True)
 
-st_autorefresh(interval=5 * 60 * 1000, key="auto_refresh_counter")
+# Refresh completo della pagina solo per CSV statici e nuove stazioni; i pannelli si aggiornano da soli
+st_autorefresh(interval=PAGE_REFRESH_MINUTES * 60 * 1000, key="auto_refresh_counter")
+trend_hours = st.sidebar.slider("Trend pressione / visibilità / ceiling (ore)", 1, 24, 6)
+lightning_minutes = st.sidebar.slider("Fulmini: finestra (minuti)", 5, 60, 15) if get_lightning_feed() is not None else 15
+show_diagnostics = st.sidebar.checkbox("Diagnostica prestazioni", value=False)
 now = datetime.now(pytz.timezone('Europe/Rome'))
 st.info(f"Last update (local time): {now.strftime('%H:%M:%S on %d/%m/%Y')}")
 
 try:
-    aircraft_limits = load_aircraft_limits(url_limits)
-    airports_df = pd.read_csv(url_airports, skipinitialspace=True)
-    first_airport_row = airports_df[airports_df['coord'].notna()].iloc[0] if 'coord' in airports_df.columns and not airports_df[airports_df['coord'].notna()].empty else None
-    
-    if first_airport_row is not None:
-        lat, lon = parse_coord(first_airport_row['coord'])
-        first_airport_icao = first_airport_row['ICAO'].strip()
-    else:
-        lat, lon, first_airport_icao = None, None, None
-
-    for index, row in airports_df.iterrows():
-        icao, name = row["ICAO"].strip(), row["Name"].strip()
-        st.subheader(f"{icao} - {name}")
-
-        # --- LOGICA ALTERNATO METEO ---
-        if icao != first_airport_icao:
-            procedures = parse_procedures(row.get('proc'))
-            if not procedures:
-                st.markdown("<b>Alternato meteo:</b> Nessuna procedura di avvicinamento disponibile.", unsafe_allow_html=True)
-            else:
-                min_proc = min(procedures, key=lambda p: (p['ceil'], p['vis']))
-                ceil_proc, vis_proc = min_proc['ceil'], min_proc['vis']
-                vis_req = max(vis_proc + 2000, 3000)
-                ceil_req = max(ceil_proc + 500, 1000)
-                
-                st.markdown(f"**Requisiti Alternato (basati su {min_proc['proc']}):** Visibilità &ge; {vis_req}m, Ceiling &ge; {ceil_req}ft")
-                
-                metar_str = get_weather_data(icao)[0]
-                metar_vis, metar_ceil = parse_weather_conditions(metar_str)
-                metar_ok = (metar_vis >= vis_req) and (metar_ceil >= ceil_req)
-                st.markdown(f"**METAR:** {box_ALT(metar_ok)}", unsafe_allow_html=True)
-                
-                taf_str = get_weather_data(icao)[1]
-                if taf_str and "non emesso" not in taf_str:
-                    st.markdown("**TAF:**")
-                    taf_segments = estrai_fasce_TAF(taf_str)
-                    for label, vis, ceil in taf_segments:
-                        taf_ok = (vis >= vis_req) and (ceil >= ceil_req)
-                        st.markdown(f"- **{label.strip()}:** {box_ALT(taf_ok)}", unsafe_allow_html=True)
-                else:
-                    st.markdown("**TAF:** Non disponibile o non emesso.")
-        
-        # --- FUNZIONALITÀ ORIGINALI DELLO SCRIPT (MANTENUTE) ---
-        if icao == first_airport_icao and lat is not None:
-            astro_data = get_astronomy_data(lat, lon, IPGEOLOCATION_API_KEY)
-            if astro_data:
-                st.markdown(f"<div style='font-size: 0.9em'><b>Sunrise:</b> {astro_data['sunrise']} | <b>Sunset:</b> {astro_data['sunset']}<br><b>Moonrise:</b> {astro_data['moonrise']} | <b>Moonset:</b> {astro_data['moonset']}<br><b>Moon Phase:</b> {astro_data['moon_phase']} | <b>Max Illumination:</b> {astro_data['moon_luminosity']} millilux</div>", unsafe_allow_html=True)
-            st.markdown("<br>", unsafe_allow_html=True)
-        
-        metar, taf = get_weather_data(icao)
-        procedures = parse_procedures(row.get('proc'))
-        ceil_vis_col1, ceil_vis_col2 = st.columns(2)
-
-        with ceil_vis_col1:
-            st.text("METAR")
-            st.text_area("METAR_area", metar, height=150, key=f"metar_{icao}", label_visibility="collapsed")
-            if procedures:
-                metar_vis, metar_ceil = parse_weather_conditions(metar)
-                st.markdown("<i>Procedures: <span style='color:green'>GREEN</span> at or above minima / <span style='color:red'>RED</span> below minima</i>", unsafe_allow_html=True)
-                st.markdown(format_grouped_procedures(procedures, metar_vis, metar_ceil), unsafe_allow_html=True)
-                st.markdown("<br>", unsafe_allow_html=True)
-            st.markdown("<b>Wind Components</b>")
-            metar_winds = parse_multiple_wind(metar)
-            if not metar_winds:
-                st.info("Wind not reported or calm.")
-            else:
-                true_hdgs, magn_hdgs = parse_runway_data(row.get('RWY(truenorth;magnnorth)'))
-                wind_lines = []
-                for true_hdg, magn_hdg in zip(true_hdgs, magn_hdgs):
-                    max_hw, max_tw, max_cw, max_w = get_max_wind_components(metar_winds, true_hdg)
-                    wind_lines.append(f"<div><b>{format_runway_name(magn_hdg)}:</b> {get_colored_wind_display(max_hw, max_tw, max_cw, max_w, aircraft_limits)}</div>")
-                st.markdown("".join(wind_lines), unsafe_allow_html=True)
-
-        with ceil_vis_col2:
-            st.text("TAF")
-            st.text_area("TAF_area", taf, height=150, key=f"taf_{icao}", label_visibility="collapsed")
-            if procedures:
-                taf_vis, taf_ceil = parse_weather_conditions(taf)
-                st.markdown("<i>Procedures: <span style='color:green'>GREEN</span> at or above minima / <span style='color:red'>RED</span> below minima</i>", unsafe_allow_html=True)
-                st.markdown(format_grouped_procedures(procedures, taf_vis, taf_ceil), unsafe_allow_html=True)
-                st.markdown("<br>", unsafe_allow_html=True)
-            st.markdown("<b>Forecast Wind Components</b>")
-            taf_winds = parse_multiple_wind(taf)
-            if not taf_winds:
-                st.info("No specific wind forecast.")
-            else:
-                true_hdgs, magn_hdgs = parse_runway_data(row.get('RWY(truenorth;magnnorth)'))
-                wind_lines = []
-                for true_hdg, magn_hdg in zip(true_hdgs, magn_hdgs):
-                    max_hw, max_tw, max_cw, max_w = get_max_wind_components(taf_winds, true_hdg)
-                    wind_lines.append(f"<div><b>{format_runway_name(magn_hdg)}:</b> {get_colored_wind_display(max_hw, max_tw, max_cw, max_w, aircraft_limits)}</div>")
-                st.markdown("".join(wind_lines), unsafe_allow_html=True)
-        st.markdown("---")
+    # CSV statici rivalidati al massimo ogni pochi minuti, con fallback sui file locali
+    limit_profiles = load_limit_profiles(url_limits, PATH_LIMITS, AIRAC_NUMBER)
+    # Profilo per sessione: tutti i profili sono gia' valutati, la scelta cambia solo cosa si mostra
+    profile = st.sidebar.selectbox("Profilo aeromobile", list(limit_profiles), key="limit_profile")
+    limits = limit_profiles[profile]
+    st.sidebar.caption(f"Limiti (kt): vento {limits['max_wind']:g}, head {limits['max_headwind']:g}, tail {limits['max_tailwind']:g}, "
+                       f"cross {limits['max_crosswind_dry']:g} asciutta / {limits['max_crosswind_wet']:g} bagnata")
+    # Modello tipizzato degli aeroporti, ricostruito solo quando cambiano CSV o AIRAC
+    airports = load_airport_table(url_airports, PATH_AIRPORTS, AIRAC_NUMBER)
+    first_airport_icao = airports.home_base
+    if airports.problems:
+        st.warning("Righe scartate dal CSV aeroporti: " + "; ".join(airports.problems))
+
+    # METAR/TAF letti dalla cache condivisa del processo, aggiornata da un unico poller
+    weather_poller = get_weather_poller()
+    weather_poller.watch(airports.icaos)
+    # Si attende il primo poll solo per le stazioni senza un report valido salvato su disco
+    if weather_poller.cache.missing(airports.icaos):
+        with metrics.timer('stage_seconds', stage='weather_wait'):
+            weather_poller.wait_ready(timeout=15)
+    if weather_poller.upstream_ok is None:
+        st.info("Avvio: ultimi report validi dalla cache locale, aggiornamento in corso.")
+    elif not weather_poller.upstream_ok:
+        st.warning("aviationweather.gov non raggiungibile: mostrati gli ultimi report validi salvati (vedere l'età di ogni report).")
+    weather_by_icao = weather_poller.cache.snapshot(airports.icaos)
+    get_observation_store().backfill_async(weather_poller.cache.stations())
+
+    astro_stations = airports.stations()
+    show_alternate_planner(airports)
+
+    # Riepilogo di tutte le stazioni; pannelli solo per quelle fissate, selezionate o (board piccolo) in pagina
+    st.subheader("Riepilogo stazioni")
+    pinned = st.sidebar.multiselect("Stazioni fissate", list(airports.icaos), key="pinned_stations")
+    summary = get_board_summary(airports, weather_by_icao, limit_profiles, first_airport_icao, profile)
+    # Stazioni in attenzione/critiche: polling piu' stretto per SPECI/AMD
+    watched_labels = (STATION_LABELS[STATION_CAUTION], STATION_LABELS[STATION_CRITICAL])
+    weather_poller.scheduler.set_watched(r['ICAO'] for r in summary if r['Stato'] in watched_labels)
+    # Colonne che cambiano col tempo, fuori dalla cache del riepilogo: eta' del METAR e fulmini
+    extra_columns = {'METAR (min fa)': {icao: report_age(weather_poller.cache.get(icao), 'metar')[0] for icao in airports.icaos}}
+    lightning_feed = get_lightning_feed()
+    if lightning_feed is not None:
+        lightning_feed.grid.set_stations(astro_stations)
+        if lightning_feed.alive:
+            extra_columns[f"Fulmini {'/'.join(map(str, RADII_NM))} NM"] = {
+                icao: '/'.join(map(str, counts)) for icao, counts in lightning_feed.grid.counts(lightning_minutes).items()}
+        else:
+            extra_columns[f"Fulmini {'/'.join(map(str, RADII_NM))} NM"] = {icao: 'n/d' for icao, _, _ in astro_stations}
+            st.sidebar.warning("Feed fulmini non attivo: conteggi non disponibili")
+    page_rows, selected = show_board_summary(summary, extra_columns)
+    auto_expanded = [r['ICAO'] for r in page_rows] if len(airports) <= AUTO_EXPAND_STATIONS else []
+    detail_icaos = [icao for icao in dict.fromkeys(pinned + selected + auto_expanded) if icao in airports]
+    # Aggiornamento guidato dai cambi: la sessione si riesegue solo per un report nuovo di una stazione mostrata
+    shown_icaos = list(dict.fromkeys([r['ICAO'] for r in page_rows] + detail_icaos))
+    if not subscribe_session(get_change_feed(), shown_icaos):
+        watch_changes(shown_icaos)
+    # Con upstream irraggiungibile non si attende: restano i TAF salvati
+    if detail_icaos and weather_poller.request_detail(detail_icaos) and weather_poller.upstream_ok is not False:
+        with metrics.timer('stage_seconds', stage='detail_wait'):
+            weather_poller.wait_detail(detail_icaos, timeout=DETAIL_WAIT_SECONDS)
+
+    # Modelli dei pannelli con firma cambiata calcolati insieme (vento vettoriale sulle stazioni espanse)
+    detail_airports = [airports[icao] for icao in detail_icaos]
+    get_panel_model_batch(detail_airports, weather_poller.cache.snapshot(detail_icaos), limit_profiles, first_airport_icao)
+    panel_context = {'profiles': limit_profiles, 'profile': profile, 'first_airport_icao': first_airport_icao, 'astro_stations': astro_stations,
+                     'trend_hours': trend_hours, 'lightning_minutes': lightning_minutes}
+    if not detail_airports:
+        st.info("Selezionare una o più stazioni nel riepilogo (o fissarle dalla barra laterale) per i pannelli completi.")
+    for airport in detail_airports:
+        render_airport_panel(airport, panel_context)
 
 except Exception as e:
     st.error(f"Impossibile caricare o processare i file: {e}")
     st.exception(e)
+
+metrics.observe('rerun_seconds', perf_counter() - rerun_started)
+if show_diagnostics:
+    show_diagnostics_sidebar(metrics_server)
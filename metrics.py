@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# --- CONFIGURAZIONE ---
+METRICS_PREFIX = 'total_step'
+# Endpoint /metrics solo su richiesta (TOTAL_STEP_METRICS_PORT), di default raggiungibile solo in locale
+METRICS_PORT = int(os.environ['TOTAL_STEP_METRICS_PORT']) if os.environ.get('TOTAL_STEP_METRICS_PORT') else None
+METRICS_HOST = os.environ.get('TOTAL_STEP_METRICS_HOST', '127.0.0.1')
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WINDOW_SECONDS = 15 * 60
+WINDOW_MAX_SAMPLES = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+
+log = logging.getLogger(__name__)
+
+
+# --- ISTOGRAMMA: BUCKET CUMULATIVI + FINESTRA MOBILE PER I QUANTILI ---
+
+class Histogram:
+    __slots__ = ('buckets', 'count', 'total', 'window')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.window = deque(maxlen=WINDOW_MAX_SAMPLES)
+
+    def observe(self, value, now):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.window.append((now, value))
+
+    def recent(self, now):
+        while self.window and self.window[0][0] < now - WINDOW_SECONDS:
+            self.window.popleft()
+        return np.array([value for _, value in self.window])
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}' if pairs else ''
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(seconds, time.monotonic())
+
+    def increment(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, callback):
+        # Valori letti al momento dell'esportazione: callback() -> {(etichette): valore}
+        self._gauges[name] = callback
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    # --- RIEPILOGO (SIDEBAR) ---
+
+    def summary(self):
+        now = time.monotonic()
+        rows = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                recent = histogram.recent(now)
+                quantiles = np.quantile(recent, QUANTILES) if len(recent) else [np.nan] * len(QUANTILES)
+                rows.append({'metrica': name, 'etichette': ', '.join(f'{k}={v}' for k, v in labels), 'n (finestra)': len(recent),
+                             **{f'p{int(q * 100)} ms': round(float(v) * 1000, 1) for q, v in zip(QUANTILES, quantiles)},
+                             'max ms': round(float(recent.max()) * 1000, 1) if len(recent) else np.nan})
+        return rows
+
+    def counters(self):
+        with self._lock:
+            return {(name, labels): value for (name, labels), value in sorted(self._counters.items())}
+
+    # --- ESPORTAZIONE TESTUALE PROMETHEUS ---
+
+    def render_prometheus(self):
+        now = time.monotonic()
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        for name in dict.fromkeys(name for (name, _), _ in histograms):
+            metric = f'{METRICS_PREFIX}_{name}'
+            lines.append(f'# TYPE {metric} histogram')
+            lines.append(f'# TYPE {metric}_window summary')
+            for (h_name, labels), histogram in histograms:
+                if h_name != name:
+                    continue
+                cumulative = np.cumsum(histogram.buckets)
+                for bound, count in zip(BUCKETS + ('+Inf',), cumulative):
+                    lines.append(f'{metric}_bucket{_format_labels(labels, le=bound)} {count}')
+                lines.append(f'{metric}_sum{_format_labels(labels)} {histogram.total:.6f}')
+                lines.append(f'{metric}_count{_format_labels(labels)} {histogram.count}')
+                recent = histogram.recent(now)
+                if len(recent):
+                    for q, value in zip(QUANTILES, np.quantile(recent, QUANTILES)):
+                        lines.append(f'{metric}_window{_format_labels(labels, quantile=q)} {value:.6f}')
+        for name in dict.fromkeys(name for (name, _), _ in counters):
+            lines.append(f'# TYPE {METRICS_PREFIX}_{name}_total counter')
+            lines.extend(f'{METRICS_PREFIX}_{name}_total{_format_labels(labels)} {value}' for (c_name, labels), value in counters if c_name == name)
+        for name, callback in sorted(self._gauges.items()):
+            lines.append(f'# TYPE {METRICS_PREFIX}_{name} gauge')
+            lines.extend(f'{METRICS_PREFIX}_{name}{_format_labels(_labels(dict(labels)))} {value}' for labels, value in callback().items())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+observe = REGISTRY.observe
+increment = REGISTRY.increment
+timer = REGISTRY.timer
+
+
+# --- ENDPOINT HTTP /metrics ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    # Non configurato o porta occupata (es. una seconda replica): nessun endpoint, le metriche restano nella sidebar
+    if port is None:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        log.warning("Endpoint /metrics non avviato su %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,364 @@
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from data_loader import BASE_DIR
+from http_client import get_client
+import metrics
+
+# --- CONFIGURAZIONE ---
+NOTAM_URL = os.environ.get('TOTAL_STEP_NOTAM_URL')
+NOTAM_FILE = os.environ.get('TOTAL_STEP_NOTAM_FILE', os.path.join(BASE_DIR, 'notams.txt'))
+NOTAM_REFRESH_SECONDS = 10 * 60
+PERMANENT = float('inf')
+
+# Soggetto Q-code (lettere 2-3) -> impianto; condizione (lettere 4-5) che lo rende inutilizzabile
+Q_SUBJECTS = {'IC': 'ILS', 'IG': 'ILS', 'IL': 'LOC', 'NN': 'TCN', 'NT': 'TCN', 'NV': 'VOR', 'NB': 'NDB', 'MH': 'BAK'}
+Q_UNAVAILABLE = {'LC', 'AS', 'AU', 'AW'}
+# Procedure (parole del nome) rese inutilizzabili da ciascun impianto; RWY = tutte quelle della pista
+FACILITY_PROCEDURES = {'ILS': {'ILS'}, 'LOC': {'ILS', 'LOC'}, 'TCN': {'TCN', 'TACAN'}, 'PAR': {'PAR'},
+                       'VOR': {'VOR'}, 'NDB': {'NDB'}}
+RUNWAY_SUBJECTS = ('RWY', 'BAK')
+
+RE_HEADER = re.compile(r'^\(?\s*([A-Z]\d{4}/\d{2})\s+NOTAM([NRC])(?:\s+([A-Z]\d{4}/\d{2}))?')
+RE_ITEM = re.compile(r'(?:^|\s)([QA-G])\)\s*')
+RE_TIME = re.compile(r'(\d{10})')
+RE_RUNWAY = re.compile(r'\bRWY\s*(\d{2}[LRC]?)(?:\s*/\s*(\d{2}[LRC]?))?')
+RE_UNAVAILABLE = re.compile(r'\b(CLSD|CLOSED|U/S|UNSERVICEABLE|NOT AVBL|NOT AVAILABLE|OUT OF SERVICE|WITHDRAWN)\b')
+RE_FACILITIES = {
+    'ILS': re.compile(r'\b(ILS|GP|GLIDE ?PATH)\b'),
+    'LOC': re.compile(r'\b(LOC|LLZ|LOCALI[SZ]ER)\b'),
+    'TCN': re.compile(r'\b(TCN|TACAN|VORTAC)\b'),
+    'PAR': re.compile(r'\bPAR\b'),
+    'VOR': re.compile(r'\bVOR\b'),
+    'NDB': re.compile(r'\bNDB\b'),
+    'BAK': re.compile(r'\b(BAK|BARRIER|ARRESTING)\b'),
+}
+
+
+# --- PARSING (Q, A, B, C, E) ---
+
+class Notam:
+    __slots__ = ('id', 'kind', 'replaces', 'icaos', 'qcode', 'start', 'end', 'text', 'subjects')
+
+    def __init__(self, notam_id, kind, replaces, icaos, qcode, start, end, text, subjects):
+        self.id = notam_id
+        self.kind = kind
+        self.replaces = replaces
+        self.icaos = icaos
+        self.qcode = qcode
+        self.start = start
+        self.end = end
+        self.text = text
+        self.subjects = subjects
+
+    def as_dict(self):
+        return {'id': self.id, 'qcode': self.qcode, 'text': self.text,
+                'start': _format_time(self.start), 'end': _format_time(self.end),
+                'subjects': [' '.join(s for s in subject if s) for subject in self.subjects]}
+
+    def __repr__(self):
+        return f"Notam({self.id!r}, {'/'.join(self.icaos)}, {self.subjects})"
+
+
+def _parse_time(value, default):
+    # B)/C) in formato YYMMDDhhmm UTC; PERM (o assente) = senza scadenza; EST ignorato
+    match = RE_TIME.search(value or '')
+    if not match:
+        return default
+    return datetime.strptime(match.group(1), '%y%m%d%H%M').replace(tzinfo=timezone.utc).timestamp()
+
+def _format_time(value):
+    return 'PERM' if value == PERMANENT else datetime.fromtimestamp(value, timezone.utc).strftime('%Y-%m-%dT%H:%MZ')
+
+def _runways(text):
+    runways = []
+    for first, second in RE_RUNWAY.findall(text):
+        runways.extend(f'RWY{r}' for r in (first, second) if r)
+    return list(dict.fromkeys(runways))
+
+def notam_subjects(qcode, text):
+    # Solo i NOTAM di indisponibilita' (Q-code o testo E) producono soggetti: (impianto|RWY|BAK, pista o None)
+    condition = qcode[3:5] if len(qcode) >= 5 else ''
+    if condition not in Q_UNAVAILABLE and not RE_UNAVAILABLE.search(text):
+        return ()
+    facilities = {Q_SUBJECTS[qcode[1:3]]} if qcode[1:3] in Q_SUBJECTS else set()
+    facilities.update(name for name, pattern in RE_FACILITIES.items() if pattern.search(text))
+    if 'ILS' in facilities and 'LOC' in facilities:
+        facilities.discard('ILS')
+    runways = _runways(text) or [None]
+    if not facilities and (qcode[1:3] == 'MR' or RE_RUNWAY.search(text)):
+        return tuple(('RWY', rwy) for rwy in runways if rwy)
+    return tuple((facility, rwy) for facility in sorted(facilities) for rwy in runways)
+
+def parse_notam(block):
+    header = RE_HEADER.match(block.strip())
+    if not header:
+        return None
+    parts = RE_ITEM.split(block)
+    items = {parts[i]: parts[i + 1].strip() for i in range(1, len(parts) - 1, 2)}
+    qcode = next((f for f in items.get('Q', '').split('/') if f.startswith('Q') and len(f) == 5), '')
+    icaos = tuple(items.get('A', '').split())
+    text = ' '.join(items.get('E', '').split()).upper()
+    subjects = notam_subjects(qcode, text) if header.group(2) != 'C' else ()
+    return Notam(header.group(1), header.group(2), header.group(3), icaos, qcode,
+                 _parse_time(items.get('B'), 0.0), _parse_time(items.get('C'), PERMANENT), text, subjects)
+
+def split_notams(text):
+    # Un NOTAM per blocco: separati da righe vuote o da una nuova intestazione "A1234/25 NOTAMx"
+    blocks, current = [], []
+    for line in (text or '').splitlines():
+        if (not line.strip() or RE_HEADER.match(line.strip())) and current:
+            blocks.append('\n'.join(current))
+            current = []
+        if line.strip():
+            current.append(line.strip())
+    if current:
+        blocks.append('\n'.join(current))
+    return blocks
+
+
+# --- INTERVAL TREE (CENTRATO, STATICO) ---
+
+class IntervalTree:
+    # Intervalli chiusi [inizio, fine]; "attivi all'istante t" in O(log n + k)
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, intervals):
+        intervals = list(intervals)
+        starts = sorted(start for start, _, _ in intervals)
+        self.center = starts[len(starts) // 2] if starts else 0.0
+        here = [iv for iv in intervals if iv[0] <= self.center <= iv[1]]
+        self.by_start = sorted(here, key=lambda iv: iv[0])
+        self.by_end = sorted(here, key=lambda iv: iv[1], reverse=True)
+        left = [iv for iv in intervals if iv[1] < self.center]
+        right = [iv for iv in intervals if iv[0] > self.center]
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def query(self, t):
+        found, node = [], self
+        while node is not None:
+            if t < node.center:
+                for start, _, item in node.by_start:
+                    if start > t:
+                        break
+                    found.append(item)
+                node = node.left
+            else:
+                for _, end, item in node.by_end:
+                    if end < t:
+                        break
+                    found.append(item)
+                node = node.right if t > node.center else None
+        return found
+
+
+# --- INDICE PER AEROPORTO E SOGGETTO, INGESTIONE INCREMENTALE ---
+
+class NotamIndex:
+    def __init__(self):
+        self._notams = {}   # ID -> Notam
+        self._by_icao = {}  # ICAO -> {ID: Notam}
+        self._raw = {}      # ID -> testo grezzo gia' analizzato
+        self._trees = {}    # ICAO -> {soggetto: IntervalTree}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._notams)
+
+    def stations(self):
+        return sorted(icao for icao, notams in self._by_icao.items() if notams)
+
+    def ingest(self, text, complete=False):
+        # Blocchi con ID e testo invariati non vengono riparsati; complete=True: gli ID assenti sono ritirati
+        seen, changed = set(), 0
+        for block in split_notams(text):
+            header = RE_HEADER.match(block)
+            if not header:
+                continue
+            seen.add(header.group(1))
+            if self._raw.get(header.group(1)) == block:
+                continue
+            notam = parse_notam(block)
+            with self._lock:
+                self._raw[notam.id] = block
+                for old_id in (notam.replaces,) if notam.kind in 'RC' else ():
+                    self._remove(old_id)
+                if notam.kind != 'C':
+                    self._remove(notam.id)
+                    self._notams[notam.id] = notam
+                    for icao in notam.icaos:
+                        self._by_icao.setdefault(icao, {})[notam.id] = notam
+                    self._dirty.update(notam.icaos)
+            changed += 1
+        if complete:
+            with self._lock:
+                for notam_id in [i for i in self._raw if i not in seen]:
+                    self._raw.pop(notam_id)
+                    self._remove(notam_id)
+                    changed += 1
+        return changed
+
+    def _remove(self, notam_id):
+        notam = self._notams.pop(notam_id, None)
+        if notam is not None:
+            for icao in notam.icaos:
+                self._by_icao.get(icao, {}).pop(notam_id, None)
+            self._dirty.update(notam.icaos)
+
+    def _station_trees(self, icao):
+        with self._lock:
+            if icao in self._dirty:
+                by_subject = {}
+                for notam in self._by_icao.get(icao, {}).values():
+                    for subject in notam.subjects:
+                        by_subject.setdefault(subject, []).append((notam.start, notam.end, notam))
+                self._trees[icao] = {subject: IntervalTree(intervals) for subject, intervals in by_subject.items()}
+                self._dirty.discard(icao)
+            return self._trees.get(icao, {})
+
+    def active(self, icao, when):
+        # {soggetto: [NOTAM attivi all'istante]}
+        t = when.timestamp()
+        active = {}
+        for subject, tree in self._station_trees(icao).items():
+            notams = tree.query(t)
+            if notams:
+                active[subject] = notams
+        return active
+
+    def active_notams(self, icao, when):
+        unique = {n.id: n for notams in self.active(icao, when).values() for n in notams}
+        return [unique[notam_id] for notam_id in sorted(unique)]
+
+    def active_ids(self, icao, when):
+        return tuple(n.id for n in self.active_notams(icao, when))
+
+    def unavailable_procedures(self, icao, procedures, when):
+        # {nome procedura: [ID NOTAM]} per le procedure dell'indice rese inutilizzabili
+        active = self.active(icao, when)
+        blocked = {}
+        for (facility, runway), notams in active.items():
+            if facility == 'BAK':
+                continue
+            for p in procedures.procedures:
+                if runway is not None and p.runway.replace(' ', '') != runway:
+                    continue
+                if facility == 'RWY' or FACILITY_PROCEDURES[facility] & set(p.name.upper().split()):
+                    blocked.setdefault(p.name, []).extend(n.id for n in notams)
+        return {name: sorted(set(ids)) for name, ids in blocked.items()}
+
+    def runway_notams(self, icao, runway, when):
+        # Chiusure pista e barriere (BAK) per la pista "RWY08"
+        return sorted({n.id for (facility, rwy), notams in self.active(icao, when).items()
+                       if facility in RUNWAY_SUBJECTS and rwy in (runway, None) for n in notams})
+
+
+# --- SORGENTI (FILE LOCALE O SERVER HTTP) E AGGIORNAMENTO IN BACKGROUND ---
+
+class FileNotamSource:
+    def __init__(self, path=NOTAM_FILE):
+        self.path = path
+
+    def fetch(self):
+        with open(self.path, encoding='utf-8') as f:
+            return f.read()
+
+
+class HttpNotamSource:
+    def __init__(self, url=NOTAM_URL):
+        self.url = url
+
+    def fetch(self):
+        result = get_client().get(self.url, key=('notam', self.url))
+        if not result.ok:
+            raise OSError(f"NOTAM non disponibili da {self.url}: {result.error or result.status}")
+        return result.text
+
+def default_source():
+    if NOTAM_URL:
+        return HttpNotamSource(NOTAM_URL)
+    return FileNotamSource(NOTAM_FILE) if os.path.exists(NOTAM_FILE) else None
+
+
+class NotamFeed:
+    def __init__(self, source, index=None, interval=NOTAM_REFRESH_SECONDS):
+        self.source = source
+        self.index = index or NotamIndex()
+        self.interval = interval
+        self.last_refresh = None
+        self.last_error = None
+        self._running = threading.Lock()
+
+    def refresh(self):
+        with metrics.timer('stage_seconds', stage='notam'):
+            try:
+                changed = self.index.ingest(self.source.fetch(), complete=True)
+            except Exception as e:
+                self.last_error = str(e)
+                return None
+        self.last_refresh, self.last_error = time.monotonic(), None
+        return changed
+
+    def refresh_async(self):
+        # Al massimo un aggiornamento ogni interval secondi, mai due in parallelo
+        if self.last_refresh is not None and time.monotonic() - self.last_refresh < self.interval:
+            return False
+        if not self._running.acquire(blocking=False):
+            return False
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._running.release()
+        threading.Thread(target=run, name='notam-refresh', daemon=True).start()
+        return True
+
+
+# --- CLI: VERIFICA DI UN FILE E SERVER DI PROVA ---
+
+def serve(path, port, host='127.0.0.1'):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = FileNotamSource(path).fetch().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    server = ThreadingHTTPServer((host, port), Handler)
+    bound_host, bound_port = server.server_address[:2]
+    print(f"NOTAM da {path} su http://{bound_host}:{bound_port}/ (TOTAL_STEP_NOTAM_URL)", file=sys.stderr)
+    server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingestione NOTAM: NOTAM attivi per aeroporto e soggetto")
+    parser.add_argument('path', help="file di testo con i NOTAM")
+    parser.add_argument('--at', help="istante UTC YYYY-MM-DDTHH:MM (default: adesso)")
+    parser.add_argument('--serve', type=int, metavar='PORT', help="espone il file via HTTP come sorgente di prova")
+    parser.add_argument('--host', default='127.0.0.1', help="indirizzo di ascolto di --serve (0.0.0.0 per esporlo in rete)")
+    args = parser.parse_args(argv)
+    if args.serve:
+        serve(args.path, args.serve, args.host)
+        return 0
+    when = datetime.strptime(args.at, '%Y-%m-%dT%H:%M').replace(tzinfo=timezone.utc) if args.at else datetime.now(timezone.utc)
+    index = NotamIndex()
+    print(f"{index.ingest(FileNotamSource(args.path).fetch(), complete=True)} NOTAM indicizzati", file=sys.stderr)
+    for icao in index.stations():
+        for (facility, runway), notams in sorted(index.active(icao, when).items(), key=lambda item: (item[0][0], item[0][1] or '')):
+            print(f"{icao} {facility} {runway or '-'}: {', '.join(n.id for n in notams)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
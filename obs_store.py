@@ -0,0 +1,167 @@
+import os
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from report_parser import parse_report, parse_issue_time, VIS_NOT_REPORTED, CEIL_NOT_REPORTED
+from weather_fetch import fetch_reports
+
+# --- CONFIGURAZIONE ---
+OBS_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'observations.sqlite3')
+OBS_RETENTION_HOURS = 48
+HOT_WINDOW_HOURS = 24
+HOT_MAX_PER_STATION = HOT_WINDOW_HOURS * 6
+BACKFILL_HOURS = 6
+
+
+# --- OSSERVAZIONE (UNA PER METAR/SPECI) ---
+
+class Observation:
+    __slots__ = ('icao', 'time', 'pressure', 'visibility', 'ceiling', 'raw')
+
+    def __init__(self, icao, time, pressure, visibility, ceiling, raw):
+        self.icao = icao
+        self.time = time
+        self.pressure = pressure
+        self.visibility = visibility
+        self.ceiling = ceiling
+        self.raw = raw
+
+    def as_row(self):
+        return (self.icao, int(self.time.timestamp()), self.pressure, self.visibility, self.ceiling, self.raw)
+
+    @classmethod
+    def from_row(cls, row):
+        icao, ts, pressure, visibility, ceiling, raw = row
+        return cls(icao, datetime.fromtimestamp(ts, timezone.utc), pressure, visibility, ceiling, raw)
+
+
+def observations_from_metar(icao, metar_text, now=None):
+    # Un METAR/SPECI per riga, come restituito da aviationweather.gov
+    observations = []
+    for line in metar_text.splitlines() if isinstance(metar_text, str) else ():
+        section = parse_report(line.strip()).latest
+        if section is None or section.report_type == 'TAF' or not section.issued or (section.station and section.station != icao):
+            continue
+        obs_time = parse_issue_time(section.issued, now)
+        if obs_time is None:
+            continue
+        base = section.base
+        visibility = base.visibility if base.visibility is not None else VIS_NOT_REPORTED
+        ceiling = base.ceiling if base.ceiling is not None else CEIL_NOT_REPORTED
+        observations.append(Observation(icao, obs_time, section.pressure, visibility, ceiling, line.strip()))
+    return observations
+
+
+# --- ARCHIVIO LOCALE: SQLITE APPEND-ONLY + RING BUFFER IN MEMORIA ---
+
+class ObservationStore:
+    def __init__(self, path=OBS_DB_PATH, retention_hours=OBS_RETENTION_HOURS, hot_hours=HOT_WINDOW_HOURS):
+        self.retention = timedelta(hours=retention_hours)
+        self.hot_window = timedelta(hours=hot_hours)
+        self._hot = {}
+        self._lock = threading.Lock()
+        self._backfilled = set()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS observations (
+            icao TEXT NOT NULL, obs_time INTEGER NOT NULL, pressure INTEGER, visibility INTEGER,
+            ceiling INTEGER, raw TEXT, PRIMARY KEY (icao, obs_time)) WITHOUT ROWID''')
+        self._db.commit()
+        self._load_hot()
+
+    def _load_hot(self):
+        since = int((datetime.now(timezone.utc) - self.hot_window).timestamp())
+        with self._lock:
+            rows = self._db.execute('SELECT icao, obs_time, pressure, visibility, ceiling, raw FROM observations '
+                                    'WHERE obs_time >= ? ORDER BY obs_time', (since,)).fetchall()
+            for row in rows:
+                self._ring(row[0]).append(Observation.from_row(row))
+
+    def _ring(self, icao):
+        if icao not in self._hot:
+            self._hot[icao] = deque(maxlen=HOT_MAX_PER_STATION)
+        return self._hot[icao]
+
+    def add(self, observations):
+        with self._lock:
+            new = []
+            for obs in sorted(observations, key=lambda o: o.time):
+                ring = self._ring(obs.icao)
+                if any(o.time == obs.time for o in ring):
+                    continue
+                new.append(obs)
+                ring.append(obs)
+                if len(ring) > 1 and ring[-2].time > obs.time:
+                    self._hot[obs.icao] = deque(sorted(ring, key=lambda o: o.time), maxlen=HOT_MAX_PER_STATION)
+            if new:
+                self._db.executemany('INSERT OR IGNORE INTO observations VALUES (?, ?, ?, ?, ?, ?)', [o.as_row() for o in new])
+                self._db.commit()
+            return len(new)
+
+    def add_weather(self, weather_by_icao, now=None):
+        # Alimentato dal poller: {ICAO: (metar, taf)}
+        observations = []
+        for icao, (metar, _) in weather_by_icao.items():
+            observations.extend(observations_from_metar(icao, metar, now))
+        added = self.add(observations)
+        self.purge(now)
+        return added
+
+    def _claim_backfill(self, icaos):
+        with self._lock:
+            icaos = [i for i in icaos if i not in self._backfilled]
+            self._backfilled.update(icaos)
+        return icaos
+
+    def _backfill(self, icaos, hours):
+        # Storico con hoursBeforeNow; le stazioni non raggiungibili (o un errore di rete) verranno ritentate
+        missing = set(icaos)
+        try:
+            reports = fetch_reports(icaos, kinds=('metar',), hours=hours)
+            observations = []
+            for icao in icaos:
+                text = reports.get(('metar', icao))
+                if text is not None:
+                    missing.discard(icao)
+                    observations.extend(observations_from_metar(icao, text))
+            return self.add(observations)
+        finally:
+            with self._lock:
+                self._backfilled.difference_update(missing)
+
+    def backfill(self, icaos, hours=BACKFILL_HOURS):
+        icaos = self._claim_backfill(icaos)
+        return self._backfill(icaos, hours) if icaos else 0
+
+    def backfill_async(self, icaos, hours=BACKFILL_HOURS):
+        icaos = self._claim_backfill(icaos)
+        if icaos:
+            threading.Thread(target=self._backfill, args=(icaos, hours), name='obs-backfill', daemon=True).start()
+
+    def series(self, icao, hours, now=None):
+        now = now or datetime.now(timezone.utc)
+        since = now - timedelta(hours=hours)
+        if timedelta(hours=hours) <= self.hot_window:
+            return [o for o in list(self._hot.get(icao, ())) if o.time >= since]
+        with self._lock:
+            rows = self._db.execute('SELECT icao, obs_time, pressure, visibility, ceiling, raw FROM observations '
+                                    'WHERE icao = ? AND obs_time >= ? ORDER BY obs_time',
+                                    (icao, int(since.timestamp()))).fetchall()
+        return [Observation.from_row(row) for row in rows]
+
+    def series_bulk(self, icaos, hours, now=None):
+        return {icao: self.series(icao, hours, now) for icao in icaos}
+
+    def purge(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            self._db.execute('DELETE FROM observations WHERE obs_time < ?', (int((now - self.retention).timestamp()),))
+            self._db.commit()
+            for icao, ring in list(self._hot.items()):
+                while ring and ring[0].time < now - self.hot_window:
+                    ring.popleft()
+                # Stazioni senza campioni recenti (es. tolte dalla lista aeroporti): nessun ring residuo
+                if not ring or ring[-1].time < now - self.retention:
+                    del self._hot[icao]
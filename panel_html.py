@@ -0,0 +1,160 @@
+from html import escape
+from string import Template
+
+from board_eval import runway_status, STATUS_OK, STATUS_DRY_ONLY, STATUS_EXCEEDED
+from last_good_cache import report_age, FRESH, STALE, EXPIRED
+from lightning import RADII_NM
+
+# --- CONFIGURAZIONE ---
+STATUS_CLASSES = {STATUS_OK: 'ts-ok', STATUS_DRY_ONLY: 'ts-warn', STATUS_EXCEEDED: 'ts-bad'}
+AGE_CLASSES = {FRESH: 'ts-fresh', STALE: 'ts-stale', EXPIRED: 'ts-expired'}
+
+# --- FOGLIO DI STILE CONDIVISO (UNA SOLA VOLTA PER PAGINA, AL POSTO DEGLI STILI INLINE) ---
+PANEL_CSS = """<style>
+.ts-panel h3{margin:0 0 .25em;padding:0}
+.ts-panel hr{margin:1em 0}
+.ts-meta{font-size:.85em;color:gray}
+.ts-small{font-size:.9em}
+.ts-note{font-size:.85em}
+.ts-ok{color:green}
+.ts-warn{color:orange}
+.ts-bad{color:red}
+.ts-muted{color:gray}
+.ts-off{color:gray;text-decoration:line-through}
+.ts-na{color:gray}
+.ts-badge{color:white;font-size:.8em;border-radius:3px;padding:1px 5px}
+.ts-fresh{background:#34c759}
+.ts-stale{background:orange}
+.ts-expired{background:#fa5252}
+.ts-alt,.ts-hour{display:inline-block;color:white;text-align:center}
+.ts-alt{min-width:42px;font-weight:600;border-radius:4px;margin:2px;padding:2px 7px}
+.ts-hour{min-width:22px;font-size:.75em;border-radius:3px;margin:1px;padding:1px 3px}
+.ts-go{background:#34c759}
+.ts-nogo{background:#fa5252}
+.ts-unknown{background:gray}
+.ts-panel details{margin:.5em 0}
+.ts-panel ul{margin:0 0 .5em}
+.ts-cols{display:grid;grid-template-columns:repeat(auto-fit,minmax(320px,1fr));gap:1rem;margin-top:1em}
+.ts-pre{white-space:pre-wrap;font-size:.85em;max-height:150px;overflow-y:auto;margin:.25em 0 .75em;padding:.5em;border-radius:4px;background:rgba(128,128,128,.1)}
+.ts-procs{margin:.25em 0 1em}
+.ts-info{margin:.25em 0;padding:.5em .75em;border-radius:4px;background:rgba(28,131,225,.1)}
+</style>"""
+
+# --- TEMPLATE PRECOMPILATI (NESSUNA RIGA VUOTA: IL MARKDOWN TRATTA IL BLOCCO COME HTML GREZZO) ---
+# Il separatore fra pannelli apre il pannello: il trend (grafici Streamlit) resta sotto l'HTML
+PANEL = Template('<div class="ts-panel"><hr><h3>$icao - $name</h3>$meta$body$lightning$astronomy'
+                 '<div class="ts-cols"><div>$metar</div><div>$taf</div></div></div>')
+META = Template('<div class="ts-meta">Report scaricati alle $fetched $badges</div>')
+BADGE = Template('<span class="ts-badge $level">$kind $age fa</span>')
+NOTAMS = Template('<details><summary>NOTAM attivi</summary>$items</details>')
+NOTAM = Template('<div class="ts-note"><b>$id</b> ($start - $end): $text</div>')
+ALTERNATE = Template('<div><b>Requisiti Alternato (basati su $procedure):</b> Visibilità &ge; ${vis_req}m, '
+                     'Ceiling &ge; ${ceil_req}ft</div><div><b>METAR:</b> $metar</div>$taf')
+ALTERNATE_TAF = Template('<div><b>TAF:</b></div><ul>$segments</ul>$hourly')
+ALTERNATE_HOURLY = Template('<div><b>Alternato ora per ora (Z):</b> $boxes</div>')
+NO_ALTERNATE = '<div><b>Alternato meteo:</b> Nessuna procedura di avvicinamento disponibile.</div>'
+NO_ALTERNATE_TAF = '<div><b>TAF:</b> Non disponibile o non emesso.</div>'
+LIGHTNING = Template('<div class="ts-small"><b>Fulmini (ultimi $minutes min):</b> <span class="$level">$radii</span></div>')
+ASTRONOMY = Template('<div class="ts-small"><b>Sunrise:</b> $sunrise | <b>Sunset:</b> $sunset<br>'
+                     '<b>Moonrise:</b> $moonrise | <b>Moonset:</b> $moonset<br><b>Moon Phase:</b> $moon_phase '
+                     '($moon_illumination%) | <b>Max Illumination:</b> $moon_luminosity millilux</div>')
+COLUMN = Template('<div>$title</div><pre class="ts-pre">$report</pre>$procedures<div><b>$wind_title</b></div>$wind')
+PROCEDURES = Template('<div class="ts-note"><i>Procedures: <span class="ts-ok">GREEN</span> at or above minima / '
+                      '<span class="ts-bad">RED</span> below minima$notam_legend</i></div><div class="ts-procs">$lines</div>')
+NOTAM_LEGEND = ' / <span class="ts-off">GRAY</span> unavailable (NOTAM)'
+NO_REPORT_PROCEDURES = Template('<div class="ts-note"><i>Procedures: <span class="ts-na">GRAY</span> report not available'
+                                '$notam_legend</i></div><div class="ts-procs">$lines</div>')
+WIND_LINE = Template('<div><b>$runway:</b> $components$notams</div>')
+INFO = Template('<div class="ts-info">$text</div>')
+
+
+# --- FRAMMENTI STATICI (CALCOLATI CON IL MODELLO DEL PANNELLO) ---
+
+def alt_box(ok):
+    # ok None: report mancante o non richiesto, casella neutra
+    if ok is None:
+        return '<span class="ts-alt ts-unknown">n/d</span>'
+    return f'<span class="ts-alt {"ts-go" if ok else "ts-nogo"}">ALT</span>'
+
+def hour_boxes(taf_hourly):
+    # Una casella per ora di validita' del TAF, sul caso peggiore (TEMPO/PROB/transizioni BECMG inclusi)
+    return "".join(f'<span class="ts-hour {"ts-go" if h["ok"] else "ts-nogo"}" title="{h["hour"][8:10]} {h["hour"][11:]}">'
+                   f'{h["hour"][11:13]}</span>' for h in taf_hourly)
+
+def format_alternate(alternate):
+    if alternate is None:
+        return ""
+    if alternate['procedure'] is None:
+        return NO_ALTERNATE
+    if alternate['taf_segments'] is None:
+        taf = NO_ALTERNATE_TAF
+    else:
+        segments = "".join(f"<li><b>{escape(s['label'])}:</b> {alt_box(s['ok'])}</li>" for s in alternate['taf_segments'])
+        hourly = ALTERNATE_HOURLY.substitute(boxes=hour_boxes(alternate['taf_hourly'])) if alternate.get('taf_hourly') else ""
+        taf = ALTERNATE_TAF.substitute(segments=segments, hourly=hourly)
+    return ALTERNATE.substitute(procedure=escape(alternate['procedure']), vis_req=alternate['vis_req'],
+                                ceil_req=alternate['ceil_req'], metar=alt_box(alternate['metar_ok']), taf=taf)
+
+def format_notams(notams):
+    if not notams:
+        return ""
+    return NOTAMS.substitute(items="".join(NOTAM.substitute(id=escape(n['id']), start=n['start'], end=n['end'], text=escape(n['text']))
+                                           for n in notams))
+
+def format_wind_components(sustained, gust, status):
+    # I colori considerano la raffica (caso peggiore); il valore in raffica e' mostrato se superiore al sostenuto
+    def value(label, component):
+        gust_text = f" (G {gust[component]:.1f})" if gust[component] > sustained[component] else ""
+        return f'<span class="{STATUS_CLASSES[status[component]]}">{label}: {sustained[component]:.1f} kts{gust_text}</span>'
+    parts = []
+    if max(sustained['headwind'], gust['headwind']) > 0.0: parts.append(value("Max Headwind", 'headwind'))
+    if max(sustained['tailwind'], gust['tailwind']) > 0.0: parts.append(value("Max Tailwind", 'tailwind'))
+    parts.append(value("Max Crosswind", 'crosswind'))
+    parts.append(value("Max Wind", 'wind'))
+    return " | ".join(parts)
+
+def format_wind_lines(runways, source, profile=None):
+    return "".join(WIND_LINE.substitute(
+        runway=runway['runway'],
+        components=format_wind_components(runway[source]['sustained'], runway[source]['gust'], runway_status(runway[source], profile)),
+        notams=f' <span class="ts-muted">[NOTAM {", ".join(runway["notams"])}]</span>' if runway['notams'] else "")
+        for runway in runways)
+
+def report_column(title, report, procedures, has_unavailable, wind_title, wind, no_wind, known=True):
+    # Report in <pre> al posto del text_area: nessun widget (ne' chiave) per pannello
+    if procedures:
+        template = PROCEDURES if known else NO_REPORT_PROCEDURES
+        procedures = template.substitute(notam_legend=NOTAM_LEGEND if has_unavailable else "", lines=procedures)
+    return COLUMN.substitute(title=title, report=escape(report or ""), procedures=procedures, wind_title=wind_title,
+                             wind=wind if wind else INFO.substitute(text=no_wind))
+
+
+# --- FRAMMENTI CHE CAMBIANO COL TEMPO (A OGNI RENDER) ---
+
+def age_badge(entry, kind, now=None):
+    minutes, level = report_age(entry, kind, now)
+    if minutes is None:
+        return ""
+    age = f"{minutes} min" if minutes < 120 else f"{minutes // 60} h {minutes % 60:02d} min"
+    return BADGE.substitute(level=AGE_CLASSES[level], kind=kind.upper(), age=age)
+
+def format_meta(entry, now=None):
+    if entry is None:
+        return ""
+    badges = " ".join(b for b in (age_badge(entry, 'metar', now), age_badge(entry, 'taf', now)) if b)
+    return META.substitute(fetched=entry.fetched_at.strftime('%H:%M:%SZ'), badges=badges)
+
+def format_lightning(counts, minutes):
+    if counts is None:
+        return ""
+    level = 'ts-bad' if counts[0] else ('ts-warn' if any(counts) else 'ts-ok')
+    return LIGHTNING.substitute(minutes=minutes, level=level,
+                                radii=" | ".join(f"{radius} NM: {n}" for radius, n in zip(RADII_NM, counts)))
+
+def format_astronomy(astro):
+    return ASTRONOMY.substitute(astro) if astro else ""
+
+def render_panel(model, profile, meta="", lightning="", astronomy=""):
+    # Un solo blocco HTML per pannello: un messaggio verso il browser invece di uno per riga
+    return PANEL.substitute(icao=model['icao'], name=escape(model['name']), meta=meta, body=model['body'], lightning=lightning,
+                            astronomy=astronomy, metar=model['metar_column'][profile], taf=model['taf_column'][profile])
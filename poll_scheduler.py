@@ -0,0 +1,157 @@
+import statistics
+import threading
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+
+from report_parser import parse_issue_time, parse_weather_conditions
+
+# --- CONFIGURAZIONE ---
+METAR_CYCLES_MINUTES = (30, 60)   # il primo e' il default finche' non ci sono almeno due emissioni
+TAF_CYCLES_MINUTES = (180, 360)
+HISTORY_SIZE = 16
+PUBLISH_DELAY = timedelta(minutes=2)   # ritardo tipico fra ora nominale e disponibilita' su aviationweather.gov
+EAGER_INTERVAL = timedelta(minutes=1)  # subito dopo l'emissione attesa
+EAGER_WINDOW = timedelta(minutes=15)   # oltre: emissione saltata, si torna al ciclo successivo
+IDLE_INTERVAL = {'metar': timedelta(minutes=10), 'taf': timedelta(minutes=30)}
+WATCH_INTERVAL = {'metar': timedelta(minutes=2), 'taf': timedelta(minutes=5)}  # vicino ai minimi: SPECI/AMD
+RETRY_INTERVAL = timedelta(minutes=2)  # stazione senza report (o upstream non raggiungibile)
+COALESCE = timedelta(seconds=30)       # stazioni in scadenza a breve accorpate nella stessa richiesta
+NEAR_MINIMA_VISIBILITY = 5000
+NEAR_MINIMA_CEILING = 1500
+
+
+def near_minima(metar):
+    visibility, ceiling = parse_weather_conditions(metar)
+    return visibility < NEAR_MINIMA_VISIBILITY or ceiling < NEAR_MINIMA_CEILING
+
+def issue_times(text, now=None):
+    return [t for t in (parse_issue_time(line, now) for line in (text or '').splitlines()) if t is not None]
+
+
+# --- CICLO DI EMISSIONE APPRESO DAGLI ORARI DEI REPORT ---
+
+class IssueCycle:
+    __slots__ = ('candidates', 'issued')
+
+    def __init__(self, candidates, history=HISTORY_SIZE):
+        self.candidates = candidates
+        self.issued = deque(maxlen=history)
+
+    def observe(self, times):
+        for issued in sorted(times):
+            if not self.issued or issued > self.issued[-1]:
+                self.issued.append(issued)
+
+    def last(self):
+        return self.issued[-1] if self.issued else None
+
+    def cycle(self):
+        # Mediana degli intervalli fra emissioni (SPECI/AMD isolati non la spostano), agganciata al ciclo piu' vicino
+        gaps = [(b - a).total_seconds() / 60 for a, b in zip(self.issued, list(self.issued)[1:])]
+        if not gaps:
+            return self.candidates[0]
+        gap = statistics.median(gaps)
+        return min(self.candidates, key=lambda c: abs(c - gap))
+
+    def phase(self, cycle):
+        # Minuto dell'emissione di routine dentro il ciclo (es. :20 e :50 -> 20 su 30): il piu' frequente
+        offsets = Counter((t.hour * 60 + t.minute) % cycle for t in self.issued)
+        return max(offsets, key=lambda o: offsets[o]) if offsets else None
+
+    def next_after(self, moment):
+        cycle = self.cycle()
+        phase = self.phase(cycle)
+        if phase is None:
+            return moment + timedelta(minutes=cycle)
+        day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        elapsed = (moment - day).total_seconds() / 60
+        return day + timedelta(minutes=phase + ((elapsed - phase) // cycle + 1) * cycle)
+
+
+class StationSchedule:
+    __slots__ = ('cycles', 'polled', 'near', 'forced')
+
+    def __init__(self):
+        self.cycles = {'metar': IssueCycle(METAR_CYCLES_MINUTES), 'taf': IssueCycle(TAF_CYCLES_MINUTES)}
+        self.polled = {'metar': None, 'taf': None}
+        self.near = False
+        self.forced = set()
+
+
+# --- SCHEDULER PER STAZIONE ---
+
+class PollScheduler:
+    # Polling ravvicinato appena dopo l'emissione attesa, diradato fra un ciclo e l'altro,
+    # piu' stretto (SPECI/AMD) per le stazioni vicine ai minimi
+    def __init__(self):
+        self._stations = {}
+        self._watched = frozenset()
+        self._lock = threading.Lock()
+
+    def _station(self, icao):
+        station = self._stations.get(icao)
+        if station is None:
+            station = self._stations[icao] = StationSchedule()
+        return station
+
+    def set_watched(self, icaos):
+        # Stazioni in attenzione/critiche secondo il board: limiti e minimi propri di ogni aeroporto
+        self._watched = frozenset(icaos)
+
+    def force(self, icaos, kind='metar'):
+        with self._lock:
+            for icao in icaos:
+                self._station(icao).forced.add(kind)
+
+    def record(self, icao, metar, taf, now, taf_polled=False):
+        with self._lock:
+            station = self._station(icao)
+            station.polled['metar'] = now
+            times = issue_times(metar, now)
+            if times:
+                station.cycles['metar'].observe(times)
+                station.near = near_minima(metar)
+            station.forced.discard('metar')
+            if taf_polled:
+                station.polled['taf'] = now
+                station.cycles['taf'].observe(issue_times(taf, now))
+                station.forced.discard('taf')
+
+    def forget(self, keep):
+        with self._lock:
+            for icao in [i for i in self._stations if i not in keep]:
+                del self._stations[icao]
+
+    def next_poll(self, icao, kind, now):
+        station = self._stations.get(icao)
+        if station is None or kind in station.forced or station.polled[kind] is None:
+            return now
+        polled, cycle = station.polled[kind], station.cycles[kind]
+        last = cycle.last()
+        if last is None:
+            return polled + RETRY_INTERVAL
+        expected = cycle.next_after(last)
+        if expected + PUBLISH_DELAY + EAGER_WINDOW < now:
+            expected = cycle.next_after(now - PUBLISH_DELAY - EAGER_WINDOW)
+        ready = expected + PUBLISH_DELAY
+        if now >= ready:
+            return polled + EAGER_INTERVAL
+        near = station.near or icao in self._watched
+        return min(ready, polled + (WATCH_INTERVAL if near else IDLE_INTERVAL)[kind])
+
+    def due(self, icaos, taf_icaos, now=None):
+        # (stazioni da interrogare, di cui anche il TAF); un TAF in scadenza porta con se' il METAR
+        now = now or datetime.now(timezone.utc)
+        taf_icaos, horizon = set(taf_icaos), now + COALESCE
+        with self._lock:
+            taf_due = [i for i in icaos if i in taf_icaos and self.next_poll(i, 'taf', now) <= horizon]
+            metar_due = [i for i in icaos if self.next_poll(i, 'metar', now) <= horizon]
+        return list(dict.fromkeys(metar_due + taf_due)), taf_due
+
+    def seconds_to_next(self, icaos, taf_icaos, now=None):
+        now = now or datetime.now(timezone.utc)
+        taf_icaos = set(taf_icaos)
+        with self._lock:
+            polls = [self.next_poll(i, 'metar', now) for i in icaos]
+            polls += [self.next_poll(i, 'taf', now) for i in icaos if i in taf_icaos]
+        return max(0.0, (min(polls) - now).total_seconds()) if polls else None
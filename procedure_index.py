@@ -0,0 +1,122 @@
+import re
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+# --- CONFIGURAZIONE ---
+PROCEDURE_INDEX_CACHE_SIZE = 1024
+PROCEDURE_KINDS = ('CIRC', 'ILS', 'LOC', 'PAR', 'SRA', 'TCN', 'VOR', 'NDB', 'RNAV', 'RNP', 'GNSS')
+MISC_RUNWAY = "MISC"
+
+RE_PROCEDURE = re.compile(r'\(([^;]+);([^;]+);([^)]+)\)')
+RE_RUNWAY = re.compile(r'RWY\s*\d{2}[RLC]?')
+
+
+# --- PROCEDURA (RECORD IMMUTABILE) ---
+
+class Procedure:
+    __slots__ = ('name', 'runway', 'kind', 'ceil', 'vis')
+
+    def __init__(self, name, ceil, vis):
+        self.name = name
+        match = RE_RUNWAY.search(name)
+        self.runway = match.group(0) if match else MISC_RUNWAY
+        first_word = name.split()[0].upper() if name.split() else ''
+        self.kind = first_word if first_word in PROCEDURE_KINDS else 'OTHER'
+        self.ceil = ceil
+        self.vis = vis
+
+    def usable(self, vis, ceil):
+        return vis >= self.vis and ceil >= self.ceil
+
+    def as_dict(self):
+        return {"proc": self.name, "ceil": self.ceil, "vis": self.vis}
+
+    def __repr__(self):
+        return f"Procedure({self.name!r}, ceil={self.ceil}, vis={self.vis})"
+
+
+# --- INDICE ORDINATO PER MINIME ---
+
+class MinimaTable:
+    # Procedure ordinate per (ceiling, visibilita'): il minimo prefisso delle visibilita' e' monotono,
+    # quindi "la piu' bassa utilizzabile con vis V / ceiling C" sono due bisect
+    __slots__ = ('procedures', 'ceils', 'neg_prefix_min_vis')
+
+    def __init__(self, procedures):
+        self.procedures = tuple(sorted(procedures, key=lambda p: (p.ceil, p.vis)))
+        self.ceils = tuple(p.ceil for p in self.procedures)
+        prefix, current = [], None
+        for p in self.procedures:
+            current = p.vis if current is None else min(current, p.vis)
+            prefix.append(-current)
+        self.neg_prefix_min_vis = tuple(prefix)
+
+    @property
+    def lowest(self):
+        return self.procedures[0] if self.procedures else None
+
+    def best_usable(self, vis, ceil):
+        candidates = bisect_right(self.ceils, ceil)
+        first = bisect_left(self.neg_prefix_min_vis, -vis)
+        return self.procedures[first] if first < candidates else None
+
+
+class ProcedureIndex:
+    __slots__ = ('procedures', 'by_runway', 'by_kind', 'all', 'runway_tables')
+
+    def __init__(self, procedures):
+        self.procedures = tuple(procedures)  # ordine del CSV, usato per la visualizzazione
+        by_runway, by_kind = {}, {}
+        for p in self.procedures:
+            by_runway.setdefault(p.runway, []).append(p)
+            by_kind.setdefault(p.kind, []).append(p)
+        self.by_runway = {rwy: tuple(procs) for rwy, procs in sorted(by_runway.items())}
+        self.by_kind = {kind: tuple(procs) for kind, procs in by_kind.items()}
+        self.all = MinimaTable(self.procedures)
+        self.runway_tables = {rwy: MinimaTable(procs) for rwy, procs in self.by_runway.items()}
+
+    @classmethod
+    def from_dicts(cls, procedures):
+        return cls(Procedure(p['proc'], p['ceil'], p['vis']) for p in procedures)
+
+    def __len__(self):
+        return len(self.procedures)
+
+    def __bool__(self):
+        return bool(self.procedures)
+
+    @property
+    def lowest(self):
+        return self.all.lowest
+
+    def best_usable(self, vis, ceil, runway=None):
+        table = self.all if runway is None else self.runway_tables.get(runway)
+        return table.best_usable(vis, ceil) if table else None
+
+    def best_by_runway(self, vis, ceil):
+        return {rwy: table.best_usable(vis, ceil) for rwy, table in self.runway_tables.items()}
+
+    def as_dicts(self):
+        return [p.as_dict() for p in self.procedures]
+
+
+def _parse(proc_str):
+    procedures = []
+    for match in RE_PROCEDURE.findall(proc_str):
+        try:
+            procedures.append(Procedure(match[0].strip(), int(match[1].strip()), int(match[2].strip())))
+        except (ValueError, IndexError):
+            continue
+    return procedures
+
+@lru_cache(maxsize=PROCEDURE_INDEX_CACHE_SIZE)
+def _cached_index(proc_str):
+    return ProcedureIndex(_parse(proc_str))
+
+EMPTY_INDEX = ProcedureIndex(())
+
+def procedure_index(proc_str):
+    # Colonna "(proc;ceil;vis)" del CSV -> indice immutabile, costruito una sola volta per stringa
+    if not isinstance(proc_str, str) or not proc_str.strip():
+        return EMPTY_INDEX
+    return _cached_index(proc_str)
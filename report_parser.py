@@ -0,0 +1,282 @@
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+import metrics
+
+# --- CONFIGURAZIONE ---
+REPORT_CACHE_SIZE = 2048
+VIS_NOT_REPORTED = 9999
+CEIL_NOT_REPORTED = 99999
+MPS_TO_KT = 1.943844
+INHG_TO_HPA = 33.8639
+
+REPORT_TYPES = {'METAR', 'SPECI', 'TAF'}
+REPORT_FLAGS = {'AMD', 'COR', 'AUTO', 'NIL', 'CNL'}
+SKY_CLEAR = {'NSC', 'SKC', 'NCD', 'CLR'}
+CEILING_COVERS = {'BKN', 'OVC', 'VV'}
+
+# --- TOKEN (PATTERN COMPILATI UNA SOLA VOLTA) ---
+RE_STATION = re.compile(r'[A-Z]{4}')
+RE_ISSUE = re.compile(r'\d{6}Z')
+RE_PERIOD = re.compile(r'\d{4}/\d{4}')
+RE_FM = re.compile(r'FM\d{6}')
+RE_PROB = re.compile(r'PROB\d{2}')
+RE_WIND = re.compile(r'(\d{3}|VRB)(\d{2,3})(?:G(\d{2,3}))?(KT|MPS)')
+RE_WIND_SECTOR = re.compile(r'(\d{3})V(\d{3})')
+RE_VISIBILITY = re.compile(r'(\d{4})(?:NDV|N|NE|E|SE|S|SW|W|NW)?')
+RE_CLOUD = re.compile(r'(FEW|SCT|BKN|OVC)(\d{3})(CB|TCU|///)?')
+RE_VERTICAL_VIS = re.compile(r'VV(\d{3})')
+RE_PRESSURE = re.compile(r'(Q|A)(\d{4})')
+RE_WEATHER = re.compile(r'[-+]?(?:VC)?(?:MI|BC|PR|DR|BL|SH|TS|FZ)?(?:DZ|RA|SN|SG|IC|PL|GR|GS|UP|BR|FG|FU|VA|DU|SA|HZ|PO|SQ|FC|SS|DS)*|TS|VCSH|VCTS|NSW')
+
+
+# --- RECORD COMPATTI ---
+
+class Wind:
+    __slots__ = ('direction', 'speed', 'gust', 'var_from', 'var_to')
+
+    def __init__(self, direction, speed, gust=None, var_from=None, var_to=None):
+        self.direction = direction  # None = VRB
+        self.speed = speed
+        self.gust = gust
+        self.var_from = var_from
+        self.var_to = var_to
+
+    def __repr__(self):
+        direction = 'VRB' if self.direction is None else f"{self.direction:03d}"
+        gust = f"G{self.gust}" if self.gust else ''
+        sector = f" {self.var_from:03d}V{self.var_to:03d}" if self.var_from is not None else ''
+        return f"Wind({direction}{self.speed:02d}{gust}KT{sector})"
+
+
+class ReportSegment:
+    __slots__ = ('kind', 'period', 'visibility', 'layers', 'winds', 'weather', 'cavok', 'sky_clear')
+
+    def __init__(self, kind, period=None):
+        self.kind = kind
+        self.period = period
+        self.visibility = None
+        self.layers = []
+        self.winds = []
+        self.weather = []
+        self.cavok = False
+        self.sky_clear = False  # NSC/SKC/NCD/CLR: nessuna nube significativa
+
+    @property
+    def ceiling(self):
+        heights = [height for cover, height, _ in self.layers if cover in CEILING_COVERS]
+        return min(heights) if heights else None
+
+    @property
+    def label(self):
+        return f"{self.kind} {self.period}" if self.period else self.kind
+
+
+class ReportSection:
+    # Un singolo METAR/SPECI/TAF: gruppo base + eventuali gruppi di variazione
+    __slots__ = ('report_type', 'station', 'issued', 'validity', 'flags', 'pressure', 'base', 'change_groups')
+
+    def __init__(self, report_type=None):
+        self.report_type = report_type
+        self.station = None
+        self.issued = None
+        self.validity = None
+        self.flags = []
+        self.pressure = None
+        self.base = ReportSegment('BASE')
+        self.change_groups = []
+
+    @property
+    def segments(self):
+        return [self.base] + self.change_groups
+
+
+class WeatherReport:
+    __slots__ = ('text', 'sections', 'visibility', 'ceiling', 'layers', 'winds', 'weather')
+
+    def __init__(self, text, sections):
+        self.text = text
+        self.sections = tuple(sections)
+        segments = [segment for section in self.sections for segment in section.segments]
+        for segment in segments:
+            segment.layers = tuple(segment.layers)
+            segment.winds = tuple(segment.winds)
+            segment.weather = tuple(segment.weather)
+        self.layers = tuple(layer for segment in segments for layer in segment.layers)
+        self.winds = tuple(wind for segment in segments for wind in segment.winds)
+        self.weather = tuple(wx for segment in segments for wx in segment.weather)
+        vis_values = [s.visibility for s in segments if s.visibility is not None]
+        self.visibility = min(vis_values) if vis_values else VIS_NOT_REPORTED
+        ceilings = [s.ceiling for s in segments if s.ceiling is not None]
+        self.ceiling = min(ceilings) if ceilings else CEIL_NOT_REPORTED
+
+    @property
+    def latest(self):
+        return self.sections[0] if self.sections else None
+
+
+# --- TOKENIZER A PASSATA SINGOLA ---
+
+def _starts_report(tokens, i):
+    token = tokens[i]
+    if token in REPORT_TYPES:
+        return True
+    return bool(RE_STATION.fullmatch(token)) and i + 1 < len(tokens) and bool(RE_ISSUE.fullmatch(tokens[i + 1]))
+
+def _tokenize(text):
+    tokens = text.split()
+    sections = []
+    section = None
+    segment = None
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if _starts_report(tokens, i) and (section is None or section.station is not None or token in REPORT_TYPES):
+            section = ReportSection(token if token in REPORT_TYPES else None)
+            segment = section.base
+            sections.append(section)
+            if token in REPORT_TYPES:
+                i += 1
+                continue
+        if section is None:
+            section = ReportSection()
+            segment = section.base
+            sections.append(section)
+        if token in REPORT_FLAGS:
+            section.flags.append(token)
+        elif section.station is None and not section.change_groups and RE_STATION.fullmatch(token) \
+                and segment.visibility is None and not segment.winds:
+            section.station = token
+        elif RE_ISSUE.fullmatch(token):
+            section.issued = section.issued or token
+        elif RE_PERIOD.fullmatch(token):
+            if segment is section.base:
+                section.validity = section.validity or token
+            else:
+                segment.period = segment.period or token
+        elif token in ('BECMG', 'TEMPO') or RE_FM.fullmatch(token) or RE_PROB.fullmatch(token):
+            if token == 'TEMPO' and segment.kind.startswith('PROB') and segment.period is None and not segment.winds:
+                segment.kind = f"{segment.kind} TEMPO"
+            else:
+                segment = ReportSegment(token)
+                section.change_groups.append(segment)
+        elif section.pressure is None and RE_PRESSURE.fullmatch(token):
+            unit, value = RE_PRESSURE.fullmatch(token).groups()
+            section.pressure = int(value) if unit == 'Q' else round(int(value) / 100 * INHG_TO_HPA)
+        elif token == 'CAVOK':
+            segment.cavok = True
+            segment.visibility = VIS_NOT_REPORTED if segment.visibility is None else min(segment.visibility, VIS_NOT_REPORTED)
+        elif token in SKY_CLEAR:
+            segment.sky_clear = True
+        else:
+            _classify(token, segment)
+        i += 1
+    return sections
+
+def _classify(token, segment):
+    match = RE_WIND.fullmatch(token)
+    if match:
+        direction, speed, gust, unit = match.groups()
+        factor = MPS_TO_KT if unit == 'MPS' else 1
+        segment.winds.append(Wind(None if direction == 'VRB' else int(direction), round(int(speed) * factor),
+                                  round(int(gust) * factor) if gust else None))
+        return
+    match = RE_WIND_SECTOR.fullmatch(token)
+    if match and segment.winds:
+        segment.winds[-1].var_from, segment.winds[-1].var_to = int(match.group(1)), int(match.group(2))
+        return
+    match = RE_VISIBILITY.fullmatch(token)
+    if match:
+        vis = int(match.group(1))
+        segment.visibility = vis if segment.visibility is None else min(segment.visibility, vis)
+        return
+    match = RE_CLOUD.fullmatch(token)
+    if match:
+        segment.layers.append((match.group(1), int(match.group(2)) * 100, match.group(3)))
+        return
+    match = RE_VERTICAL_VIS.fullmatch(token)
+    if match:
+        segment.layers.append(('VV', int(match.group(1)) * 100, None))
+        return
+    if token and RE_WEATHER.fullmatch(token) and token not in ('-', '+'):
+        segment.weather.append(token)
+
+@lru_cache(maxsize=REPORT_CACHE_SIZE)
+def parse_report(text):
+    return WeatherReport(text, _tokenize(text))
+
+def _parse_cache_stats():
+    info = parse_report.cache_info()
+    return {(('result', 'hit'),): info.hits, (('result', 'miss'),): info.misses, (('result', 'size'),): info.currsize}
+
+metrics.REGISTRY.gauge('parse_cache', _parse_cache_stats)
+
+
+# --- ORARI DEI REPORT (GIORNO/ORA SENZA MESE E ANNO) ---
+
+def parse_issue_time(report, now=None):
+    # Gruppo DDHHMMZ: mese e anno sono quelli piu' recenti non nel futuro
+    match = re.search(r'\b(\d{2})(\d{2})(\d{2})Z\b', report or '')
+    if not match:
+        return None
+    now = now or datetime.now(timezone.utc)
+    day, hour, minute = (int(g) for g in match.groups())
+    year, month = now.year, now.month
+    for _ in range(2):
+        try:
+            issued = datetime(year, month, day, hour, minute, tzinfo=timezone.utc)
+        except ValueError:
+            issued = None
+        if issued is not None and issued <= now + timedelta(hours=1):
+            return issued
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return None
+
+def latest_issue_time(reports_text, now=None):
+    times = [parse_issue_time(line, now) for line in (reports_text or '').splitlines()]
+    times = [t for t in times if t is not None]
+    return max(times) if times else None
+
+def resolve_day_time(day, hour, minute, reference):
+    # Giorno/ora di un gruppo TAF (es. 1724 = giorno 17 ore 24): il mese piu' vicino al riferimento
+    candidates = []
+    for month_shift in (-1, 0, 1):
+        year, month = reference.year, reference.month + month_shift
+        if month < 1:
+            year, month = year - 1, 12
+        elif month > 12:
+            year, month = year + 1, 1
+        try:
+            candidates.append(datetime(year, month, day, tzinfo=timezone.utc) + timedelta(hours=hour, minutes=minute))
+        except ValueError:
+            continue
+    return min(candidates, key=lambda dt: abs(dt - reference)) if candidates else None
+
+
+# --- VISTE COMPATIBILI CON I VECCHI HELPER ---
+
+def parse_weather_conditions(report_str):
+    if not isinstance(report_str, str):
+        return VIS_NOT_REPORTED, CEIL_NOT_REPORTED
+    report = parse_report(report_str)
+    return report.visibility, report.ceiling
+
+def parse_multiple_wind(report_str):
+    if not isinstance(report_str, str): return []
+    winds = parse_report(report_str).winds
+    return [(w.direction or 0, w.speed) for w in winds if (w.direction or 0) != 0 or w.speed != 0]
+
+def estrai_fasce_TAF(taf_str):
+    if not isinstance(taf_str, str) or not taf_str.strip():
+        return []
+    section = parse_report(taf_str).latest
+    if section is None:
+        return []
+    parsed_segments = []
+    for segment in section.segments:
+        label = (section.validity or "Base") if segment is section.base else segment.label
+        vis = segment.visibility if segment.visibility is not None else VIS_NOT_REPORTED
+        ceil = segment.ceiling if segment.ceiling is not None else CEIL_NOT_REPORTED
+        parsed_segments.append((label, vis, ceil))
+    return parsed_segments
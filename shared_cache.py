@@ -0,0 +1,153 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# --- CONFIGURAZIONE ---
+# Cache condivisa fra i processi Streamlit della stessa macchina; TOTAL_STEP_SHARED_CACHE="" la disattiva
+SHARED_CACHE_PATH = os.environ.get('TOTAL_STEP_SHARED_CACHE',
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared_cache.sqlite3'))
+LEASE_SECONDS = 30
+LEASE_POLL_SECONDS = 0.2
+BUSY_TIMEOUT_SECONDS = 10
+MAX_SQL_VARIABLES = 500
+CONNECT_RETRY_SECONDS = 60  # dopo un'apertura fallita si riprova solo dopo questo intervallo
+
+
+def _chunks(keys, size=MAX_SQL_VARIABLES):
+    keys = list(keys)
+    for i in range(0, len(keys), size):
+        yield keys[i:i + size]
+
+
+# --- VALORI JSON PER (NAMESPACE, CHIAVE) + LEASE PER IL SINGLE-FLIGHT ---
+
+class SharedCache:
+    # SQLite in WAL: letture concorrenti fra processi, una sola scrittura alla volta; il lease su una chiave
+    # fa si' che un solo processo la ricalcoli (o la scarichi) mentre gli altri aspettano il risultato
+    def __init__(self, path=SHARED_CACHE_PATH, owner=None):
+        self.path = path
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS entries (
+            namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)) WITHOUT ROWID''')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS leases (
+            namespace TEXT NOT NULL, key TEXT NOT NULL, owner TEXT NOT NULL, expires_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)) WITHOUT ROWID''')
+
+    @contextmanager
+    def _transaction(self):
+        # COMMIT solo se tutte le istruzioni sono riuscite, altrimenti ROLLBACK: mai una scrittura a meta'
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def get_many(self, namespace, keys):
+        # {chiave: (valore, updated_at epoch)} per le sole chiavi presenti
+        found = {}
+        with self._lock:
+            for chunk in _chunks(dict.fromkeys(keys)):
+                rows = self._db.execute(f"SELECT key, value, updated_at FROM entries WHERE namespace = ? "
+                                        f"AND key IN ({','.join('?' * len(chunk))})", (namespace, *chunk)).fetchall()
+                found.update((key, (json.loads(value), updated_at)) for key, value, updated_at in rows)
+        return found
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key]).get(key)
+
+    def put_many(self, namespace, values, now=None):
+        now = now or time.time()
+        rows = [(namespace, key, json.dumps(value, ensure_ascii=False), now) for key, value in values.items()]
+        if rows:
+            with self._lock, self._transaction():
+                self._db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def put(self, namespace, key, value, now=None):
+        return self.put_many(namespace, {key: value}, now)
+
+    def claim(self, namespace, keys, ttl=LEASE_SECONDS):
+        # Chiavi di cui questo processo ottiene (o ha gia') il lease; quelle di altri processi restano escluse
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return []
+        now = time.time()
+        with self._lock, self._transaction():
+            self._db.execute('DELETE FROM leases WHERE namespace = ? AND expires_at < ?', (namespace, now))
+            self._db.executemany('INSERT OR IGNORE INTO leases VALUES (?, ?, ?, ?)',
+                                 [(namespace, key, self.owner, now + ttl) for key in keys])
+            owned = {key for (key,) in self._db.execute('SELECT key FROM leases WHERE namespace = ? AND owner = ?',
+                                                        (namespace, self.owner))}
+        return [key for key in keys if key in owned]
+
+    def release(self, namespace, keys):
+        with self._lock:
+            for chunk in _chunks(keys):
+                self._db.execute(f"DELETE FROM leases WHERE namespace = ? AND owner = ? AND key IN ({','.join('?' * len(chunk))})",
+                                 (namespace, self.owner, *chunk))
+
+    def wait_for(self, namespace, keys, since, timeout=LEASE_SECONDS):
+        # Attende che un altro processo pubblichi le chiavi (aggiornate dopo `since`); ritorna quelle arrivate
+        keys, found = list(keys), {}
+        deadline = time.monotonic() + timeout
+        while True:
+            found.update((k, hit) for k, hit in self.get_many(namespace, [k for k in keys if k not in found]).items()
+                         if hit[1] >= since)
+            if len(found) == len(keys) or time.monotonic() >= deadline:
+                return found
+            time.sleep(LEASE_POLL_SECONDS)
+
+    def get_or_compute(self, namespace, key, compute, max_age=None, timeout=LEASE_SECONDS):
+        # Single-flight: valore fresco dalla cache, altrimenti lo calcola un solo processo e gli altri lo attendono
+        started = time.time()
+        hit = self.get(namespace, key)
+        if hit is not None and (max_age is None or started - hit[1] <= max_age):
+            return hit[0]
+        if not self.claim(namespace, [key], ttl=timeout):
+            hit = self.wait_for(namespace, [key], started, timeout).get(key)
+            if hit is not None:
+                return hit[0]
+        try:
+            value = compute()
+            self.put(namespace, key, value)
+            return value
+        finally:
+            self.release(namespace, [key])
+
+    def purge(self, namespace, older_than_seconds):
+        with self._lock:
+            self._db.execute('DELETE FROM entries WHERE namespace = ? AND updated_at < ?',
+                             (namespace, time.time() - older_than_seconds))
+
+
+# --- ISTANZA DEL PROCESSO ---
+
+_shared = None
+_failed_at = None
+_shared_lock = threading.Lock()
+
+def get_shared_cache():
+    # None se disattivata o se il file non e' utilizzabile: ogni processo lavora da solo come prima;
+    # dopo un fallimento l'apertura si ritenta solo ogni CONNECT_RETRY_SECONDS
+    global _shared, _failed_at
+    with _shared_lock:
+        if _shared is None and SHARED_CACHE_PATH:
+            if _failed_at is not None and time.monotonic() - _failed_at < CONNECT_RETRY_SECONDS:
+                return None
+            try:
+                _shared = SharedCache()
+            except sqlite3.Error:
+                _failed_at = time.monotonic()
+                return None
+        return _shared
@@ -0,0 +1,205 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from report_parser import parse_report, parse_issue_time, resolve_day_time, VIS_NOT_REPORTED, CEIL_NOT_REPORTED
+
+# --- CONFIGURAZIONE ---
+MAX_TIMELINES = 500
+HOUR = timedelta(hours=1)
+
+
+# --- GRUPPI DI VARIAZIONE CON INTERVALLO ORARIO ---
+
+def _group_ceiling(segment):
+    # None solo senza alcun gruppo nubi (condizioni invariate); strati senza BKN/OVC/VV o NSC/SKC = nessun ceiling
+    if segment.cavok or segment.sky_clear:
+        return CEIL_NOT_REPORTED
+    if segment.layers:
+        return segment.ceiling if segment.ceiling is not None else CEIL_NOT_REPORTED
+    return None
+
+
+class TafGroup:
+    __slots__ = ('kind', 'start', 'end', 'vis', 'ceil', 'wind', 'gust', 'signature')
+
+    def __init__(self, kind, start, end, segment):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.vis = VIS_NOT_REPORTED if segment.cavok else segment.visibility
+        self.ceil = _group_ceiling(segment)
+        speeds = [w.speed for w in segment.winds]
+        self.wind = max(speeds) if speeds else None
+        gusts = [max(w.gust or 0, w.speed) for w in segment.winds]
+        self.gust = max(gusts) if gusts else None
+        self.signature = (segment.kind, segment.period, self.vis, self.ceil, self.wind, self.gust)
+
+    @property
+    def propagates(self):
+        # FM e BECMG cambiano le condizioni prevalenti fino alla fine della validita'
+        return self.kind.startswith('FM') or self.kind == 'BECMG'
+
+
+def _hour_index(dt, start, n_hours, round_up=False):
+    hours = (dt - start) / HOUR
+    index = int(np.ceil(hours)) if round_up else int(np.floor(hours))
+    return min(max(index, 0), n_hours)
+
+def _period(period, issued):
+    from_part, to_part = period.split('/')
+    start = resolve_day_time(int(from_part[:2]), int(from_part[2:]), 0, issued)
+    end = resolve_day_time(int(to_part[:2]), int(to_part[2:]), 0, issued)
+    return start, end
+
+
+def _build_groups(taf_text, now=None):
+    section = parse_report(taf_text).latest if isinstance(taf_text, str) else None
+    if section is None or not section.validity:
+        return None
+    issued = parse_issue_time(section.issued or '', now) or now or datetime.now(timezone.utc)
+    start, end = _period(section.validity, issued)
+    if start is None or end is None or end <= start:
+        return None
+    n_hours = int(np.ceil((end - start) / HOUR))
+    groups = [TafGroup('BASE', 0, n_hours, section.base)]
+    for segment in section.change_groups:
+        if segment.kind.startswith('FM'):
+            from_dt = resolve_day_time(int(segment.kind[2:4]), int(segment.kind[4:6]), int(segment.kind[6:8]), issued)
+            g_start, g_end = _hour_index(from_dt, start, n_hours), n_hours
+        elif segment.period:
+            g_from, g_to = _period(segment.period, issued)
+            g_start = _hour_index(g_from, start, n_hours)
+            g_end = _hour_index(g_to, start, n_hours, round_up=True)
+        else:
+            continue
+        groups.append(TafGroup(segment.kind, g_start, g_end, segment))
+    return start, n_hours, groups
+
+
+# --- GRIGLIA ORARIA COLONNARE ---
+
+class TafTimeline:
+    __slots__ = ('text', 'start', 'n_hours', 'groups', 'prev_vis', 'prev_ceil', 'prev_wind',
+                 'worst_vis', 'worst_ceil', 'worst_wind')
+
+    def __init__(self, text, start, n_hours, groups):
+        self.text = text
+        self.start = start
+        self.n_hours = n_hours
+        self.groups = groups
+        for column in ('prev_vis', 'prev_ceil', 'prev_wind', 'worst_vis', 'worst_ceil', 'worst_wind'):
+            setattr(self, column, np.zeros(n_hours, dtype=np.int32))
+        self._evaluate(np.arange(n_hours))
+
+    @classmethod
+    def from_text(cls, taf_text, now=None):
+        parsed = _build_groups(taf_text, now)
+        return cls(taf_text, *parsed) if parsed else None
+
+    def _evaluate(self, idx):
+        base = self.groups[0]
+        prev_vis = np.full(len(idx), base.vis if base.vis is not None else VIS_NOT_REPORTED)
+        prev_ceil = np.full(len(idx), base.ceil if base.ceil is not None else CEIL_NOT_REPORTED)
+        prev_wind = np.full(len(idx), base.wind or 0)
+        prev_gust = np.full(len(idx), base.gust or 0)
+        temporary = []
+        for group in self.groups[1:]:
+            active = (idx >= group.start) & (idx < group.end)
+            if group.kind.startswith('FM'):
+                after = idx >= group.start
+                prev_vis[after] = group.vis if group.vis is not None else VIS_NOT_REPORTED
+                prev_ceil[after] = group.ceil if group.ceil is not None else CEIL_NOT_REPORTED
+                prev_wind[after] = group.wind or 0
+                prev_gust[after] = group.gust or 0
+                continue
+            if group.kind == 'BECMG':
+                after = idx >= group.end
+                for column, value in ((prev_vis, group.vis), (prev_ceil, group.ceil), (prev_wind, group.wind), (prev_gust, group.gust)):
+                    if value is not None:
+                        column[after] = value
+            # BECMG durante la transizione, TEMPO e PROB: contano solo per il caso peggiore
+            temporary.append((active, group))
+        worst_vis, worst_ceil, worst_wind = prev_vis.copy(), prev_ceil.copy(), prev_gust.copy()
+        for active, group in temporary:
+            if group.vis is not None:
+                worst_vis[active] = np.minimum(worst_vis[active], group.vis)
+            if group.ceil is not None:
+                worst_ceil[active] = np.minimum(worst_ceil[active], group.ceil)
+            if group.gust is not None:
+                worst_wind[active] = np.maximum(worst_wind[active], group.gust)
+        self.prev_vis[idx], self.prev_ceil[idx], self.prev_wind[idx] = prev_vis, prev_ceil, prev_wind
+        self.worst_vis[idx], self.worst_ceil[idx], self.worst_wind[idx] = worst_vis, worst_ceil, worst_wind
+
+    def update(self, taf_text, now=None):
+        # TAF AMD: si ricalcolano solo le ore toccate dai gruppi aggiunti o rimossi
+        if taf_text == self.text:
+            return self
+        parsed = _build_groups(taf_text, now)
+        if parsed is None:
+            return None
+        start, n_hours, groups = parsed
+        if start != self.start or n_hours != self.n_hours or groups[0].signature != self.groups[0].signature:
+            return TafTimeline(taf_text, start, n_hours, groups)
+        old_signatures = {g.signature for g in self.groups[1:]}
+        new_signatures = {g.signature for g in groups[1:]}
+        affected = np.zeros(n_hours, dtype=bool)
+        for group in self.groups[1:] + groups[1:]:
+            if (group.signature in old_signatures) != (group.signature in new_signatures):
+                affected[group.start:n_hours if group.propagates else group.end] = True
+        new = TafTimeline.__new__(TafTimeline)
+        for slot in TafTimeline.__slots__:
+            value = getattr(self, slot)
+            setattr(new, slot, value.copy() if isinstance(value, np.ndarray) else value)
+        new.text, new.groups = taf_text, groups
+        if affected.any():
+            new._evaluate(np.nonzero(affected)[0])
+        return new
+
+    # --- INTERROGAZIONI O(ore) ---
+
+    def window(self, start=None, end=None):
+        first = _hour_index(start, self.start, self.n_hours) if start else 0
+        last = _hour_index(end, self.start, self.n_hours, round_up=True) if end else self.n_hours
+        return slice(first, max(first, last))
+
+    def worst_conditions(self, start=None, end=None):
+        hours = self.window(start, end)
+        if hours.stop <= hours.start:
+            return None
+        return (int(self.worst_vis[hours].min()), int(self.worst_ceil[hours].min()), int(self.worst_wind[hours].max()))
+
+    def hourly_alternate(self, vis_req, ceil_req, worst=True):
+        vis, ceil = (self.worst_vis, self.worst_ceil) if worst else (self.prev_vis, self.prev_ceil)
+        return (vis >= vis_req) & (ceil >= ceil_req)
+
+    def alternate_valid(self, vis_req, ceil_req, start=None, end=None, worst=True):
+        hours = self.window(start, end)
+        return bool(self.hourly_alternate(vis_req, ceil_req, worst)[hours].all()) if hours.stop > hours.start else False
+
+    def hour_starts(self):
+        return [self.start + i * HOUR for i in range(self.n_hours)]
+
+
+# --- CACHE PER STAZIONE CON AGGIORNAMENTO INCREMENTALE ---
+
+_timelines = OrderedDict()
+_lock = threading.Lock()
+
+def get_timeline(icao, taf_text, now=None):
+    with _lock:
+        timeline = _timelines.get(icao)
+        if timeline is None:
+            timeline = TafTimeline.from_text(taf_text, now)
+        else:
+            timeline = timeline.update(taf_text, now)
+        if timeline is None:
+            _timelines.pop(icao, None)
+            return None
+        _timelines[icao] = timeline
+        _timelines.move_to_end(icao)
+        while len(_timelines) > MAX_TIMELINES:
+            _timelines.popitem(last=False)
+        return timeline
@@ -0,0 +1,241 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import metrics
+from poll_scheduler import PollScheduler
+from report_parser import latest_issue_time
+from weather_fetch import get_weather_bulk, METAR_MISSING, TAF_MISSING, TAF_NOT_REQUESTED
+
+# --- CONFIGURAZIONE ---
+MAX_CACHED_STATIONS = 5000
+SHARED_FRESH_SECONDS = 60  # report scaricati da un'altra replica da meno di cosi' = come scaricati ora
+DETAIL_TTL_SECONDS = 30 * 60
+
+log = logging.getLogger(__name__)
+
+
+# --- CACHE CONDIVISA PER STAZIONE ---
+
+class WeatherEntry:
+    __slots__ = ('metar', 'taf', 'metar_issued', 'taf_issued', 'fetched_at')
+
+    def __init__(self, metar, taf, metar_issued, taf_issued, fetched_at):
+        self.metar = metar
+        self.taf = taf
+        self.metar_issued = metar_issued
+        self.taf_issued = taf_issued
+        self.fetched_at = fetched_at
+
+
+class WeatherCache:
+    def __init__(self, max_stations=MAX_CACHED_STATIONS):
+        self.max_stations = max_stations
+        self._entries = OrderedDict()
+        self._stations = ()
+        self._lock = threading.Lock()
+
+    def set_stations(self, icaos):
+        stations = tuple(dict.fromkeys(i.strip().upper() for i in icaos if isinstance(i, str) and i.strip()))
+        with self._lock:
+            self._stations = stations[:self.max_stations]
+            for icao in [i for i in self._entries if i not in self._stations]:
+                del self._entries[icao]
+
+    def stations(self):
+        return self._stations
+
+    def seed(self, entries):
+        # Ultimi report validi da disco: serviti subito, sostituiti dal primo poll riuscito
+        with self._lock:
+            for icao, entry in entries.items():
+                self._entries.setdefault(icao, entry)
+
+    def update(self, weather_by_icao, fetched_at=None, keep_taf=()):
+        # Ritorna le stazioni con un METAR/TAF diverso da quello in cache; keep_taf: TAF non richiesto
+        # in questo giro (non ancora in scadenza) ma ancora seguito, resta quello in cache
+        fetched_at = fetched_at or datetime.now(timezone.utc)
+        changed = []
+        with self._lock:
+            for icao, (metar, taf) in weather_by_icao.items():
+                if icao not in self._stations:
+                    continue
+                entry = WeatherEntry(metar, taf, latest_issue_time(metar, fetched_at),
+                                     latest_issue_time(taf, fetched_at), fetched_at)
+                previous = self._entries.get(icao)
+                # Upstream non raggiungibile: si tiene l'ultimo report valido (l'eta' resta visibile)
+                if previous is not None and metar == METAR_MISSING and previous.metar_issued is not None:
+                    entry.metar, entry.metar_issued, entry.fetched_at = previous.metar, previous.metar_issued, previous.fetched_at
+                if previous is not None and (taf == TAF_MISSING or (taf is None and metar == METAR_MISSING)) and previous.taf_issued is not None:
+                    entry.taf, entry.taf_issued = previous.taf, previous.taf_issued
+                elif previous is not None and taf is None and icao in keep_taf:
+                    entry.taf, entry.taf_issued = previous.taf, previous.taf_issued
+                if previous is None or (entry.metar, entry.taf) != (previous.metar, previous.taf):
+                    changed.append(icao)
+                self._entries[icao] = entry
+                self._entries.move_to_end(icao)
+            while len(self._entries) > self.max_stations:
+                self._entries.popitem(last=False)
+        return changed
+
+    def get(self, icao):
+        return self._entries.get(icao.strip().upper())
+
+    def entries(self):
+        with self._lock:
+            return dict(self._entries)
+
+    def missing(self, icaos):
+        return [i for i in (i.strip().upper() for i in icaos) if i not in self._entries]
+
+    def weather(self, icao):
+        entry = self.get(icao)
+        if entry is None:
+            return METAR_MISSING, TAF_MISSING
+        return entry.metar, entry.taf if entry.taf is not None else TAF_NOT_REQUESTED
+
+    def has_taf(self, icao):
+        entry = self.get(icao)
+        return entry is not None and entry.taf is not None
+
+    def snapshot(self, icaos):
+        return {icao.strip().upper(): self.weather(icao) for icao in icaos}
+
+
+# --- POLLER IN BACKGROUND (UNO PER PROCESSO) ---
+
+class WeatherPoller(threading.Thread):
+    def __init__(self, cache, scheduler=None, fetch=get_weather_bulk, store=None, shared=None):
+        super().__init__(name='weather-poller', daemon=True)
+        self.cache = cache
+        self.scheduler = scheduler or PollScheduler()
+        self.shared = shared
+        self.fetch = fetch
+        self.store = store
+        self.upstream_ok = None  # None finche' il primo poll non e' concluso
+        self.ready = threading.Event()
+        self.listeners = []
+        self.change_listeners = []  # chiamati solo con le stazioni il cui report e' cambiato
+        self._wakeup = threading.Event()
+        self._detail = {}
+        self._detail_lock = threading.Lock()  # sessioni (request_detail) e thread del poller (detail_stations)
+        self._polled = threading.Condition()
+
+    def watch(self, icaos):
+        stations = self.cache.stations()
+        self.cache.set_stations(icaos)
+        if set(self.cache.stations()) != set(stations):
+            self.scheduler.forget(set(self.cache.stations()))
+        if set(self.cache.stations()) - set(stations):
+            self.ready.clear()
+            self.poll_now()
+
+    def request_detail(self, icaos):
+        # TAF solo per le stazioni espanse o fissate da almeno una sessione negli ultimi DETAIL_TTL_SECONDS
+        now = time.monotonic()
+        icaos = [i.strip().upper() for i in icaos]
+        with self._detail_lock:
+            new = [i for i in icaos if i not in self._detail]
+            self._detail.update((i, now) for i in icaos)
+        if new:
+            self.scheduler.force(new, 'taf')
+            self.poll_now()
+        return bool(new)
+
+    def detail_stations(self):
+        expired = time.monotonic() - DETAIL_TTL_SECONDS
+        with self._detail_lock:
+            for icao in [i for i, requested in self._detail.items() if requested < expired]:
+                del self._detail[icao]
+            detail = set(self._detail)
+        return [i for i in self.cache.stations() if i in detail]
+
+    def wait_detail(self, icaos, timeout=None):
+        with self._polled:
+            return self._polled.wait_for(lambda: all(self.cache.has_taf(i) for i in icaos), timeout)
+
+    def poll_now(self):
+        self._wakeup.set()
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def _shared_fetch(self, due, taf_due):
+        # Piu' repliche: ogni stazione e' scaricata da una sola (lease), le altre ne leggono i report
+        if self.shared is None:
+            return self.fetch(due, taf_due)
+        started, taf_requested = time.time(), set(taf_due)
+
+        def usable(icao, value):
+            return icao not in taf_requested or value['taf'] is not None
+
+        weather = {icao: (value['metar'], value['taf'] if icao in taf_requested else None)
+                   for icao, (value, updated_at) in self.shared.get_many('weather', due).items()
+                   if started - updated_at <= SHARED_FRESH_SECONDS and usable(icao, value)}
+        missing = [i for i in due if i not in weather]
+        claimed = self.shared.claim('weather', missing)
+        try:
+            fetched = self.fetch(claimed, [i for i in claimed if i in taf_requested]) if claimed else {}
+            # Solo report validi: un errore upstream non deve fermare le altre repliche
+            self.shared.put_many('weather', {icao: {'metar': metar, 'taf': taf if taf != TAF_MISSING else None}
+                                             for icao, (metar, taf) in fetched.items() if metar != METAR_MISSING})
+        finally:
+            self.shared.release('weather', claimed)
+        weather.update(fetched)
+        claimed = set(claimed)
+        others = [i for i in missing if i not in claimed]
+        arrived = {icao: value for icao, (value, _) in self.shared.wait_for('weather', others, started).items()
+                   if usable(icao, value)} if others else {}
+        weather.update((icao, (value['metar'], value['taf'] if icao in taf_requested else None)) for icao, value in arrived.items())
+        late = [i for i in others if i not in arrived]
+        if late:
+            weather.update(self.fetch(late, [i for i in late if i in taf_requested]))
+        metrics.increment('shared_weather', len(due) - len(claimed) - len(late), outcome='from_replica')
+        metrics.increment('shared_weather', len(claimed) + len(late), outcome='fetched')
+        return weather
+
+    def _safe(self, description, function, *args):
+        try:
+            return function(*args)
+        except Exception:
+            log.exception("Poller meteo: errore in %s", description)
+            return None
+
+    def run(self):
+        # Ogni giro interroga solo le stazioni in scadenza secondo lo scheduler, poi dorme fino alla prossima
+        while True:
+            # Risveglio consumato prima di calcolare le scadenze: un poll_now() arrivato durante il giro non va perso
+            self._wakeup.clear()
+            stations = self.cache.stations()
+            detail = self.detail_stations()
+            due, taf_due = self.scheduler.due(stations, detail) if stations else ([], [])
+            if due:
+                now, taf_requested = datetime.now(timezone.utc), set(taf_due)
+                try:
+                    weather = self._shared_fetch(due, taf_due)
+                except Exception:
+                    log.exception("Poll METAR/TAF fallito (%d stazioni)", len(due))
+                    self.upstream_ok = False
+                    for icao in due:
+                        self.scheduler.record(icao, None, None, now, taf_polled=icao in taf_requested)
+                else:
+                    self.upstream_ok = any(metar != METAR_MISSING for metar, _ in weather.values())
+                    changed = self._safe("aggiornamento cache", self.cache.update, weather, now, set(detail) - taf_requested) or []
+                    for icao, (metar, taf) in weather.items():
+                        self._safe(f"scheduler {icao}", self.scheduler.record, icao, metar, taf, now, icao in taf_requested)
+                    if self.store is not None and self.upstream_ok:
+                        self._safe("salvataggio ultimi report validi", self.store.save, self.cache.entries())
+                    # Ogni listener isolato: uno che solleva non toglie i push di cambio agli altri
+                    for listener in self.listeners:
+                        self._safe(f"listener {listener!r}", listener, weather)
+                    for listener in self.change_listeners if changed else ():
+                        self._safe(f"listener cambi {listener!r}", listener, changed)
+                metrics.increment('scheduled_polls', len(due), kind='metar')
+                metrics.increment('scheduled_polls', len(taf_due), kind='taf')
+                self.ready.set()
+                with self._polled:
+                    self._polled.notify_all()
+            wait = self.scheduler.seconds_to_next(stations, detail) if stations else None
+            self._wakeup.wait(max(1.0, wait) if wait is not None else 1)
@@ -0,0 +1,106 @@
+import re
+
+import metrics
+from http_client import get_client
+
+# --- CONFIGURAZIONE ---
+METAR_URL = 'https://aviationweather.gov/api/data/metar'
+TAF_URL = 'https://aviationweather.gov/api/data/taf'
+MAX_IDS_PER_REQUEST = 200
+
+METAR_MISSING = "METAR non disponibile"
+TAF_MISSING = "TAF non disponibile"
+TAF_NOT_ISSUED = "TAF non emesso per questa stazione."
+TAF_NOT_REQUESTED = "TAF non richiesto (stazione non espansa)."
+
+REPORT_PREFIXES = {'METAR', 'SPECI', 'TAF', 'AMD', 'COR'}
+
+
+# --- SUDDIVISIONE DELLA RISPOSTA PER STAZIONE ---
+
+def report_station(report):
+    for token in report.split():
+        if token in REPORT_PREFIXES:
+            continue
+        return token if re.fullmatch(r'[A-Z]{4}', token) else None
+    return None
+
+def split_reports_by_station(raw_text):
+    # Ogni report inizia a colonna 0; le righe indentate (gruppi TAF) sono continuazioni del precedente
+    reports = []
+    for line in raw_text.splitlines():
+        if not line.strip():
+            continue
+        if line[0].isspace() and reports:
+            reports[-1].append(line)
+        else:
+            reports.append([line])
+    by_station = {}
+    for lines in reports:
+        icao = report_station(lines[0])
+        if icao:
+            by_station.setdefault(icao, []).append("\n".join(lines).strip())
+    return {icao: "\n".join(texts) for icao, texts in by_station.items()}
+
+
+# --- DOWNLOAD MULTI-STAZIONE ---
+
+def _chunks(icaos, size):
+    for i in range(0, len(icaos), size):
+        yield tuple(icaos[i:i + size])
+
+def _report_request(kind, icaos, hours=None):
+    url, default_hours = (METAR_URL, 2) if kind == 'metar' else (TAF_URL, 3)
+    return url, {'ids': ','.join(icaos), 'format': 'raw', 'hoursBeforeNow': hours or default_hours}
+
+def _result_ok(result):
+    return result.ok or result.status == 404
+
+def _split_result(result):
+    return split_reports_by_station(result.text) if result.ok else {}
+
+def fetch_reports(icaos, kinds=('metar', 'taf'), hours=None, kind_icaos=None):
+    # {(tipo, ICAO): testo o None se la stazione non e' stata raggiungibile}
+    # kind_icaos: {tipo: ICAO} limita un tipo a un sottoinsieme (es. TAF solo per le stazioni espanse)
+    client = get_client()
+    kind_icaos = kind_icaos or {}
+    chunk_requests = {(kind, chunk): _report_request(kind, chunk, hours)
+                      for kind in kinds for chunk in _chunks(list(kind_icaos.get(kind, icaos)), MAX_IDS_PER_REQUEST)}
+    results = client.fetch_many(chunk_requests)
+    reports = {}
+    retry_requests = {}
+    for (kind, chunk), result in results.items():
+        if _result_ok(result):
+            by_station = _split_result(result)
+            for icao in chunk:
+                reports[(kind, icao)] = by_station.get(icao, '')
+        elif len(chunk) > 1:
+            # Richiesta multipla fallita: si riprova stazione per stazione, cosi' un ICAO problematico non blocca gli altri
+            retry_requests.update({(kind, icao): _report_request(kind, (icao,), hours) for icao in chunk})
+        else:
+            reports[(kind, chunk[0])] = None
+    for (kind, icao), result in client.fetch_many(retry_requests).items():
+        reports[(kind, icao)] = _split_result(result).get(icao, '') if _result_ok(result) else None
+    return reports
+
+def get_weather_bulk(icaos, taf_icaos=None):
+    # {ICAO: (metar, taf)}; con taf_icaos il TAF e' scaricato solo per quelle stazioni (None per le altre)
+    icaos = list(dict.fromkeys(i.strip().upper() for i in icaos if isinstance(i, str) and i.strip()))
+    taf_requested = set(icaos) if taf_icaos is None else {t.strip().upper() for t in taf_icaos}
+    taf_stations = [i for i in icaos if i in taf_requested]
+    with metrics.timer('stage_seconds', stage='fetch'):
+        reports = fetch_reports(icaos, kind_icaos={'taf': taf_stations})
+    for (kind, _), text in reports.items():
+        metrics.increment('station_reports', kind=kind, outcome='failed' if text is None else ('ok' if text else 'missing'))
+    weather = {}
+    for icao in icaos:
+        metar = reports.get(('metar', icao)) or METAR_MISSING
+        taf = reports.get(('taf', icao))
+        if icao not in taf_requested:
+            taf = None
+        elif taf is None:
+            taf = TAF_MISSING
+        elif not taf:
+            taf = TAF_NOT_ISSUED
+        weather[icao] = (metar, taf)
+    return weather
@@ -0,0 +1,77 @@
+import numpy as np
+
+from report_parser import Wind
+
+# --- CONFIGURAZIONE ---
+SECTOR_STEP_DEG = 10
+COMPONENTS = ('headwind', 'tailwind', 'crosswind', 'wind')
+SUSTAINED, GUST = 0, 1
+
+
+# --- CAMPIONI DI DIREZIONE PER OGNI GRUPPO VENTO ---
+
+def wind_directions(wind):
+    # Direzione peggiore: VRB = tutte le direzioni, dddVddd = tutto il settore (in senso orario)
+    if wind.direction is None:
+        return np.arange(0, 360, SECTOR_STEP_DEG)
+    if wind.var_from is None:
+        return np.array([wind.direction])
+    span = (wind.var_to - wind.var_from) % 360
+    sector = (wind.var_from + np.append(np.arange(0, span, SECTOR_STEP_DEG), span)) % 360
+    return np.append(sector, wind.direction)
+
+def _samples(station_winds):
+    directions, sustained, gusts, counts = [], [], [], []
+    for winds in station_winds:
+        n = 0
+        for wind in winds:
+            if not wind.speed and not wind.gust:
+                continue
+            dirs = wind_directions(wind)
+            directions.append(dirs)
+            sustained.append(np.full(len(dirs), wind.speed, dtype=float))
+            gusts.append(np.full(len(dirs), max(wind.gust or 0, wind.speed), dtype=float))
+            n += len(dirs)
+        counts.append(n)
+    if not directions:
+        return np.empty(0), np.empty(0), np.empty(0), np.array(counts, dtype=int)
+    return (np.concatenate(directions).astype(float), np.concatenate(sustained), np.concatenate(gusts),
+            np.array(counts, dtype=int))
+
+
+# --- CALCOLO VETTORIALE PER TUTTO IL BOARD ---
+
+def board_wind_components(stations):
+    # stations: [(venti, prue_vere)] -> per stazione un array (piste, 2, 4):
+    # [sostenuto|raffica][headwind, tailwind, crosswind, vento max]
+    station_winds = [winds for winds, _ in stations]
+    headings = [np.asarray(hdgs, dtype=float) for _, hdgs in stations]
+    directions, sustained, gusts, w_counts = _samples(station_winds)
+    r_counts = np.array([len(h) for h in headings], dtype=int)
+    n_runways = int(r_counts.sum())
+    result = np.zeros((n_runways, 2, 4))
+    if n_runways and len(directions):
+        rw_heading = np.concatenate(headings)
+        rw_station = np.repeat(np.arange(len(stations)), r_counts)
+        w_start = np.concatenate(([0], np.cumsum(w_counts)[:-1]))
+        # Coppie (campione vento, pista) solo all'interno della stessa stazione
+        pair_counts = w_counts[rw_station]
+        pair_runway = np.repeat(np.arange(n_runways), pair_counts)
+        block_start = np.concatenate(([0], np.cumsum(pair_counts)[:-1]))
+        pair_sample = np.arange(int(pair_counts.sum())) - np.repeat(block_start - w_start[rw_station], pair_counts)
+        angle = np.radians(directions[pair_sample] - rw_heading[pair_runway])
+        cos_a, sin_a = np.cos(angle), np.abs(np.sin(angle))
+        for kind, speeds in ((SUSTAINED, sustained), (GUST, gusts)):
+            speed = speeds[pair_sample]
+            along = np.round(speed * cos_a, 6)
+            np.maximum.at(result[:, kind, 0], pair_runway, np.maximum(along, 0))
+            np.maximum.at(result[:, kind, 1], pair_runway, np.maximum(-along, 0))
+            np.maximum.at(result[:, kind, 2], pair_runway, np.round(speed * sin_a, 6))
+            np.maximum.at(result[:, kind, 3], pair_runway, speed)
+    return np.split(result, np.cumsum(r_counts)[:-1])
+
+def get_max_wind_components(winds, rwy_true_heading):
+    # Compatibilita' con la vecchia firma: venti come coppie (direzione, intensita')
+    winds = [w if isinstance(w, Wind) else Wind(w[0], w[1]) for w in winds]
+    components = board_wind_components([(winds, [rwy_true_heading])])[0]
+    return tuple(float(v) for v in components[0, SUSTAINED])